@@ -0,0 +1,124 @@
+"""
+Cost of the chat of one video at 1, 100 and 1000 messages per second,
+sending every message on its own as before, and through the chat pipeline.
+
+Mongo and the socket.io server are replaced by in-memory stand-ins with a fixed
+round trip, so only the number of round trips and the latency they add are measured.
+
+    pdm run bench-chat
+"""
+import asyncio
+import time
+from datetime import datetime
+
+from bson import ObjectId
+
+from fliji_sockets.chat_pipeline import ChatPipeline, get_chat_message_payload
+from fliji_sockets.models.database import TimelineChatMessage
+from fliji_sockets.settings import CHAT_BATCH_INTERVAL
+
+RATES = (1, 100, 1000)
+DURATION = 3
+ROUND_TRIP = 0.002
+VIDEO_UUID = "9d2b6a97-d054-4c68-96ed-af0cb82b97db"
+
+
+class Collection:
+    def __init__(self):
+        self.writes = 0
+
+    async def insert_one(self, document: dict) -> None:
+        # like pymongo, the inserted documents get their _id
+        document["_id"] = ObjectId()
+        self.writes += 1
+        await asyncio.sleep(ROUND_TRIP)
+
+    async def insert_many(self, documents: list[dict]) -> None:
+        for document in documents:
+            document["_id"] = ObjectId()
+        self.writes += 1
+        await asyncio.sleep(ROUND_TRIP)
+
+
+class Database:
+    def __init__(self):
+        self.timeline_chat_messages = Collection()
+
+
+class Application:
+    def __init__(self):
+        self.emits = 0
+        self.latencies: list[float] = []
+
+    async def emit(self, event: str, data, room: str) -> None:
+        self.emits += 1
+        await asyncio.sleep(ROUND_TRIP)
+        messages = data if isinstance(data, list) else [data]
+        now = datetime.now()
+        self.latencies.extend(
+            (now - datetime.fromisoformat(message["created_at"])).total_seconds()
+            for message in messages
+        )
+
+
+def build_message() -> TimelineChatMessage:
+    return TimelineChatMessage(
+        video_uuid=VIDEO_UUID,
+        user_uuid="user_uuid",
+        username="username",
+        message="message",
+        created_at=datetime.now(),
+    )
+
+
+async def send_per_message(db: Database, app: Application, chat_message: TimelineChatMessage):
+    """What timeline_send_chat_message did before: one insert_one and one emit per message"""
+    await db.timeline_chat_messages.insert_one(chat_message.model_dump(exclude_none=True))
+    await app.emit("timeline_chat_message", get_chat_message_payload(chat_message), room=VIDEO_UUID)
+
+
+async def run(rate: int, pipelined: bool) -> str:
+    db = Database()
+    app = Application()
+    pipeline = ChatPipeline(CHAT_BATCH_INTERVAL)
+    handlers = set()
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for i in range(rate * DURATION):
+        # messages are sent at a steady rate
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        chat_message = build_message()
+        if pipelined:
+            pipeline.put(db, app, "sid", chat_message)
+        else:
+            task = asyncio.create_task(send_per_message(db, app, chat_message))
+            handlers.add(task)
+            task.add_done_callback(handlers.discard)
+
+    await asyncio.gather(*handlers)
+    while pipeline._tasks:
+        await asyncio.sleep(CHAT_BATCH_INTERVAL)
+    cpu = time.process_time() - cpu_started
+
+    latency = sum(app.latencies) / len(app.latencies)
+    return (
+        f"{db.timeline_chat_messages.writes / DURATION:7.1f} writes/s "
+        f"{app.emits / DURATION:7.1f} emits/s "
+        f"{latency * 1000:6.1f} ms mean latency "
+        f"{cpu / DURATION * 100:5.1f}% CPU"
+    )
+
+
+async def main():
+    for rate in RATES:
+        for pipelined in (False, True):
+            mode = "pipeline" if pipelined else "per message"
+            print(f"{rate:5} msg/s {mode:>12}: {await run(rate, pipelined)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
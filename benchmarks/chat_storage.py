@@ -0,0 +1,98 @@
+"""
+Writes and history reads of 1M chat messages, one document per message
+and in buckets (CHAT_STORAGE="buckets").
+
+Needs the Mongo server of the settings, the messages are written to a "<MONGO_DB>_bench"
+database which is dropped afterwards. The chat history cache is bypassed.
+
+    pdm run bench-chat-storage
+"""
+import asyncio
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fliji_sockets.settings import MONGO_DB
+from fliji_sockets.store import get_database, INDEXES, _push_chat_message_buckets, \
+    _find_chat_message_documents, _find_chat_message_buckets
+
+MESSAGES = 1_000_000
+VIDEOS = 10
+# messages written together, as the chat pipeline does for a busy video
+BATCH_SIZE = 10
+PAGE_SIZE = 50
+READS = 1000
+
+
+def build_batches() -> list[list[dict]]:
+    """Batches of messages sent one millisecond apart, videos interleaved"""
+    videos = [str(uuid.uuid4()) for _ in range(VIDEOS)]
+    started = datetime(2024, 1, 1)
+    batches = []
+    for i in range(0, MESSAGES, BATCH_SIZE):
+        video_uuid = videos[i // BATCH_SIZE % VIDEOS]
+        batches.append([
+            {
+                "id": f"{j:024x}",
+                "video_uuid": video_uuid,
+                "user_uuid": "user_uuid",
+                "username": "username",
+                "message": "message",
+                "created_at": started + timedelta(milliseconds=j),
+            }
+            for j in range(i, i + BATCH_SIZE)
+        ])
+    return batches
+
+
+async def write(db, batches: list[list[dict]], bucketed: bool) -> float:
+    started = time.perf_counter()
+    for batch in batches:
+        # the writes copy the messages, the batches are reused by both layouts
+        messages = [dict(message) for message in batch]
+        if bucketed:
+            await _push_chat_message_buckets(db, messages)
+        else:
+            await db.timeline_chat_messages.insert_many(messages)
+    return time.perf_counter() - started
+
+
+async def read(db, batches: list[list[dict]], bucketed: bool) -> float:
+    find = _find_chat_message_buckets if bucketed else _find_chat_message_documents
+    started = time.perf_counter()
+    for _ in range(READS):
+        # a page before a random message, as timeline_fetch_chat_messages reads
+        message = random.choice(random.choice(batches))
+        before = (message["created_at"], message["id"])
+        await find(db, message["video_uuid"], PAGE_SIZE + 1, before)
+    return time.perf_counter() - started
+
+
+async def main():
+    db = get_database().client[f"{MONGO_DB}_bench"]
+    for collection_name, indexes in INDEXES.items():
+        await db[collection_name].create_indexes(indexes)
+
+    batches = build_batches()
+    try:
+        for bucketed, collection_name in ((False, "timeline_chat_messages"),
+                                          (True, "timeline_chat_buckets")):
+            layout = "buckets" if bucketed else "messages"
+            write_seconds = await write(db, batches, bucketed)
+            read_seconds = await read(db, batches, bucketed)
+            stats = await db.command("collStats", collection_name)
+            print(
+                f"{layout:>8}: {MESSAGES / write_seconds:8.0f} messages/s written, "
+                f"{read_seconds / READS * 1000:6.2f} ms per page, "
+                f"{stats['count']} documents, "
+                f"{stats['size'] / 2 ** 20:.0f} MiB data, "
+                f"{stats['totalIndexSize'] / 2 ** 20:.0f} MiB indexes"
+            )
+    finally:
+        await db.client.drop_database(db.name)
+        await db.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
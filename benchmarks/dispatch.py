@@ -0,0 +1,158 @@
+"""
+Dispatch cost of `ping` and `timeline_update_timecode`, from the socket.io handler
+to the event handler, with the per-event binding SocketioApplication.event did before
+and with the invocation plans compiled at registration.
+
+The old path inspects the handler signature on every event, binds and applies the defaults,
+checks every annotation and inspects the signature of every dependency factory.
+The session store and the emits are in-memory stand-ins and the group of
+`timeline_update_timecode` is built in memory instead of being read from Mongo,
+so only the dispatch is measured.
+
+    pdm run bench-dispatch
+"""
+import asyncio
+import inspect
+import time
+from typing import Any
+
+from pydantic import BaseModel
+
+from fliji_sockets.core.di import Context, Depends, container, Scope
+from fliji_sockets.core.rate_limit import RateLimiter
+from fliji_sockets.core.socketio_application import SocketioApplication
+from fliji_sockets.events.handlers import ping
+from fliji_sockets.models.base import UserSioSession
+from fliji_sockets.models.database import TimelineGroup
+from fliji_sockets.models.socket import TimelineUpdateTimecodeRequest
+
+NUMBER = 20000
+SID = "sid"
+SESSION = UserSioSession(user_uuid="f4a1d9a4-7f0e-4b8b-9a52-3b1f6b2b7c1e", username="username")
+GROUP = TimelineGroup(
+    group_uuid="0c7e8f6e-5a8e-4c3b-8d7e-2f1e9d8c7b6a",
+    video_uuid="9d2b6a97-d054-4c68-96ed-af0cb82b97db",
+    host_user_uuid=SESSION.user_uuid,
+    users_count=1,
+)
+TIMECODE = {"timecode": 1500}
+
+
+class Application(SocketioApplication):
+    def __init__(self):
+        super().__init__()
+        # the benchmark sends many more events than a client may
+        self._rate_limiter = RateLimiter({})
+
+    async def get_session(self, sid) -> UserSioSession:
+        return SESSION
+
+    async def emit(self, event: str, data: Any, room: str | None = None,
+                   skip_sid: str | None = None) -> None:
+        pass
+
+
+async def get_group(context: Context) -> TimelineGroup:
+    await container.get("sio_session", context)
+    return GROUP
+
+
+async def timeline_update_timecode(
+        sid,
+        data: TimelineUpdateTimecodeRequest,
+        app: SocketioApplication = Depends("app"),
+        session: UserSioSession = Depends("sio_session"),
+        group: TimelineGroup = Depends("bench_timeline_group"),
+):
+    """Same dependencies as the handler, besides the database"""
+    group.watch_time = data.timecode
+
+
+async def legacy_get(key: str, context: Context) -> Any:
+    """DIContainer.get as it was: no request scope, the factory inspected on every call"""
+    factory = LEGACY_FACTORIES[key]
+    params = inspect.signature(factory).parameters
+    if len(params) == 1:
+        return await factory(context) if inspect.iscoroutinefunction(factory) else factory(context)
+    return await factory() if inspect.iscoroutinefunction(factory) else factory()
+
+
+async def legacy_get_sio_session(context: Context) -> UserSioSession:
+    return await context.app.get_session(context.sid)
+
+
+async def legacy_get_group(context: Context) -> TimelineGroup:
+    await legacy_get("sio_session", context)
+    return GROUP
+
+
+LEGACY_FACTORIES = {
+    "sio_session": legacy_get_sio_session,
+    "bench_timeline_group": legacy_get_group,
+}
+
+
+def legacy_event(app: SocketioApplication, func: Any):
+    """The wrapper of SocketioApplication.event as it was, without its debug logging"""
+
+    async def wrapper(sid: str, data=None):
+        sig = inspect.signature(func)
+
+        session = await app.get_session(sid)
+        if not session:
+            return
+
+        args_dict = {}
+        if "sid" in sig.parameters:
+            args_dict["sid"] = sid
+        if "data" in sig.parameters:
+            args_dict["data"] = data
+
+        bound = sig.bind_partial(**args_dict)
+        bound.apply_defaults()
+
+        for name, value in bound.arguments.items():
+            param = sig.parameters.get(name)
+            if param and issubclass(param.annotation, BaseModel) and "type" not in value:
+                if isinstance(data, str):
+                    bound.arguments[name] = param.annotation.model_validate_json(data)
+                else:
+                    bound.arguments[name] = param.annotation.model_validate(data)
+            elif isinstance(value, dict) and value.get("type") == "dependency":
+                if value["key"] == "app":
+                    bound.arguments[name] = app
+                else:
+                    bound.arguments[name] = await legacy_get(value["key"], Context(sid=sid, app=app))
+
+        await func(*bound.args, **bound.kwargs)
+
+    return wrapper
+
+
+async def measure(handler, data) -> float:
+    """Returns the microseconds per event"""
+    started = time.perf_counter()
+    for _ in range(NUMBER):
+        await handler(SID, data)
+    return (time.perf_counter() - started) / NUMBER * 1_000_000
+
+
+async def main():
+    app = Application()
+    container.register("bench_timeline_group", get_group, Scope.REQUEST, requires=("sio_session",))
+
+    for event_name, func, data in (
+            ("ping", ping, None),
+            ("timeline_update_timecode", timeline_update_timecode, TIMECODE),
+    ):
+        app.event(event_name)(func)
+        compiled = app.sio.handlers["/"][event_name]
+        legacy = legacy_event(app, func)
+
+        for path, handler in (("per-event binding", legacy), ("compiled plan", compiled)):
+            microseconds = await measure(handler, data)
+            print(f"{event_name} {path}: {microseconds:.1f} us per event")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
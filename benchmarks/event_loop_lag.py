@@ -0,0 +1,111 @@
+"""
+Event loop lag under concurrent handlers, with the blocking pymongo client
+the store used before and with the async client it uses now.
+
+Each simulated handler runs the reads of a timeline_connect: the watch session of the user,
+the single users of the video and the number of viewers. A monitor task measures
+how late the event loop wakes it up while the handlers run.
+
+Needs the Mongo server of the settings, the sessions are written to a "<MONGO_DB>_bench"
+database which is dropped afterwards.
+
+    pdm run bench-event-loop-lag
+"""
+import asyncio
+import statistics
+import time
+import uuid
+from datetime import datetime
+
+from pymongo import AsyncMongoClient, MongoClient
+
+from fliji_sockets.settings import MONGO_USER, MONGO_PASSWORD, MONGO_HOST, MONGO_PORT, MONGO_DB
+
+VIEWERS = 1000
+HANDLERS = 200
+MONITOR_INTERVAL = 0.001
+VIDEO_UUID = str(uuid.uuid4())
+CONNECTION_URL = f"mongodb://{MONGO_USER}:{MONGO_PASSWORD}@{MONGO_HOST}:{MONGO_PORT}"
+DATABASE = f"{MONGO_DB}_bench"
+
+
+def seed() -> list[str]:
+    client = MongoClient(CONNECTION_URL)
+    sessions = client[DATABASE].timeline_watch_sessions
+    user_uuids = [str(uuid.uuid4()) for _ in range(VIEWERS)]
+    sessions.insert_many([
+        {
+            "user_uuid": user_uuid,
+            "video_uuid": VIDEO_UUID,
+            "sid": user_uuid,
+            "group_uuid": None,
+            "mic_enabled": False,
+            "created_at": datetime.now(),
+            "last_update_time": datetime.now(),
+        }
+        for user_uuid in user_uuids
+    ])
+    sessions.create_index([("user_uuid", 1), ("video_uuid", 1)])
+    sessions.create_index([("video_uuid", 1), ("group_uuid", 1), ("last_update_time", 1)])
+    client.close()
+    return user_uuids
+
+
+async def blocking_handler(db, user_uuid: str) -> None:
+    """The store functions before: declared async, calling the synchronous client"""
+    db.timeline_watch_sessions.find_one({"user_uuid": user_uuid})
+    list(db.timeline_watch_sessions.find({"video_uuid": VIDEO_UUID, "group_uuid": None}))
+    db.timeline_watch_sessions.count_documents({"video_uuid": VIDEO_UUID})
+
+
+async def async_handler(db, user_uuid: str) -> None:
+    await db.timeline_watch_sessions.find_one({"user_uuid": user_uuid})
+    await db.timeline_watch_sessions.find({"video_uuid": VIDEO_UUID, "group_uuid": None}).to_list()
+    await db.timeline_watch_sessions.count_documents({"video_uuid": VIDEO_UUID})
+
+
+async def monitor(lags: list[float], stop: asyncio.Event) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(MONITOR_INTERVAL)
+        lags.append(loop.time() - started - MONITOR_INTERVAL)
+
+
+async def run(handler, db, user_uuids: list[str]) -> str:
+    lags = []
+    stop = asyncio.Event()
+    monitor_task = asyncio.create_task(monitor(lags, stop))
+    # the monitor is sleeping before the handlers start
+    await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(db, user_uuid) for user_uuid in user_uuids[:HANDLERS]))
+    seconds = time.perf_counter() - started
+    stop.set()
+    await monitor_task
+
+    lags.sort()
+    return (
+        f"{HANDLERS / seconds:7.0f} handlers/s, "
+        f"lag mean {statistics.mean(lags) * 1000:7.2f} ms, "
+        f"p99 {lags[int(len(lags) * 0.99)] * 1000:7.2f} ms, "
+        f"max {lags[-1] * 1000:7.2f} ms"
+    )
+
+
+async def main():
+    user_uuids = seed()
+    sync_client = MongoClient(CONNECTION_URL)
+    async_client = AsyncMongoClient(CONNECTION_URL)
+    try:
+        print(f"  blocking client: {await run(blocking_handler, sync_client[DATABASE], user_uuids)}")
+        print(f"     async client: {await run(async_handler, async_client[DATABASE], user_uuids)}")
+    finally:
+        sync_client.drop_database(DATABASE)
+        sync_client.close()
+        await async_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""
+Serialization cost of a `timeline_groups` listing of 1k users,
+emitted to several rooms as in schedule_timeline_groups_broadcast.
+
+    pdm run bench-serialization
+"""
+import json
+import timeit
+import uuid
+from datetime import datetime
+
+from fliji_sockets.core import serialization
+from fliji_sockets.core.serialization import encode_payload
+from fliji_sockets.models.socket import TimelineGroupResponse
+
+USERS = 1000
+GROUP_SIZE = 4
+EMITS = 3
+NUMBER = 20
+
+
+def build_response() -> TimelineGroupResponse:
+    groups = []
+    for _ in range(USERS // GROUP_SIZE):
+        users = [
+            {
+                "user_uuid": str(uuid.uuid4()),
+                "username": "username",
+                "first_name": "First",
+                "last_name": "Last",
+                "agora_id": 123456789,
+                "mic_enabled": False,
+                "avatar": "https://cdn.example.com/avatars/avatar.jpg",
+                "avatar_thumbnail": "https://cdn.example.com/avatars/avatar_thumbnail.jpg",
+                "bio": "bio",
+                "is_host": i == 0,
+                "last_update_time": datetime.now(),
+            }
+            for i in range(GROUP_SIZE)
+        ]
+        groups.append({
+            "group_uuid": str(uuid.uuid4()),
+            "host_user_uuid": users[0]["user_uuid"],
+            "on_pause": False,
+            "users_count": GROUP_SIZE,
+            "watch_time": 1500,
+            "users": users,
+        })
+    return TimelineGroupResponse(root=groups)
+
+
+def model_dump_per_emit(response: TimelineGroupResponse) -> None:
+    """What SocketioApplication.emit did before: a dict per emit, dumped with the json module"""
+    for _ in range(EMITS):
+        json.dumps(["timeline_groups", response.model_dump(mode="json")], separators=(",", ":"))
+
+
+def encoded_once(response: TimelineGroupResponse) -> None:
+    payload = encode_payload(response)
+    for _ in range(EMITS):
+        serialization.dumps(["timeline_groups", payload])
+
+
+def main():
+    response = build_response()
+    for benchmark in (model_dump_per_emit, encoded_once):
+        seconds = timeit.timeit(lambda: benchmark(response), number=NUMBER) / NUMBER
+        print(f"{benchmark.__name__}: {seconds * 1000:.2f} ms for {EMITS} emits of {USERS} users")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Reads of the `timeline_groups` listing of a video with 100, 1k and 10k viewers in groups of
+GROUP_SIZE, joined in Python from two queries as before and joined by Mongo with the $lookup pipeline.
+
+Needs the Mongo server of the settings, the groups are written to a "<MONGO_DB>_bench"
+database which is dropped afterwards. The groups cache is bypassed.
+
+    pdm run bench-timeline-groups
+"""
+import asyncio
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fliji_sockets.cache import build_timeline_groups
+from fliji_sockets.settings import MONGO_DB
+from fliji_sockets.store import get_database, INDEXES, _timeline_groups_pipeline
+
+VIEWERS = (100, 1000, 10_000)
+GROUP_SIZE = 4
+READS = 20
+
+
+def build_video(viewers: int) -> tuple[str, list[dict], list[dict]]:
+    video_uuid = str(uuid.uuid4())
+    started = datetime(2024, 1, 1)
+    groups = []
+    sessions = []
+    for i in range(viewers // GROUP_SIZE):
+        group_uuid = str(uuid.uuid4())
+        user_uuids = [str(uuid.uuid4()) for _ in range(GROUP_SIZE)]
+        groups.append({
+            "group_uuid": group_uuid,
+            "video_uuid": video_uuid,
+            "host_user_uuid": user_uuids[0],
+            "users_count": GROUP_SIZE,
+            "on_pause": False,
+            "watch_time": 1500,
+            "created_at": started + timedelta(seconds=i),
+        })
+        sessions.extend(
+            {
+                "user_uuid": user_uuid,
+                "video_uuid": video_uuid,
+                "group_uuid": group_uuid,
+                "sid": user_uuid,
+                "username": "username",
+                "first_name": "First",
+                "last_name": "Last",
+                "agora_id": 123456789,
+                "mic_enabled": False,
+                "avatar": "https://cdn.example.com/avatars/avatar.jpg",
+                "avatar_thumbnail": "https://cdn.example.com/avatars/avatar_thumbnail.jpg",
+                "bio": "bio",
+                "created_at": started + timedelta(seconds=i),
+                "last_update_time": started + timedelta(seconds=i, milliseconds=j),
+            }
+            for j, user_uuid in enumerate(user_uuids)
+        )
+    return video_uuid, groups, sessions
+
+
+async def python_join(db, video_uuid: str) -> list[dict]:
+    """What get_timeline_groups did before"""
+    users, groups = await asyncio.gather(
+        db.timeline_watch_sessions.find(
+            {"video_uuid": video_uuid, "group_uuid": {"$ne": None}}
+        ).sort("last_update_time").to_list(),
+        db.timeline_groups.find({"video_uuid": video_uuid}).to_list(),
+    )
+    return build_timeline_groups(groups, users)
+
+
+async def lookup_join(db, video_uuid: str) -> list[dict]:
+    return await (
+        await db.timeline_groups.aggregate(_timeline_groups_pipeline({"video_uuid": video_uuid}))
+    ).to_list()
+
+
+async def measure(join, db, video_uuid: str) -> float:
+    """Returns the milliseconds per listing"""
+    started = time.perf_counter()
+    for _ in range(READS):
+        await join(db, video_uuid)
+    return (time.perf_counter() - started) / READS * 1000
+
+
+async def main():
+    db = get_database().client[f"{MONGO_DB}_bench"]
+    for collection_name, indexes in INDEXES.items():
+        await db[collection_name].create_indexes(indexes)
+
+    try:
+        for viewers in VIEWERS:
+            video_uuid, groups, sessions = build_video(viewers)
+            await db.timeline_groups.insert_many(groups)
+            await db.timeline_watch_sessions.insert_many(sessions)
+
+            for join in (python_join, lookup_join):
+                milliseconds = await measure(join, db, video_uuid)
+                print(
+                    f"{viewers:>6} viewers, {join.__name__:>11}: "
+                    f"{milliseconds:8.2f} ms per listing"
+                )
+    finally:
+        await db.client.drop_database(db.name)
+        await db.client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+"""
+Copies the chat messages of `timeline_chat_messages` into `timeline_chat_buckets`.
+
+Run it before setting CHAT_STORAGE to "buckets": running it again rebuilds the buckets
+from `timeline_chat_messages`, the messages written since the switch would be lost.
+
+    pdm run backfill-chat-buckets
+"""
+import asyncio
+import logging
+
+from fliji_sockets.helpers import configure_logging
+from fliji_sockets.store import get_database, ensure_indexes, backfill_timeline_chat_buckets
+
+
+async def main():
+    db = get_database()
+    await ensure_indexes(db)
+
+    copied = await backfill_timeline_chat_buckets(db)
+    logging.info(f"Copied {copied} chat messages into buckets")
+
+    await db.client.close()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    asyncio.run(main())
@@ -0,0 +1,544 @@
+import bisect
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any
+
+from fliji_sockets.core.serialization import EncodedPayload, encode_payload
+from fliji_sockets.models.socket import TimelineGroupResponse, TimelineGroupDataResponse, \
+    TimelineGroupsViewportResponse
+from fliji_sockets.settings import TIMELINE_CACHE_TTL, CHAT_HISTORY_CACHE_SIZE, \
+    CHAT_HISTORY_CACHE_TTL
+
+
+class _VideoLoads:
+    """
+    Mutation counters of the videos being read from Mongo right now,
+    so that a load that raced with a local write is not cached.
+    """
+
+    def __init__(self):
+        self._generations: dict[str, int] = {}
+        self._loading: dict[str, int] = {}
+
+    def begin(self, video_uuid: str) -> int:
+        self._loading[video_uuid] = self._loading.get(video_uuid, 0) + 1
+        return self._generations.setdefault(video_uuid, 0)
+
+    def end(self, video_uuid: str, generation: int) -> bool:
+        current = self._generations.get(video_uuid, 0)
+
+        self._loading[video_uuid] -= 1
+        if self._loading[video_uuid] == 0:
+            del self._loading[video_uuid]
+            del self._generations[video_uuid]
+
+        return current == generation
+
+    def touch(self, video_uuid: str) -> None:
+        if video_uuid in self._generations:
+            self._generations[video_uuid] += 1
+
+    def touch_all(self) -> None:
+        for video_uuid in self._generations:
+            self._generations[video_uuid] += 1
+
+
+class _VideoGroups:
+    """Groups and grouped watch sessions of a single video"""
+    __slots__ = ("groups", "users", "loaded_at", "response", "payload", "orders")
+
+    def __init__(self, loaded_at: float):
+        self.groups: dict[str, dict] = {}
+        self.users: dict[str, dict] = {}
+        self.loaded_at = loaded_at
+        self.response: TimelineGroupResponse | None = None
+        # the response encoded once for all the emits
+        self.payload: EncodedPayload | None = None
+        # the groups of the response in each viewport sort
+        self.orders: dict[str, _GroupsOrder] = {}
+
+    def reset_response(self) -> None:
+        """Called on every change of the video"""
+        self.response = None
+        self.payload = None
+        self.orders = {}
+
+
+class TimelineGroupsCache:
+    """
+    In-memory view of the timeline groups of each video.
+
+    Mongo stays the source of truth: a video is loaded from it on the first read
+    and then kept up to date from the mutations done through the store.
+    Other nodes write to Mongo without going through this cache, so every video
+    is reloaded after ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._videos: dict[str, _VideoGroups] = {}
+        self._user_videos: dict[str, str] = {}
+        self._group_videos: dict[str, str] = {}
+        self._loads = _VideoLoads()
+
+    def _get_video(self, video_uuid: str) -> _VideoGroups | None:
+        video = self._videos.get(video_uuid)
+        if video is None:
+            return None
+
+        if time.monotonic() - video.loaded_at > self._ttl:
+            self._drop_video(video_uuid)
+            return None
+
+        return video
+
+    def _drop_video(self, video_uuid: str) -> None:
+        video = self._videos.pop(video_uuid, None)
+        if video is None:
+            return
+
+        for user_uuid in video.users:
+            self._user_videos.pop(user_uuid, None)
+        for group_uuid in video.groups:
+            self._group_videos.pop(group_uuid, None)
+
+    def begin_load(self, video_uuid: str) -> int:
+        """Must be called before reading a video from Mongo, returns the generation to pass to end_load"""
+        return self._loads.begin(video_uuid)
+
+    def end_load(self, video_uuid: str, generation: int) -> bool:
+        """Returns False if the video was written to while it was being read"""
+        return self._loads.end(video_uuid, generation)
+
+    def load(self, video_uuid: str, groups: list[dict], users: list[dict]) -> None:
+        """Store the groups and users read from Mongo"""
+        now = time.monotonic()
+        # videos nobody reads anymore are only dropped here
+        for expired_video_uuid in [
+            cached_video_uuid for cached_video_uuid, video in self._videos.items()
+            if now - video.loaded_at > self._ttl
+        ]:
+            self._drop_video(expired_video_uuid)
+
+        self._drop_video(video_uuid)
+        video = _VideoGroups(now)
+        for group in groups:
+            video.groups[group["group_uuid"]] = group
+            self._group_videos[group["group_uuid"]] = video_uuid
+        for user in users:
+            video.users[user["user_uuid"]] = user
+            self._user_videos[user["user_uuid"]] = video_uuid
+
+        self._videos[video_uuid] = video
+
+    def get_response(self, video_uuid: str) -> TimelineGroupResponse | None:
+        """Returns the `timeline_groups` payload, or None if the video is not loaded"""
+        video = self._get_video(video_uuid)
+        if video is None:
+            return None
+
+        if video.response is None:
+            video.response = TimelineGroupResponse(
+                root=build_timeline_groups(list(video.groups.values()), list(video.users.values()))
+            )
+
+        return video.response
+
+    def get_payload(self, video_uuid: str) -> EncodedPayload | None:
+        """Same as get_response, encoded for the wire"""
+        response = self.get_response(video_uuid)
+        if response is None:
+            return None
+
+        video = self._videos[video_uuid]
+        if video.payload is None:
+            video.payload = encode_payload(response)
+        return video.payload
+
+    def get_order(self, video_uuid: str, sort: str) -> "_GroupsOrder | None":
+        """
+        Returns the groups of the `timeline_groups` payload in the given sort, to be paged,
+        or None if the video is not loaded.
+        """
+        response = self.get_response(video_uuid)
+        if response is None:
+            return None
+
+        video = self._videos[video_uuid]
+        order = video.orders.get(sort)
+        if order is None:
+            order = video.orders[sort] = build_groups_order(
+                sort, list(video.groups.values()), response
+            )
+        return order
+
+    def upsert_group(self, group: dict[str, Any]) -> None:
+        self._loads.touch(group["video_uuid"])
+        video = self._get_video(group["video_uuid"])
+        if video is None:
+            return
+
+        cached_group = video.groups.get(group["group_uuid"])
+        if cached_group is None:
+            video.groups[group["group_uuid"]] = group
+            self._group_videos[group["group_uuid"]] = group["video_uuid"]
+        else:
+            # same semantics as the $set in the store
+            cached_group.update(group)
+        video.reset_response()
+
+    def update_group(self, video_uuid: str, group_uuid: str, fields: dict[str, Any]) -> None:
+        """Same as the $set of some fields in the store, does nothing if the group isn't cached"""
+        self._loads.touch(video_uuid)
+        video = self._get_video(video_uuid)
+        if video is None:
+            return
+
+        cached_group = video.groups.get(group_uuid)
+        if cached_group is None:
+            # the partial document can't be listed, the next load reads the whole group
+            return
+
+        cached_group.update(fields)
+        video.reset_response()
+
+    def delete_group(self, video_uuid: str, group_uuid: str) -> None:
+        self._loads.touch(video_uuid)
+        self._group_videos.pop(group_uuid, None)
+        video = self._get_video(video_uuid)
+        if video is None:
+            return
+
+        video.groups.pop(group_uuid, None)
+        video.reset_response()
+
+    def upsert_watch_session(self, watch_session: dict[str, Any]) -> None:
+        self._loads.touch(watch_session["video_uuid"])
+        user_uuid = watch_session["user_uuid"]
+
+        old_video_uuid = self._user_videos.get(user_uuid)
+        if old_video_uuid is not None and old_video_uuid != watch_session["video_uuid"]:
+            self.delete_watch_session(old_video_uuid, user_uuid)
+
+        video = self._get_video(watch_session["video_uuid"])
+        if video is None:
+            return
+
+        if watch_session.get("group_uuid") is None:
+            # only grouped users are part of the listing
+            video.users.pop(user_uuid, None)
+            self._user_videos.pop(user_uuid, None)
+        else:
+            video.users[user_uuid] = watch_session
+            self._user_videos[user_uuid] = watch_session["video_uuid"]
+        video.reset_response()
+
+    def delete_watch_session(self, video_uuid: str, user_uuid: str) -> None:
+        self._loads.touch(video_uuid)
+        self._user_videos.pop(user_uuid, None)
+        video = self._get_video(video_uuid)
+        if video is None:
+            return
+
+        video.users.pop(user_uuid, None)
+        video.reset_response()
+
+    def clear(self) -> None:
+        self._loads.touch_all()
+        self._videos.clear()
+        self._user_videos.clear()
+        self._group_videos.clear()
+
+
+class _VideoChat:
+    """Most recent chat messages of a single video, oldest first"""
+    __slots__ = ("messages", "complete", "loaded_at")
+
+    def __init__(self, messages: deque, complete: bool, loaded_at: float):
+        self.messages = messages
+        # True if the buffer holds every message of the video
+        self.complete = complete
+        self.loaded_at = loaded_at
+
+
+class ChatHistoryCache:
+    """
+    Ring buffer of the ``size`` most recent chat messages of each video.
+
+    Messages sent through this node are appended as they are inserted,
+    the ones sent through other nodes are picked up when the video
+    is reloaded after ``ttl`` seconds.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self._ttl = ttl
+        self._videos: dict[str, _VideoChat] = {}
+        self._loads = _VideoLoads()
+
+    def _get_video(self, video_uuid: str) -> _VideoChat | None:
+        video = self._videos.get(video_uuid)
+        if video is None:
+            return None
+
+        if time.monotonic() - video.loaded_at > self._ttl:
+            del self._videos[video_uuid]
+            return None
+
+        return video
+
+    def begin_load(self, video_uuid: str) -> int:
+        """Must be called before reading a video from Mongo, returns the generation to pass to end_load"""
+        return self._loads.begin(video_uuid)
+
+    def end_load(self, video_uuid: str, generation: int) -> bool:
+        """Returns False if a message was inserted while the video was being read"""
+        return self._loads.end(video_uuid, generation)
+
+    def load(self, video_uuid: str, messages: list[dict]) -> None:
+        """Store the latest ``size`` messages read from Mongo, oldest first"""
+        now = time.monotonic()
+        for expired_video_uuid in [
+            cached_video_uuid for cached_video_uuid, video in self._videos.items()
+            if now - video.loaded_at > self._ttl
+        ]:
+            del self._videos[expired_video_uuid]
+
+        self._videos[video_uuid] = _VideoChat(
+            deque(messages, maxlen=self.size),
+            complete=len(messages) < self.size,
+            loaded_at=now,
+        )
+
+    def get_page(self, video_uuid: str, limit: int,
+                 before: tuple[datetime, str] | None = None) -> tuple[list[dict], bool] | None:
+        """
+        Returns the ``limit`` latest messages sent before the (created_at, id) cursor, oldest first,
+        and whether there are older ones.
+        Returns None if the buffer doesn't hold the whole page.
+        """
+        video = self._get_video(video_uuid)
+        if video is None:
+            return None
+
+        if before is None:
+            messages = list(video.messages)
+        else:
+            messages = [
+                message for message in video.messages
+                if (message["created_at"], message["id"]) < before
+            ]
+
+        if len(messages) > limit:
+            return messages[-limit:], True
+        if video.complete:
+            return messages, False
+        return None
+
+    def append(self, message: dict[str, Any]) -> None:
+        self._loads.touch(message["video_uuid"])
+        video = self._get_video(message["video_uuid"])
+        if video is None:
+            return
+
+        if len(video.messages) == self.size:
+            # the oldest message is dropped
+            video.complete = False
+        video.messages.append(message)
+
+    def clear(self) -> None:
+        self._loads.touch_all()
+        self._videos.clear()
+
+
+# viewers shown in the `timeline_user_avatars` strip, the first ones to join the video
+AVATAR_STRIP_SIZE = 6
+
+
+class _VideoAvatars:
+    __slots__ = ("avatars", "complete", "loaded_at")
+
+    def __init__(self, avatars: list[dict], loaded_at: float):
+        self.avatars = avatars
+        # True if the video has no viewers beyond the strip
+        self.complete = len(avatars) < AVATAR_STRIP_SIZE
+        self.loaded_at = loaded_at
+
+
+class AvatarStripCache:
+    """
+    The first AVATAR_STRIP_SIZE watch sessions of each video by created_at.
+
+    Kept up to date from the sessions created and deleted through the store,
+    a video is only read again from Mongo once a full strip loses a viewer
+    (the next one is unknown) or after ``ttl`` seconds.
+    """
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._videos: dict[str, _VideoAvatars] = {}
+        self._loads = _VideoLoads()
+
+    def _get_video(self, video_uuid: str) -> _VideoAvatars | None:
+        video = self._videos.get(video_uuid)
+        if video is None:
+            return None
+
+        if time.monotonic() - video.loaded_at > self._ttl:
+            del self._videos[video_uuid]
+            return None
+
+        return video
+
+    def begin_load(self, video_uuid: str) -> int:
+        """Must be called before reading a video from Mongo, returns the generation to pass to end_load"""
+        return self._loads.begin(video_uuid)
+
+    def end_load(self, video_uuid: str, generation: int) -> bool:
+        """Returns False if a session was created or deleted while the video was being read"""
+        return self._loads.end(video_uuid, generation)
+
+    def load(self, video_uuid: str, avatars: list[dict]) -> None:
+        """Store the first watch sessions read from Mongo, ordered by created_at"""
+        now = time.monotonic()
+        for expired_video_uuid in [
+            cached_video_uuid for cached_video_uuid, video in self._videos.items()
+            if now - video.loaded_at > self._ttl
+        ]:
+            del self._videos[expired_video_uuid]
+
+        self._videos[video_uuid] = _VideoAvatars(avatars[:AVATAR_STRIP_SIZE], now)
+
+    def get(self, video_uuid: str) -> list[dict] | None:
+        video = self._get_video(video_uuid)
+        return video.avatars if video is not None else None
+
+    def add(self, watch_session: dict[str, Any]) -> None:
+        self._loads.touch(watch_session["video_uuid"])
+        video = self._get_video(watch_session["video_uuid"])
+        if video is None:
+            return
+
+        avatars = [
+            avatar for avatar in video.avatars if avatar["user_uuid"] != watch_session["user_uuid"]
+        ]
+        avatars.append(watch_session)
+        avatars.sort(key=lambda avatar: avatar["created_at"])
+        if len(avatars) > AVATAR_STRIP_SIZE:
+            video.complete = False
+        video.avatars = avatars[:AVATAR_STRIP_SIZE]
+
+    def remove(self, video_uuid: str, user_uuid: str) -> None:
+        self._loads.touch(video_uuid)
+        video = self._get_video(video_uuid)
+        if video is None:
+            return
+
+        avatars = [avatar for avatar in video.avatars if avatar["user_uuid"] != user_uuid]
+        if len(avatars) == len(video.avatars):
+            return
+
+        if video.complete:
+            video.avatars = avatars
+        else:
+            # the viewer taking the free place is only known to Mongo
+            del self._videos[video_uuid]
+
+    def clear(self) -> None:
+        self._loads.touch_all()
+        self._videos.clear()
+
+
+def build_timeline_groups(groups: list[dict], users: list[dict]) -> list[dict]:
+    """
+    Joins the groups of a video with their users.
+    Users are sorted by last_update_time and flagged with is_host.
+    """
+    # if either groups or users is empty, return empty list
+    if len(groups) == 0 or len(users) == 0:
+        return []
+
+    groups_dict = {}
+    for group in groups:
+        groups_dict[group["group_uuid"]] = {**group, "users": []}
+
+    for user in sorted(users, key=lambda u: u["last_update_time"]):
+        group = groups_dict.get(user.get("group_uuid"))
+        if group is None:
+            continue
+
+        group["users"].append({
+            **user,
+            "is_host": user.get("user_uuid") == group.get("host_user_uuid"),
+        })
+
+    return list(groups_dict.values())
+
+
+# sorts of the groups viewports
+GROUPS_SORTS = ("size", "recency")
+
+
+def _groups_sort_key(sort: str, group: dict) -> tuple[float, str]:
+    if sort == "size":
+        # most users first
+        return -group["users_count"], group["group_uuid"]
+
+    # newest first, groups created before created_at was stored last
+    created_at = group.get("created_at")
+    return -created_at.timestamp() if created_at is not None else 0.0, group["group_uuid"]
+
+
+class _GroupsOrder:
+    """The groups of a `timeline_groups` payload in a viewport sort, paged by sort key"""
+    __slots__ = ("sort", "keys", "groups")
+
+    def __init__(self, sort: str, keys: list[tuple[float, str]],
+                 groups: list[TimelineGroupDataResponse]):
+        self.sort = sort
+        self.keys = keys
+        self.groups = groups
+
+    def get_page(self, video_uuid: str, limit: int,
+                 cursor: str | None = None) -> TimelineGroupsViewportResponse:
+        start = 0
+        if cursor is not None:
+            # the cursor is the sort key of the last group of the previous page
+            sort_value, _, group_uuid = cursor.partition(":")
+            start = bisect.bisect_right(self.keys, (float(sort_value), group_uuid))
+
+        end = start + limit
+        next_cursor = None
+        if end < len(self.keys):
+            sort_value, group_uuid = self.keys[end - 1]
+            next_cursor = f"{sort_value}:{group_uuid}"
+
+        return TimelineGroupsViewportResponse(
+            video_uuid=video_uuid,
+            sort=self.sort,
+            cursor=cursor,
+            next_cursor=next_cursor,
+            total=len(self.keys),
+            groups=self.groups[start:end],
+        )
+
+
+def build_groups_order(sort: str, groups: list[dict],
+                       response: TimelineGroupResponse) -> _GroupsOrder:
+    """Orders the groups of the response by the given sort, the keys are read from the group documents"""
+    response_groups = {group.group_uuid: group for group in response.root}
+    ordered = sorted(
+        (_groups_sort_key(sort, group), group["group_uuid"])
+        for group in groups if group["group_uuid"] in response_groups
+    )
+    return _GroupsOrder(
+        sort,
+        [key for key, _ in ordered],
+        [response_groups[group_uuid] for _, group_uuid in ordered],
+    )
+
+
+timeline_groups_cache = TimelineGroupsCache(TIMELINE_CACHE_TTL)
+avatar_strip_cache = AvatarStripCache(TIMELINE_CACHE_TTL)
+chat_history_cache = ChatHistoryCache(CHAT_HISTORY_CACHE_SIZE, CHAT_HISTORY_CACHE_TTL)
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+
+from pymongo.asynchronous.database import AsyncDatabase
+
+from fliji_sockets.core.socketio_application import SocketioApplication
+from fliji_sockets.helpers import get_room_name
+from fliji_sockets.models.database import TimelineChatMessage
+from fliji_sockets.settings import CHAT_BATCH_INTERVAL
+from fliji_sockets.store import insert_timeline_chat_messages
+
+
+def get_chat_message_payload(chat_message: TimelineChatMessage) -> dict:
+    return {
+        "id": str(chat_message.id),
+        "user_uuid": chat_message.user_uuid,
+        "message": chat_message.message,
+        "username": chat_message.username,
+        "user_avatar": chat_message.user_avatar,
+        "first_name": chat_message.first_name,
+        "last_name": chat_message.last_name,
+        "created_at": chat_message.created_at.isoformat(),
+    }
+
+
+class ChatPipeline:
+    """
+    Writes and broadcasts the chat messages of each video in micro-batches.
+
+    A message sent to a quiet video is written and emitted right away, as `timeline_chat_message`.
+    The messages sent during the following ``interval`` seconds are queued, then written
+    with a single insert_many and emitted together as one `timeline_chat_messages` list,
+    so a busy video costs at most one write and one emit per interval.
+    If a write fails, its senders get an `err` with their messages, which are not emitted.
+    """
+
+    def __init__(self, interval: float):
+        self._interval = interval
+        # queued (sender sid, message) of each video
+        self._pending: dict[str, list[tuple[str, TimelineChatMessage]]] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._db: AsyncDatabase | None = None
+        self._app: SocketioApplication | None = None
+
+    def put(self, db: AsyncDatabase, app: SocketioApplication, sid: str,
+            chat_message: TimelineChatMessage) -> None:
+        self._db = db
+        self._app = app
+        video_uuid = chat_message.video_uuid
+        self._pending.setdefault(video_uuid, []).append((sid, chat_message))
+
+        if video_uuid not in self._tasks:
+            self._tasks[video_uuid] = asyncio.create_task(self._flush_video_later(video_uuid))
+
+    async def _flush_video_later(self, video_uuid: str) -> None:
+        try:
+            while video_uuid in self._pending:
+                await self._flush_video(video_uuid)
+                await asyncio.sleep(self._interval)
+        finally:
+            del self._tasks[video_uuid]
+
+    async def _flush_video(self, video_uuid: str) -> None:
+        # flush() and the task of the video may both get here, the first one takes the messages
+        pending = self._pending.pop(video_uuid, None)
+        if not pending:
+            return
+
+        chat_messages = [chat_message for _, chat_message in pending]
+        try:
+            await insert_timeline_chat_messages(self._db, chat_messages)
+        except Exception as e:
+            logging.error(f"Error writing {len(chat_messages)} chat messages of {video_uuid}: {e}")
+            await self._report_failure(pending)
+            return
+
+        room = get_room_name(video_uuid)
+        try:
+            if len(chat_messages) == 1:
+                await self._app.emit(
+                    "timeline_chat_message", get_chat_message_payload(chat_messages[0]), room=room
+                )
+            else:
+                await self._app.emit(
+                    "timeline_chat_messages",
+                    [get_chat_message_payload(chat_message) for chat_message in chat_messages],
+                    room=room,
+                )
+        except Exception as e:
+            logging.error(f"Error emitting {len(chat_messages)} chat messages to {room}: {e}")
+
+    async def _report_failure(self, pending: list[tuple[str, TimelineChatMessage]]) -> None:
+        messages_by_sid: dict[str, list[str]] = {}
+        for sid, chat_message in pending:
+            messages_by_sid.setdefault(sid, []).append(chat_message.message)
+
+        for sid, messages in messages_by_sid.items():
+            try:
+                await self._app.send_error_message(
+                    sid, "Chat message could not be sent.", {"messages": messages}
+                )
+            except Exception as e:
+                logging.error(f"Error reporting unsent chat messages to {sid}: {e}")
+
+    async def flush(self) -> None:
+        """Writes and emits the queued messages of every video, waits for the writes in progress"""
+        for video_uuid in list(self._pending):
+            await self._flush_video(video_uuid)
+
+        # the tasks stop after their current write, nothing is queued anymore
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+
+chat_pipeline = ChatPipeline(CHAT_BATCH_INTERVAL)
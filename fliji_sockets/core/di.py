@@ -1,25 +1,56 @@
+import asyncio
 import inspect
-from dataclasses import dataclass
-from typing import Any, Dict, Callable, TypeVar
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict, Callable, TypeVar, Iterable
 
 T = TypeVar('T')
 
 
+class Scope(Enum):
+    # created once and shared by every event
+    SINGLETON = "singleton"
+    # created once per event and shared by the handler and the other dependencies
+    REQUEST = "request"
+    # created every time it is requested
+    TRANSIENT = "transient"
+
+
 @dataclass
 class Context:
     sid: str
     # noinspection PyUnresolvedReferences
     app: 'SocketioApplication'
+    # instances of the request scoped dependencies of the current event
+    cache: Dict[str, Any] = field(default_factory=dict)
+    # request scoped dependencies being created right now
+    resolving: Dict[str, asyncio.Future] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class _Factory:
+    func: Callable[..., Any]
+    takes_context: bool
+    is_async: bool
+    scope: Scope
+    requires: tuple[str, ...]
 
 
 class DIContainer:
     def __init__(self):
-        self._dependencies: Dict[str, Callable[..., T]] = {}
+        self._dependencies: Dict[str, _Factory] = {}
         self._instances: Dict[str, Any] = {}
-        self._no_cache_keys = {"sio_session", "timeline_session", "timeline_group"}  # Always recreate
+        # singletons being created right now
+        self._resolving: Dict[str, asyncio.Future] = {}
+
+    def register(self, key: str, factory: Callable[..., T],
+                 scope: Scope = Scope.SINGLETON, requires: Iterable[str] = ()) -> None:
+        """
+        Register a dependency factory function, allowing optional 'context'.
 
-    def register(self, key: str, factory: Callable[..., T]) -> None:
-        """Register a dependency factory function, allowing optional 'context'."""
+        `requires` lists the dependencies the factory gets from the container,
+        they are resolved concurrently before the factory is called.
+        """
         sig = inspect.signature(factory)
         params = list(sig.parameters.values())
 
@@ -29,35 +60,107 @@ class DIContainer:
                 f"Factory function for '{key}' must accept zero or one argument of type 'Context'."
             )
 
-        self._dependencies[key] = factory
+        # inspected once here, so that get() doesn't need to
+        previous = self._dependencies.get(key)
+        self._dependencies[key] = _Factory(
+            func=factory,
+            takes_context=len(params) == 1,
+            is_async=inspect.iscoroutinefunction(factory),
+            scope=scope,
+            requires=tuple(requires),
+        )
+        try:
+            self._check_cycles(key, [])
+        except TypeError:
+            # a rejected registration leaves the container as it was
+            if previous is None:
+                del self._dependencies[key]
+            else:
+                self._dependencies[key] = previous
+            raise
+
+    def _check_cycles(self, key: str, path: list[str]) -> None:
+        """A cycle would make the concurrent resolution wait on itself forever"""
+        if key in path:
+            raise TypeError(f"Dependency cycle: {' -> '.join(path + [key])}")
+
+        factory = self._dependencies.get(key)
+        if factory is None:
+            return
+
+        for required_key in factory.requires:
+            self._check_cycles(required_key, path + [key])
 
     async def get(self, key: str, context: Context | None = None) -> Any:
         """Get or create an instance of a dependency, passing context if required"""
-
-        # If the dependency is in the no-cache list, always create a new instance
-        if key not in self._no_cache_keys and key in self._instances:
+        if key in self._instances:
             return self._instances[key]
 
+        if context is not None and key in context.cache:
+            return context.cache[key]
+
         factory = self._dependencies.get(key)
-        if not factory:
+        if factory is None:
             raise KeyError(f"No dependency registered for key: {key}")
 
-        sig = inspect.signature(factory)
-        params = sig.parameters
+        if factory.scope == Scope.SINGLETON:
+            cache, resolving = self._instances, self._resolving
+        elif factory.scope == Scope.REQUEST and context is not None:
+            cache, resolving = context.cache, context.resolving
+        else:
+            return await self._create(factory, context)
+
+        # concurrent requests for the same dependency share a single creation
+        if key in resolving:
+            return await resolving[key]
+
+        future = asyncio.get_running_loop().create_future()
+        resolving[key] = future
+        try:
+            instance = await self._create(factory, context)
+        except BaseException as e:
+            future.set_exception(e)
+            # mark the exception as retrieved, it is raised below
+            future.exception()
+            raise
+        else:
+            future.set_result(instance)
+            cache[key] = instance
+        finally:
+            del resolving[key]
+
+        return instance
+
+    async def _create(self, factory: _Factory, context: Context | None) -> Any:
+        if factory.requires:
+            await asyncio.gather(*(self.get(key, context) for key in factory.requires))
 
         # Call function with context only if it accepts it
-        if context is not None and len(params) == 1:
-            instance = await factory(context) if inspect.iscoroutinefunction(factory) else factory(
-                context)
+        if context is not None and factory.takes_context:
+            instance = factory.func(context)
         else:
-            instance = await factory() if inspect.iscoroutinefunction(factory) else factory()
+            instance = factory.func()
 
-        # Cache only if it's not in the no-cache list
-        if key not in self._no_cache_keys:
-            self._instances[key] = instance
+        if factory.is_async:
+            instance = await instance
 
         return instance
 
+    async def resolve_many(self, keys: list[str], context: Context | None = None) -> list[Any]:
+        """
+        Resolve several dependencies concurrently.
+        Returns the instances in the order of the keys, a failed dependency is returned
+        as its exception.
+        """
+        return await asyncio.gather(
+            *(self.get(key, context) for key in keys),
+            return_exceptions=True,
+        )
+
+    def get_instance(self, key: str) -> Any | None:
+        """Get the cached instance of a dependency without creating it"""
+        return self._instances.get(key)
+
     def reset(self) -> None:
         """Clear all cached instances"""
         self._instances.clear()
@@ -67,11 +170,11 @@ class DIContainer:
 container = DIContainer()
 
 
-def register_dependency(key: str):
+def register_dependency(key: str, scope: Scope = Scope.SINGLETON, requires: Iterable[str] = ()):
     """Decorator to register a dependency factory"""
 
     def decorator(factory: Callable[..., T]) -> Callable[..., T]:
-        container.register(key, factory)
+        container.register(key, factory, scope, requires)
         return factory
 
     return decorator
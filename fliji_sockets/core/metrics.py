@@ -0,0 +1,181 @@
+"""
+In-process metrics, exported in the Prometheus text format by :py:class:`MetricsASGIApp`.
+
+Recording a value is a dict lookup and an addition, cheap enough for every event and every
+Mongo call. The values are those of this node, the scraper aggregates the nodes.
+"""
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Any, Callable, Awaitable
+
+# seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# bytes
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    labels = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # per labels: [count of each bucket and of +Inf, not cumulative], sum
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        counts_and_sum = self._values.get(labels)
+        if counts_and_sum is None:
+            counts_and_sum = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = counts_and_sum
+        counts[bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket_labels = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {total[0]}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A value read when the metrics are scraped"""
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.read()}",
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram | Gauge] = {}
+
+    def register(self, metric: Counter | Histogram | Gauge) -> Any:
+        # registered again by a new SocketioApplication, the latest one is exported
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+event_duration = registry.register(Histogram(
+    "fliji_sockets_event_duration_seconds",
+    "Duration of the handled socket.io events, the count is the number of events",
+    ("event",),
+))
+event_errors = registry.register(Counter(
+    "fliji_sockets_event_errors_total",
+    "Socket.io events whose handler raised an exception",
+    ("event",),
+))
+events_rejected = registry.register(Counter(
+    "fliji_sockets_events_rejected_total",
+    "Socket.io events not handled: rate_limited, coalesced or shed",
+    ("event", "reason"),
+))
+emit_size = registry.register(Histogram(
+    "fliji_sockets_emit_size_bytes",
+    "Size of the encoded payloads emitted by SocketioApplication.emit",
+    ("event",),
+    SIZE_BUCKETS,
+))
+mongo_call_duration = registry.register(Histogram(
+    "fliji_sockets_mongo_call_duration_seconds",
+    "Duration of the Mongo calls of the store, the reads served by the caches are not observed",
+    ("function",),
+))
+nats_publish_duration = registry.register(Histogram(
+    "fliji_sockets_nats_publish_duration_seconds",
+    "Duration of the NATS publishes, up to the flush: durable messages or batches",
+    ("mode",),
+))
+
+
+def timed(histogram: Histogram):
+    """Observes the duration of each call of an async function, labelled with its qualified name"""
+
+    def decorator(func: Callable[..., Awaitable[Any]]):
+        label = func.__qualname__
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started, label)
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsASGIApp:
+    """Serves the metrics on ``path``, passes every other request to the wrapped ASGI app"""
+
+    def __init__(self, app: Callable, path: str):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/plain; version=0.0.4; charset=utf-8")],
+        })
+        await send({"type": "http.response.body", "body": registry.render().encode()})
@@ -0,0 +1,64 @@
+import time
+
+
+class TokenBucket:
+    """Allows ``rate`` events per second on average, and bursts of up to ``burst`` events"""
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def take(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until an event is allowed"""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """
+    Token buckets of the events each client sends, per sid and event.
+    Events without a limit are always allowed.
+    """
+
+    def __init__(self, limits: dict[str, tuple[float, int]]):
+        self._limits = limits
+        self._buckets: dict[str, dict[str, TokenBucket]] = {}
+
+    def _get_bucket(self, sid: str, event: str, now: float) -> TokenBucket:
+        buckets = self._buckets.setdefault(sid, {})
+        bucket = buckets.get(event)
+        if bucket is None:
+            rate, burst = self._limits[event]
+            bucket = buckets[event] = TokenBucket(rate, burst, now)
+        return bucket
+
+    def allow(self, sid: str, event: str) -> bool:
+        if event not in self._limits:
+            return True
+        now = time.monotonic()
+        return self._get_bucket(sid, event, now).take(now)
+
+    def wait_time(self, sid: str, event: str) -> float:
+        """Seconds until the event is allowed for the client"""
+        if event not in self._limits:
+            return 0.0
+        now = time.monotonic()
+        return self._get_bucket(sid, event, now).wait_time(now)
+
+    def forget(self, sid: str) -> None:
+        """Drops the buckets of a disconnected client"""
+        self._buckets.pop(sid, None)
@@ -0,0 +1,114 @@
+"""
+Encoding of the socket.io packets.
+
+With the default serializer this module is passed to the server as its ``json`` module:
+payloads are encoded with orjson, models directly with their pydantic serializer.
+With SIO_SERIALIZER set to "msgpack", :py:class:`MsgPackPacket` is used instead.
+
+A payload emitted several times can be encoded once with :py:func:`encode_payload`,
+the resulting fragment is embedded as is in every packet.
+"""
+from datetime import datetime
+from typing import Any
+
+import msgpack
+import orjson
+from bson import ObjectId
+from pydantic import BaseModel
+from socketio import msgpack_packet
+
+from fliji_sockets.settings import SIO_SERIALIZER
+
+
+class EncodedPayload:
+    """
+    A payload already encoded for the wire.
+    Picklable, so it also reaches the other nodes through the client manager as is.
+    """
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+class JsonFragment(EncodedPayload):
+    __slots__ = ()
+
+
+class MsgPackFragment(EncodedPayload):
+    __slots__ = ()
+
+
+def encode_payload(payload: BaseModel | Any) -> EncodedPayload:
+    """Encodes a payload once, in the format of the serializer, to be emitted any number of times"""
+    if isinstance(payload, EncodedPayload):
+        return payload
+    if SIO_SERIALIZER == "msgpack":
+        return MsgPackFragment(msgpack.dumps(payload, default=_msgpack_default))
+    return JsonFragment(dumps_bytes(payload))
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, JsonFragment):
+        return orjson.Fragment(value.data)
+    if isinstance(value, BaseModel):
+        # same output as model_dump_json()
+        return orjson.Fragment(value.__pydantic_serializer__.to_json(value))
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=_default)
+
+
+# noinspection PyUnusedLocal
+def dumps(obj: Any, **kwargs) -> str:
+    # the output of orjson is always compact, the separators passed by socket.io are ignored
+    return orjson.dumps(obj, default=_default).decode()
+
+
+# noinspection PyUnusedLocal
+def loads(s: str | bytes, **kwargs) -> Any:
+    return orjson.loads(s)
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, MsgPackFragment):
+        # only the top level payloads are embedded as is
+        return msgpack.loads(value.data)
+    if isinstance(value, BaseModel):
+        # same values as the JSON encoding
+        return value.model_dump(mode="json")
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not msgpack serializable")
+
+
+class MsgPackPacket(msgpack_packet.MsgPackPacket):
+    """Packets of the socket.io msgpack parser, embedding the MsgPackFragment payloads as is"""
+    dumps_default = _msgpack_default
+
+    def encode(self):
+        packet = self._to_dict()
+        data = packet.get("data")
+        if not isinstance(data, list) or not any(isinstance(v, MsgPackFragment) for v in data):
+            return msgpack.dumps(packet, default=_msgpack_default)
+
+        # msgpack is a concatenation of values, the packet is written around the fragments
+        packer = msgpack.Packer(default=_msgpack_default)
+        encoded = [packer.pack_map_header(len(packet))]
+        for key, value in packet.items():
+            encoded.append(packer.pack(key))
+            if key != "data":
+                encoded.append(packer.pack(value))
+                continue
+
+            encoded.append(packer.pack_array_header(len(value)))
+            for item in value:
+                encoded.append(item.data if isinstance(item, MsgPackFragment) else packer.pack(item))
+
+        return b"".join(encoded)
@@ -1,16 +1,32 @@
+import asyncio
 import inspect
 import logging
+import time
 from functools import wraps
-from typing import Any, Optional
+from typing import Any, Optional, Callable, Awaitable
 
 import socketio
 import uvicorn
 from pydantic import ValidationError, BaseModel
 
+from fliji_sockets.core import serialization
 from fliji_sockets.core.di import container, Context
+from fliji_sockets.core.metrics import registry, Gauge, event_duration, event_errors, \
+    events_rejected, emit_size
+from fliji_sockets.core.rate_limit import RateLimiter
+from fliji_sockets.core.serialization import encode_payload
 from fliji_sockets.models.base import UserSioSession
 from fliji_sockets.settings import REDIS_CONNECTION_STRING, LOG_LEVEL, SIO_ADMIN_USERNAME, \
-    SIO_ADMIN_PASSWORD, APP_ENV
+    SIO_ADMIN_PASSWORD, APP_ENV, BROADCAST_INTERVAL, SIO_SERIALIZER, EVENT_RATE_LIMITS, \
+    COALESCED_EVENTS, OVERLOAD_LAG_THRESHOLD, OVERLOAD_CHECK_INTERVAL, SHED_EVENTS
+
+
+# kinds of handler parameters in an invocation plan
+_PARAM_SID = 0
+_PARAM_DATA = 1
+_PARAM_MODEL = 2
+_PARAM_APP = 3
+_PARAM_ENVIRON = 4
 
 
 class SocketioApplication:
@@ -28,7 +44,9 @@ class SocketioApplication:
             logger=enable_socketio_logger,
             engineio_logger=enable_socketio_logger,
             ping_interval=10,
-            ping_timeout=4000
+            ping_timeout=4000,
+            json=serialization,
+            serializer="default" if SIO_SERIALIZER == "json" else serialization.MsgPackPacket,
         )
         if APP_ENV != "prod":
             self.sio.instrument(
@@ -38,127 +56,275 @@ class SocketioApplication:
                 }
             )
 
-        self.sio_app = socketio.ASGIApp(self.sio)
+        self.sio_app = socketio.ASGIApp(
+            self.sio, on_startup=self._startup, on_shutdown=self._shutdown
+        )
+        self._startup_handlers: list[Callable[[], Awaitable[Any]]] = []
+        self._shutdown_handlers: list[Callable[[], Awaitable[Any]]] = []
+
+        # coalesced jobs, keyed by (event, room) for the emits
+        self._scheduled_jobs: dict[tuple[str, str], Callable[[], Awaitable[Any]]] = {}
+        self._scheduled_job_tasks: dict[tuple[str, str], asyncio.Task] = {}
+
+        self._rate_limiter = RateLimiter(EVENT_RATE_LIMITS)
+        # latest excess event of COALESCED_EVENTS, keyed by sid then event
+        self._deferred_events: dict[str, dict[str, Any]] = {}
+        self._deferred_event_tasks: set[asyncio.Task] = set()
+
+        # measured by the event loop monitor, started with the ASGI server
+        self.event_loop_lag = 0.0
+        self.overloaded = False
+        self._event_loop_monitor: asyncio.Task | None = None
+        self.on_startup(self._start_event_loop_monitor)
+        self.on_shutdown(self._stop_event_loop_monitor)
+
+        registry.register(Gauge(
+            "fliji_sockets_connected_sockets", "Sockets connected to this node",
+            self._count_connected_sockets,
+        ))
+        registry.register(Gauge(
+            "fliji_sockets_rooms", "Rooms with a socket of this node, besides the sid rooms",
+            self._count_rooms,
+        ))
+        registry.register(Gauge(
+            "fliji_sockets_event_loop_lag_seconds", "Latest event loop lag measured",
+            lambda: self.event_loop_lag,
+        ))
 
     @staticmethod
     def get_remote_emitter() -> socketio.AsyncRedisManager:
         return socketio.AsyncRedisManager(REDIS_CONNECTION_STRING, write_only=True)
 
-    async def resolve_dependency(self, dep: dict[str, Any], sid: str) -> Any:
-        """Enhanced dependency resolver that handles session dependencies"""
-        if not dep or "type" not in dep or dep["type"] not in ["dependency"] or "key" not in dep:
-            return None
-
-        dependency_key = dep["key"]
-
-        # if the dependency is "app"
-        if dependency_key == "app":
-            return self
-
-        return await container.get(dependency_key, Context(sid=sid, app=self))
+    @staticmethod
+    def _compile_plan(event_name: str,
+                      func: Any) -> tuple[list[tuple[str, int, Any]], list[tuple[str, str]]]:
+        """
+        Inspects the handler once, at registration.
+        Returns what to pass for each parameter as (name, kind, model class)
+        and the dependencies to resolve as (name, dependency key).
+        Parameters in neither list keep their default value.
+        """
+        plan = []
+        dependencies = []
+        for name, param in inspect.signature(func).parameters.items():
+            annotation = param.annotation
+            default = param.default
+
+            if name == "sid":
+                plan.append((name, _PARAM_SID, None))
+            elif name == "data":
+                if inspect.isclass(annotation) and issubclass(annotation, BaseModel):
+                    plan.append((name, _PARAM_MODEL, annotation))
+                else:
+                    plan.append((name, _PARAM_DATA, None))
+            elif isinstance(default, dict) and default.get("type") == "dependency" \
+                    and "key" in default:
+                if default["key"] == "app":
+                    plan.append((name, _PARAM_APP, None))
+                else:
+                    dependencies.append((name, default["key"]))
+            elif name == "environ" and event_name == "connect":
+                plan.append((name, _PARAM_ENVIRON, None))
+
+        return plan, dependencies
 
     def event(self, event_name: str):
         """Enhanced event decorator with built-in auth and validation."""
 
         def decorator(func: Any):
+            plan, dependencies = self._compile_plan(event_name, func)
+            dependency_keys = [key for _, key in dependencies]
+            requires_session = event_name != "connect" and event_name != "disconnect"
+
             # noinspection PyUnusedLocal
             @wraps(func)
             async def wrapper(sid: str, data=None, *args, **kwargs):
-                logging.critical("#######")
-                logging.critical("#######")
-                logging.critical("#######")
-                logging.critical(event_name)
-                logging.critical(args)
-                logging.critical(kwargs)
-                logging.critical("#######")
-                logging.critical("#######")
-                dependency_error = None
-                sig = inspect.signature(func)
+                if event_name == "disconnect":
+                    self._forget_client(sid)
+                elif not await self._admit(sid, event_name, data, wrapper):
+                    return
 
+                started = time.perf_counter()
                 try:
+                    context = Context(sid=sid, app=self)
+
                     # Get session early to validate authentication
-                    if event_name != "connect" and event_name != "disconnect":
+                    if requires_session:
                         session = await self.get_session(sid)
                         if not session:
                             await self.send_fatal_error_message(
                                 sid, "Unauthorized: could not find user_uuid in socketio session"
                             )
                             return
+                        # shared with the handler, so the session store is read once per event
+                        context.cache["sio_session"] = session
 
-                    # we create a dict for the bound parameters
-                    args_dict = {}
-                    if "sid" in sig.parameters:
-                        args_dict["sid"] = sid
-
-                    if "data" in sig.parameters:
-                        args_dict["data"] = data
-
-                    bound = sig.bind_partial(**args_dict)
-                    bound.apply_defaults()
-
-                    # Process parameters
-                    for name, value in bound.arguments.items():
-                        param = sig.parameters.get(name)
-                        if param and issubclass(param.annotation,
-                                                BaseModel) and "type" not in value:
+                    call_kwargs = {}
+                    for name, kind, arg in plan:
+                        if kind == _PARAM_MODEL:
                             try:
                                 if isinstance(data, str):
-                                    model_instance = param.annotation.model_validate_json(data)
+                                    call_kwargs[name] = arg.model_validate_json(data)
                                 else:
-                                    model_instance = param.annotation.model_validate(data)
-                                bound.arguments[name] = model_instance
+                                    call_kwargs[name] = arg.model_validate(data)
                             except ValidationError as e:
                                 await self.send_error_message(
                                     sid,
-                                    f"Invalid request for model: {param.annotation.__name__}",
+                                    f"Invalid request for model: {arg.__name__}",
                                     e.errors()
                                 )
-                                dependency_error = e
-                                break
-                        elif isinstance(value, dict) and value.get("type") == "dependency":
-                            try:
-                                dependency_resolved = await self.resolve_dependency(value, sid)
-                                bound.arguments[name] = dependency_resolved
-                            except Exception as e:
+                                return
+                        elif kind == _PARAM_SID:
+                            call_kwargs[name] = sid
+                        elif kind == _PARAM_APP:
+                            call_kwargs[name] = self
+                        elif kind == _PARAM_DATA:
+                            call_kwargs[name] = data
+                        elif kind == _PARAM_ENVIRON and len(args) > 0:
+                            call_kwargs[name] = args[0]
+
+                    # independent dependencies are resolved concurrently
+                    if dependency_keys:
+                        resolved = await container.resolve_many(dependency_keys, context)
+                        for (name, _), instance in zip(dependencies, resolved):
+                            if isinstance(instance, Exception):
                                 await self.send_error_message(
                                     sid,
                                     f"Error resolving dependency: {name}",
-                                    str(e)
+                                    str(instance)
                                 )
-                                dependency_error = e
-                                break
-
-                    # Handle connect event environ
-                    if event_name == "connect" and len(args) > 0:
-                        bound.arguments["environ"] = args[0]
-
-                    # Handle connect event reason
-                    if event_name == "disconnect":
-                        logging.critical("#######")
-                        logging.critical("#######")
-                        logging.critical("#######")
-                        logging.critical(args)
-                        logging.critical(kwargs)
-                        logging.critical("#######")
-                        logging.critical("#######")
-                        # bound.arguments["reason"] = args[0]
-
-                    if not dependency_error:
-                        await func(*bound.args, **bound.kwargs)
+                                return
+                            if isinstance(instance, BaseException):
+                                raise instance
+                            call_kwargs[name] = instance
+
+                    await func(**call_kwargs)
                 except Exception as e:
+                    event_errors.inc(event_name)
                     await self.send_fatal_error_message(
                         sid, f"An unexpected error occurred: {str(e)}"
                     )
                     raise
+                finally:
+                    event_duration.observe(time.perf_counter() - started, event_name)
 
             self.sio.on(event_name, wrapper)
             return func
 
         return decorator
 
+    async def _admit(self, sid: str, event_name: str, data: Any,
+                     handler: Callable[..., Awaitable[Any]]) -> bool:
+        """
+        Applies the load shedding and the rate limits before an event is handled.
+        Returns False if the event is rejected, or deferred for COALESCED_EVENTS.
+        """
+        if self.overloaded and event_name in SHED_EVENTS:
+            events_rejected.inc(event_name, "shed")
+            await self.send_error_message(
+                sid, f"Server overloaded: {event_name} was rejected, retry later."
+            )
+            return False
+
+        if self._rate_limiter.allow(sid, event_name):
+            deferred = self._deferred_events.get(sid)
+            if deferred:
+                # superseded by this more recent event
+                deferred.pop(event_name, None)
+            return True
+
+        if event_name in COALESCED_EVENTS:
+            events_rejected.inc(event_name, "coalesced")
+            deferred = self._deferred_events.setdefault(sid, {})
+            if event_name not in deferred:
+                task = asyncio.create_task(self._handle_deferred_event(sid, event_name, handler))
+                self._deferred_event_tasks.add(task)
+                task.add_done_callback(self._deferred_event_tasks.discard)
+            deferred[event_name] = data
+            return False
+
+        events_rejected.inc(event_name, "rate_limited")
+        await self.send_error_message(sid, f"Rate limit exceeded: {event_name} was dropped.")
+        return False
+
+    async def _handle_deferred_event(self, sid: str, event_name: str,
+                                     handler: Callable[..., Awaitable[Any]]) -> None:
+        await asyncio.sleep(self._rate_limiter.wait_time(sid, event_name))
+
+        deferred = self._deferred_events.get(sid)
+        if not deferred or event_name not in deferred:
+            # superseded, or the client disconnected
+            return
+        data = deferred.pop(event_name)
+        if not deferred:
+            del self._deferred_events[sid]
+
+        try:
+            await handler(sid, data)
+        except Exception as e:
+            logging.error(f"Error handling deferred {event_name} of {sid}: {e}")
+
+    def _forget_client(self, sid: str) -> None:
+        self._rate_limiter.forget(sid)
+        self._deferred_events.pop(sid, None)
+
+    def _count_connected_sockets(self) -> int:
+        # every socket is in the None room of its namespace
+        return len(self.sio.manager.rooms.get("/", {}).get(None, {}))
+
+    def _count_rooms(self) -> int:
+        rooms = self.sio.manager.rooms.get("/", {})
+        sids = rooms.get(None, {})
+        return sum(1 for room in rooms if room is not None and room not in sids)
+
+    async def _start_event_loop_monitor(self) -> None:
+        self._event_loop_monitor = asyncio.create_task(self._monitor_event_loop())
+
+    async def _stop_event_loop_monitor(self) -> None:
+        if self._event_loop_monitor is not None:
+            self._event_loop_monitor.cancel()
+            self._event_loop_monitor = None
+
+    async def _monitor_event_loop(self) -> None:
+        """Measures how late the event loop wakes up a sleeping task, to detect overload"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(OVERLOAD_CHECK_INTERVAL)
+            self.event_loop_lag = loop.time() - started - OVERLOAD_CHECK_INTERVAL
+
+            overloaded = self.event_loop_lag > OVERLOAD_LAG_THRESHOLD
+            if overloaded != self.overloaded:
+                if overloaded:
+                    logging.warning(
+                        f"Event loop lag is {self.event_loop_lag:.3f}s, shedding {SHED_EVENTS}"
+                    )
+                else:
+                    logging.warning("Event loop lag is back to normal, stopped shedding events")
+            self.overloaded = overloaded
+
     def get_asgi_app(self) -> socketio.ASGIApp:
         return self.sio_app
 
+    def on_startup(self, handler: Callable[[], Awaitable[Any]]) -> None:
+        """Register a coroutine function to be awaited when the ASGI server starts"""
+        self._startup_handlers.append(handler)
+
+    async def _startup(self) -> None:
+        for handler in self._startup_handlers:
+            await handler()
+
+    def on_shutdown(self, handler: Callable[[], Awaitable[Any]]) -> None:
+        """Register a coroutine function to be awaited when the ASGI server shuts down"""
+        self._shutdown_handlers.append(handler)
+
+    async def _shutdown(self) -> None:
+        for handler in self._shutdown_handlers:
+            try:
+                await handler()
+            except Exception as e:
+                logging.error(f"Error in shutdown handler {handler.__qualname__}: {e}")
+
     async def get_session(self, sid) -> Optional[UserSioSession]:
         try:
             session_dict = await self.sio.get_session(sid)
@@ -179,10 +345,51 @@ class SocketioApplication:
 
     async def emit(self, event: str, data: Any, room: Optional[str] = None,
                    skip_sid: Optional[str] = None) -> None:
-        if isinstance(data, BaseModel):
-            data = data.model_dump(mode='json')
+        # encoded once for every recipient on every node
+        data = encode_payload(data)
+        emit_size.observe(len(data.data), event)
         await self.sio.emit(event, data, room=room, skip_sid=skip_sid)
 
+    def schedule_emit(self, event: str, room: str,
+                      payload_factory: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Coalesces emits of the same event to the same room.
+
+        The first call emits right away, the following ones only mark the room as dirty:
+        at most one emit per BROADCAST_INTERVAL is sent, built by the latest payload_factory,
+        so all the changes made in between are merged into a single payload.
+        Nothing is emitted if the payload_factory returns None.
+        """
+        async def emit_payload():
+            payload = await payload_factory()
+            if payload is not None:
+                await self.emit(event, payload, room=room)
+
+        self.schedule((event, room), emit_payload)
+
+    def schedule(self, key: tuple[str, str], job: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Coalesces the jobs of the same key, e.g. the emits of an event to several rooms.
+        Same as schedule_emit: the latest job runs at most once per BROADCAST_INTERVAL.
+        """
+        self._scheduled_jobs[key] = job
+
+        if key not in self._scheduled_job_tasks:
+            self._scheduled_job_tasks[key] = asyncio.create_task(self._run_scheduled_jobs(key))
+
+    async def _run_scheduled_jobs(self, key: tuple[str, str]) -> None:
+        try:
+            while key in self._scheduled_jobs:
+                job = self._scheduled_jobs.pop(key)
+                try:
+                    await job()
+                except Exception as e:
+                    logging.error(f"Error running scheduled {key}: {e}")
+
+                await asyncio.sleep(BROADCAST_INTERVAL)
+        finally:
+            del self._scheduled_job_tasks[key]
+
     async def send_error_message(self, sid: str, message: str, body: Any = None) -> None:
         if body is None:
             body = {}
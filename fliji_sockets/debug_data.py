@@ -2,7 +2,7 @@ import random
 import uuid
 from datetime import datetime
 
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 
 from fliji_sockets.models.database import TimelineWatchSession, TimelineChatMessage, TimelineGroup
 from fliji_sockets.settings import TEST_VIDEO_UUID
@@ -46,7 +46,7 @@ async def _create_debug_user(group: TimelineGroup | None = None) -> (TimelineWat
     return watch_session, group
 
 
-async def load_debug_data(db: Database):
+async def load_debug_data(db: AsyncDatabase):
     video_uuid = TEST_VIDEO_UUID
 
     # groups that will hold multiple users
@@ -79,7 +79,7 @@ async def load_debug_data(db: Database):
 
 
     # get all the timeline users
-    timeline_users = list(db.timeline_watch_sessions.find({}))
+    timeline_users = await db.timeline_watch_sessions.find({}).to_list()
 
     # update base groups to have proper values for host uuid
     for group in base_groups:
@@ -110,7 +110,7 @@ async def load_debug_data(db: Database):
         )
 
         # upsert the message by user_uuid and video_uuid and message
-        db.timeline_chat_messages.update_one(
+        await db.timeline_chat_messages.update_one(
             {"user_uuid": msg.user_uuid, "video_uuid": msg.video_uuid, "message": msg.message},
             {"$set": msg.model_dump(exclude_none=True)},
             upsert=True,
@@ -1,16 +1,19 @@
 from nats.aio.client import Client
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 
-from fliji_sockets.core.di import register_dependency, Context, container
+from fliji_sockets.core.di import register_dependency, Context, container, Scope
+from fliji_sockets.event_publisher import EventPublisher
 from fliji_sockets.models.base import UserSioSession
 from fliji_sockets.models.database import TimelineWatchSession, TimelineGroup
 from fliji_sockets.store import get_watch_session_or_fail, get_group_or_fail
 
 
 @register_dependency("db")
-async def get_database() -> Database:
-    from fliji_sockets.store import get_database
-    return get_database()
+async def get_database() -> AsyncDatabase:
+    from fliji_sockets.store import get_database, ensure_indexes
+    db = get_database()
+    await ensure_indexes(db)
+    return db
 
 
 @register_dependency("nats")
@@ -21,7 +24,14 @@ async def get_nats() -> Client:
     return await nats.connect(f"{NATS_HOST}", **options)
 
 
-@register_dependency("sio_session")
+@register_dependency("event_publisher", requires=("nats",))
+async def get_event_publisher() -> EventPublisher:
+    from fliji_sockets.settings import NATS_PUBLISH_BATCH_SIZE, NATS_PUBLISH_MAX_DELAY
+    nc = await container.get("nats")
+    return EventPublisher(nc, NATS_PUBLISH_BATCH_SIZE, NATS_PUBLISH_MAX_DELAY)
+
+
+@register_dependency("sio_session", Scope.REQUEST)
 async def get_sio_session(context: Context) -> UserSioSession:
     session = await context.app.get_session(context.sid)
     if not session:
@@ -30,25 +40,24 @@ async def get_sio_session(context: Context) -> UserSioSession:
     return session
 
 
-@register_dependency("timeline_session")
+@register_dependency("timeline_session", Scope.REQUEST, requires=("db", "sio_session"))
 async def get_timeline_session(context: Context) -> TimelineWatchSession:
     """Dependency that provides current watch session"""
     db = await container.get("db")
-    socket_session = await context.app.get_session(context.sid)
+    socket_session = await container.get("sio_session", context)
     watch_session = await get_watch_session_or_fail(db, socket_session.user_uuid)
 
     return watch_session
 
 
-@register_dependency("timeline_group")
+@register_dependency("timeline_group", Scope.REQUEST, requires=("db", "timeline_session"))
 async def get_timeline_group(context: Context) -> TimelineGroup:
     """
     User must always be in a group.
     This function ensures that the internal state is correct.
     """
     db = await container.get("db")
-    socket_session = await context.app.get_session(context.sid)
-    watch_session = await get_watch_session_or_fail(db, socket_session.user_uuid)
+    watch_session = await container.get("timeline_session", context)
     group_uuid = watch_session.group_uuid
 
     group = await get_group_or_fail(db, group_uuid)
@@ -1,93 +1,145 @@
+import asyncio
 import json
+import logging
+import time
 
 from nats.aio.client import Client
 
-
-async def publish_user_online(nc: Client, user_uuid: str):
+from fliji_sockets.core.metrics import nats_publish_duration
+
+
+class EventPublisher:
+    """
+    Publishes events to NATS in micro-batches.
+
+    Messages are queued and written together, followed by a single flush,
+    once ``max_batch_size`` messages are queued or ``max_delay`` seconds after the first one.
+    Pass ``durable=True`` to publish() to wait for the server to receive the message.
+    """
+
+    def __init__(self, nc: Client, max_batch_size: int, max_delay: float):
+        self._nc = nc
+        self._max_batch_size = max_batch_size
+        self._max_delay = max_delay
+        self._queue: list[tuple[str, bytes]] = []
+        self._flush_task: asyncio.Task | None = None
+
+    async def publish(self, subject: str, payload: dict, durable: bool = False) -> None:
+        data = json.dumps(payload).encode()
+
+        if durable:
+            # send the queued messages first to keep the order
+            await self.flush()
+            started = time.perf_counter()
+            await self._nc.publish(subject, data)
+            await self._nc.flush()
+            nats_publish_duration.observe(time.perf_counter() - started, "durable")
+            return
+
+        self._queue.append((subject, data))
+        if len(self._queue) >= self._max_batch_size:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self._max_delay)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Error flushing NATS messages: {e}")
+
+    async def flush(self) -> None:
+        if not self._queue:
+            return
+
+        batch, self._queue = self._queue, []
+        started = time.perf_counter()
+        for subject, data in batch:
+            await self._nc.publish(subject, data)
+        await self._nc.flush()
+        nats_publish_duration.observe(time.perf_counter() - started, "batch")
+
+
+async def publish_user_online(publisher: EventPublisher, user_uuid: str):
     payload = {
         "user_uuid": user_uuid,
     }
 
-    await nc.publish("user.online", json.dumps(payload).encode())
-    await nc.flush()
+    await publisher.publish("user.online", payload)
 
 
-async def publish_enable_fliji_mode(nc: Client, user_uuid: str):
+async def publish_enable_fliji_mode(publisher: EventPublisher, user_uuid: str):
     payload = {
         "user_uuid": user_uuid,
     }
 
-    await nc.publish("user.fliji_mode_enabled", json.dumps(payload).encode())
-    await nc.flush()
+    await publisher.publish("user.fliji_mode_enabled", payload)
 
 
-async def publish_disable_fliji_mode(nc: Client, user_uuid: str):
+async def publish_disable_fliji_mode(publisher: EventPublisher, user_uuid: str):
     payload = {
         "user_uuid": user_uuid,
     }
 
-    await nc.publish("user.fliji_mode_disabled", json.dumps(payload).encode())
-    await nc.flush()
+    await publisher.publish("user.fliji_mode_disabled", payload)
 
 
-async def publish_user_offline(nc: Client, user_uuid: str):
+async def publish_user_offline(publisher: EventPublisher, user_uuid: str):
     payload = {
         "user_uuid": user_uuid,
     }
 
-    await nc.publish("user.offline", json.dumps(payload).encode())
-    await nc.flush()
+    await publisher.publish("user.offline", payload)
 
 
-async def publish_user_disconnected(nc: Client, user_uuid: str):
+async def publish_user_disconnected(publisher: EventPublisher, user_uuid: str):
     payload = {
         "user_uuid": user_uuid,
     }
 
-    await nc.publish("user.disconnected", json.dumps(payload).encode())
-    await nc.flush()
+    await publisher.publish("user.disconnected", payload)
 
 
-async def publish_user_connected_to_timeline(nc: Client, user_uuid: str, video_uuid: str):
+async def publish_user_connected_to_timeline(publisher: EventPublisher, user_uuid: str,
+                                             video_uuid: str):
     payload = {
         "user_uuid": user_uuid,
         "video_uuid": video_uuid,
     }
 
-    await nc.publish("timeline.user_connected", json.dumps(payload).encode())
-    await nc.flush()
+    await publisher.publish("timeline.user_connected", payload)
 
 
-async def publish_user_left_timeline_group(nc: Client, user_uuid: str, group_uuid: str,
-                                           group_participants_uuids: list[str]):
+async def publish_user_left_timeline_group(publisher: EventPublisher, user_uuid: str,
+                                           group_uuid: str, group_participants_uuids: list[str]):
     payload = {
         "user_uuid": user_uuid,
         "group_uuid": group_uuid,
         "group_participants_uuids": group_participants_uuids,
     }
 
-    await nc.publish("timeline.user_left_group", json.dumps(payload).encode())
-    await nc.flush()
+    await publisher.publish("timeline.user_left_group", payload)
 
 
-async def publish_user_left_timeline(nc: Client, user_uuid: str, video_uuid: str, watch_time: int):
+async def publish_user_left_timeline(publisher: EventPublisher, user_uuid: str, video_uuid: str,
+                                     watch_time: int):
     payload = {
         "user_uuid": user_uuid,
         "video_uuid": video_uuid,
         "watch_time": watch_time,
     }
 
-    await nc.flush()
-    await nc.publish("timeline.user_left", json.dumps(payload).encode())
+    await publisher.publish("timeline.user_left", payload)
 
 
-async def publish_timeline_chat_message(nc: Client, video_uuid: str, author_uuid: str,
-                                        message: str):
+async def publish_timeline_chat_message(publisher: EventPublisher, video_uuid: str,
+                                        author_uuid: str, message: str):
     payload = {
         "video_uuid": video_uuid,
         "author_uuid": author_uuid,
         "message": message,
     }
 
-    await nc.publish("timeline.sent_message", json.dumps(payload).encode())
-    await nc.flush()
+    await publisher.publish("timeline.sent_message", payload)
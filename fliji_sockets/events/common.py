@@ -1,26 +1,126 @@
 import logging
 import uuid
 
-from nats.aio.client import Client
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 
 from fliji_sockets.core.socketio_application import SocketioApplication
 from fliji_sockets.event_publisher import publish_user_left_timeline_group, \
-    publish_user_left_timeline
-from fliji_sockets.helpers import get_room_name
+    publish_user_left_timeline, EventPublisher
+from fliji_sockets.cache import GROUPS_SORTS
+from fliji_sockets.groups_versions import timeline_groups_versions
+from fliji_sockets.helpers import get_room_name, get_groups_room_name, get_groups_delta_room_name, \
+    get_groups_viewport_room_name
 from fliji_sockets.models.database import TimelineGroup, TimelineWatchSession
-from fliji_sockets.models.socket import TimelineGroupResponse, TimelineCurrentGroupResponse, \
-    TimelineUserAvatarsResponse
+from fliji_sockets.models.socket import TimelineCurrentGroupResponse, TimelineUserAvatarsResponse
+from fliji_sockets.room_subscribers import room_subscribers
 from fliji_sockets.store import (upsert_timeline_group, \
-    upsert_timeline_watch_session, get_timeline_groups, get_timeline_group_users_data, \
-    get_timeline_group_users, delete_timeline_group_by_uuid, \
+    update_timeline_watch_session, get_timeline_group_users_data, \
+    get_timeline_group_users, leave_timeline_group, NoGroupError, WatchSessionProjection, \
     delete_timeline_watch_session_by_user_uuid, get_group_or_fail, get_video_watch_session_count,
-                                 get_watch_session_or_fail)
+                                 get_timeline_groups_response, get_timeline_user_avatars,
+                                 get_timeline_groups_payload, get_timeline_groups_first_pages)
+from fliji_sockets.settings import GROUPS_VIEWPORT_SIZES
+
+
+def schedule_timeline_groups_broadcast(app: SocketioApplication, db: AsyncDatabase,
+                                       video_uuid: str) -> None:
+    """
+    Schedules a `timeline_groups` emit to everybody on the timeline.
+    Changes made within the broadcast interval are sent as a single snapshot.
+    The delta is only computed if somebody is subscribed to it on any node,
+    the next subscriber catches up in handle_user_joining_timeline_groups().
+    """
+    async def build_payload():
+        return await get_timeline_groups_payload(db, video_uuid)
+
+    delta_room = get_groups_delta_room_name(video_uuid)
+
+    async def build_delta_payload():
+        if not await room_subscribers.subscribed([delta_room]):
+            return None
+        timeline_groups = await get_timeline_groups_response(db, video_uuid)
+        return await timeline_groups_versions.diff(video_uuid, timeline_groups)
+
+    app.schedule_emit("timeline_groups", get_groups_room_name(video_uuid), build_payload)
+    app.schedule_emit("timeline_groups_delta", delta_room, build_delta_payload)
+
+    async def emit_viewports():
+        # only the viewports somebody is subscribed to, on any node
+        subscribed = await room_subscribers.subscribed(get_groups_viewport_room_names(video_uuid))
+        for sort in GROUPS_SORTS:
+            sizes = [
+                size for size in GROUPS_VIEWPORT_SIZES
+                if get_groups_viewport_room_name(video_uuid, sort, size) in subscribed
+            ]
+            if not sizes:
+                continue
+
+            pages = await get_timeline_groups_first_pages(db, video_uuid, sort, sizes)
+            for size, page in pages.items():
+                await app.emit("timeline_groups_viewport", page,
+                               room=get_groups_viewport_room_name(video_uuid, sort, size))
+
+    # one job for all the viewports of the video, the groups are ordered once per sort
+    app.schedule(("timeline_groups_viewport", video_uuid), emit_viewports)
+
+
+def get_groups_viewport_room_names(video_uuid: str) -> list[str]:
+    return [
+        get_groups_viewport_room_name(video_uuid, sort, size)
+        for sort in GROUPS_SORTS for size in GROUPS_VIEWPORT_SIZES
+    ]
+
+
+def get_groups_room_names(video_uuid: str) -> list[str]:
+    """Every room receiving the groups of the video, a user is in at most one of them"""
+    return [
+        get_groups_room_name(video_uuid),
+        get_groups_delta_room_name(video_uuid),
+        *get_groups_viewport_room_names(video_uuid),
+    ]
+
+
+async def leave_groups_rooms(app: SocketioApplication, sid: str, video_uuid: str) -> None:
+    """Unsubscribes the user from every kind of groups broadcast of the video"""
+    rooms = get_groups_room_names(video_uuid)
+    for room in rooms:
+        await app.leave_room(sid, room)
+    await room_subscribers.remove(rooms, sid)
+
+
+async def handle_user_joining_timeline_groups(app: SocketioApplication, db: AsyncDatabase,
+                                              sid: str, video_uuid: str,
+                                              groups_delta: bool) -> None:
+    """
+    Subscribes the user either to the full `timeline_groups` list or to `timeline_groups_delta`.
+    Delta subscribers get the snapshot the next delta will be based on.
+    """
+    if not groups_delta:
+        await app.enter_room(sid, get_groups_room_name(video_uuid))
+        return
+
+    delta_room = get_groups_delta_room_name(video_uuid)
+    # registered first, so that no broadcast skips the delta from now on
+    await room_subscribers.add(delta_room, sid)
+
+    # the deltas are not computed while nobody is subscribed,
+    # the other subscribers get the changes made meanwhile before the user joins them
+    timeline_groups = await get_timeline_groups_response(db, video_uuid)
+    delta = await timeline_groups_versions.diff(video_uuid, timeline_groups)
+    if delta is not None:
+        await app.emit("timeline_groups_delta", delta, room=delta_room)
+
+    await app.enter_room(sid, delta_room)
+    await app.emit(
+        "timeline_groups_snapshot",
+        await timeline_groups_versions.encoded_snapshot(video_uuid, timeline_groups),
+        room=sid,
+    )
 
 
 async def handle_user_joining_new_single_room(
         app: SocketioApplication,
-        db: Database,
+        db: AsyncDatabase,
         watch_session: TimelineWatchSession):
     """
     This is a helper function to handle user joining the single room.
@@ -48,14 +148,15 @@ async def handle_user_joining_new_single_room(
     )
     await upsert_timeline_group(db, group)
     watch_session.group_uuid = group.group_uuid
-    await upsert_timeline_watch_session(db, watch_session)
+    await update_timeline_watch_session(db, watch_session.user_uuid,
+                                        {"group_uuid": group.group_uuid})
 
     await app.enter_room(watch_session.sid, get_room_name(group.group_uuid))
 
 
 async def handle_user_leaving_group(
         app: SocketioApplication,
-        nc: Client, db: Database,
+        publisher: EventPublisher, db: AsyncDatabase,
         watch_session: TimelineWatchSession,
 ):
     """
@@ -67,39 +168,30 @@ async def handle_user_leaving_group(
     # later we will clear the group_uuid from the watch session, so we need to save it here
     group_uuid = watch_session.group_uuid
 
-    group = await get_group_or_fail(db, group_uuid)
+    # users of the group, the one who has been there the longest becomes the host
+    group_users = await get_timeline_group_users(db, group_uuid, WatchSessionProjection.MEMBERSHIP)
+    group_participants_uuids = [
+        group_user.get("user_uuid") for group_user in group_users
+        if group_user.get("user_uuid") != user_uuid
+    ]
+    next_host_user_uuid = group_participants_uuids[0] if group_participants_uuids else None
+
+    # the host is only handed over if the user is still the host,
+    # the group is deleted if the user was the last one
+    group_data = await leave_timeline_group(db, group_uuid, user_uuid, next_host_user_uuid)
+    if group_data is None:
+        raise NoGroupError(f"Group {group_uuid} not found")
 
     try:
         await app.leave_room(watch_session.sid, get_room_name(group_uuid))
     except Exception as e:
         logging.error(f"Error leaving sio for for user uuid:{user_uuid}: {e}")
 
-    # users of the group
-    group_users = list(await get_timeline_group_users(db, group_uuid))
-
-    # if host left the group and there are still people, change the host
-    if group.host_user_uuid == user_uuid:
-        last_user_uuid = None
-        # find the one with the
-        for group_user in group_users:
-            if group_user.get("user_uuid") != user_uuid:
-                last_user_uuid = group_user.get("user_uuid")
-                break
-
-        group.host_user_uuid = last_user_uuid
-
-
-    group.users_count -= 1
-    # if the last user left the group, delete the group
-    if len(group_users) <= 1:
-        await delete_timeline_group_by_uuid(db, group_uuid)
-    else:
-        await upsert_timeline_group(db, group)
-
     # leave the room
     logging.debug(f"Leaving room {group_uuid} for user {user_uuid}")
     watch_session.group_uuid = None
-    await upsert_timeline_watch_session(db, watch_session)
+    watch_session.mic_enabled = False
+    await update_timeline_watch_session(db, user_uuid, {"group_uuid": None, "mic_enabled": False})
 
     # timeline_groups = await get_timeline_groups(db, watch_session.video_uuid)
     # await app.emit(
@@ -119,9 +211,8 @@ async def handle_user_leaving_group(
         )
     else:
         if timeline_current_group:
-            host_watch_session = await get_watch_session_or_fail(db, timeline_current_group[0]['user_uuid'])
-            host_watch_session.mic_enabled = False
-            await upsert_timeline_watch_session(db, host_watch_session)
+            await update_timeline_watch_session(db, timeline_current_group[0]['user_uuid'],
+                                                {"mic_enabled": False})
         await app.emit(
             "timeline_group_alone",
             {"group_uuid": f"{group_uuid}"},
@@ -130,24 +221,19 @@ async def handle_user_leaving_group(
 
     # sent last for iOs compatibility
     # when users is the only one in the group, we treat it as though the user left the group
-    if group.users_count == 1:
+    if group_data["users_count"] == 1:
         await app.emit(
             "timeline_you_left_group",
             {"group_uuid": group_uuid},
             room=watch_session.sid
         )
 
-    # collects the users that the user had conversations with
-    group_participants_uuids = []
-    if group_users:
-        for group_user in group_users:
-            if group_user.get("user_uuid") != user_uuid:
-                group_participants_uuids.append(group_user.get("user_uuid"))
-
-    await publish_user_left_timeline_group(nc, user_uuid, group_uuid, group_participants_uuids)
+    await publish_user_left_timeline_group(publisher, user_uuid, group_uuid,
+                                           group_participants_uuids)
 
 
-async def handle_user_leaving_timeline(app: SocketioApplication, db: Database, nc: Client,
+async def handle_user_leaving_timeline(app: SocketioApplication, db: AsyncDatabase,
+                                       publisher: EventPublisher,
                                        timeline_watch_session: TimelineWatchSession):
     watch_session = TimelineWatchSession.model_validate(timeline_watch_session)
     logging.debug(f"Handling user leaving timeline: {watch_session}")
@@ -155,24 +241,32 @@ async def handle_user_leaving_timeline(app: SocketioApplication, db: Database, n
     watch_time = 0
     try:
         group = await get_group_or_fail(db, watch_session.group_uuid)
-        watch_time = group.watch_time
+        watch_time = group.get_position()
     except Exception as e:
         logging.error(f"Error getting group: {e}")
 
-    await handle_user_leaving_group(app, nc, db, watch_session)
+    await handle_user_leaving_group(app, publisher, db, watch_session)
+
+    # the others only need the avatars if the strip or the count changed
+    previous_user_avatars = await get_timeline_user_avatars(db, watch_session.video_uuid)
+    previous_user_count = await get_video_watch_session_count(db, watch_session.video_uuid)
 
     await delete_timeline_watch_session_by_user_uuid(db, watch_session.user_uuid)
 
     try:
         await app.leave_room(watch_session.sid, get_room_name(watch_session.video_uuid))
+        await leave_groups_rooms(app, watch_session.sid, watch_session.video_uuid)
     except Exception as e:
         logging.error(f"Error leaving room: {e}")
 
-    await publish_user_left_timeline(nc, watch_session.user_uuid, watch_session.video_uuid,
+    await publish_user_left_timeline(publisher, watch_session.user_uuid, watch_session.video_uuid,
                                      watch_time)
 
-    timeline_user_avatars = await get_timeline_group_users_data(db, watch_session.group_uuid)
+    timeline_user_avatars = await get_timeline_user_avatars(db, watch_session.video_uuid)
     timeline_user_count = await get_video_watch_session_count(db, watch_session.video_uuid)
+    if timeline_user_avatars == previous_user_avatars and timeline_user_count == previous_user_count:
+        return
+
     await app.emit(
         "timeline_user_avatars",
         TimelineUserAvatarsResponse(users=timeline_user_avatars, count=timeline_user_count),
@@ -2,15 +2,18 @@ import random
 from datetime import datetime
 
 import jwt
+from bson import ObjectId
 from pydantic import ValidationError
 
+from fliji_sockets.chat_pipeline import chat_pipeline
 from fliji_sockets.core.di import Depends
 from fliji_sockets.event_publisher import \
     publish_user_disconnected, \
     publish_user_online, publish_user_connected_to_timeline, \
     publish_enable_fliji_mode
 from fliji_sockets.events.common import *
-from fliji_sockets.helpers import get_room_name
+from fliji_sockets.groups_versions import timeline_groups_versions
+from fliji_sockets.helpers import get_room_name, get_groups_viewport_room_name
 from fliji_sockets.models.base import UserSioSession
 from fliji_sockets.models.database import TimelineWatchSession, TimelineGroup, \
     TimelineChatMessage
@@ -18,17 +21,22 @@ from fliji_sockets.models.socket import (
     TimelineConnectRequest,
     TimelineSendChatMessageRequest, TimelineUpdateTimecodeRequest, TimelineSetMicEnabled,
     TimelinePauseRequest, TimelineChatHistoryResponse,
-    TimelineGroupResponse, TimelineCurrentGroupResponse, TimelineChangeGroupRequest,
-    TimelineUserAvatars, TimelineReConnectRequest
+    TimelineCurrentGroupResponse, TimelineChangeGroupRequest,
+    TimelineUserAvatars, TimelineReConnectRequest, TimelineFetchChatMessages,
+    TimelineChatMessagesPageResponse, TimelineGroupsViewportRequest,
+    TimelineGetGroupPositionRequest, TimelineGroupPositionResponse
 )
-from fliji_sockets.settings import JWT_SECRET
+from fliji_sockets.room_subscribers import room_subscribers
+from fliji_sockets.settings import JWT_SECRET, CHAT_HISTORY_PAGE_SIZE, GROUPS_VIEWPORT_SIZES, \
+    TIMECODE_DRIFT_TOLERANCE
 from fliji_sockets.store import (
     upsert_timeline_watch_session, delete_timeline_watch_session_by_user_uuid,
     get_timeline_watch_session_by_user_uuid, upsert_timeline_group,
-    insert_timeline_chat_message,
     get_timeline_chat_messages_by_video_uuid, get_timeline_group_users_data,
-    get_group_or_fail, get_watch_session_or_fail, get_timeline_user_avatars,
-    get_video_watch_session_count, )
+    get_group_or_fail, get_timeline_user_avatars,
+    get_video_watch_session_count, get_timeline_groups_response, update_timeline_group_timecode,
+    update_timeline_group_playback, join_timeline_group, update_timeline_watch_session, WatchSessionProjection,
+    get_timeline_groups_page, )
 
 
 # async def connect(
@@ -84,7 +92,7 @@ async def connect(
         sid,
         data,
         app: SocketioApplication = Depends("app"),
-        nc: Client = Depends("nats"),
+        publisher: EventPublisher = Depends("event_publisher"),
 ):
     # logging.info(f"ENVIRON {data}")
     query_string = data.get('QUERY_STRING', '')
@@ -129,8 +137,8 @@ async def connect(
 
     logging.info(f"User {user_session.user_uuid} authenticated successfully")
 
-    await publish_user_online(nc, user_session.user_uuid)
-    await publish_enable_fliji_mode(nc, user_session.user_uuid)
+    await publish_user_online(publisher, user_session.user_uuid)
+    await publish_enable_fliji_mode(publisher, user_session.user_uuid)
 
 
 async def ping(
@@ -156,8 +164,8 @@ async def disconnect(
         sid,
         reason = None,
         app: SocketioApplication = Depends("app"),
-        db: Database = Depends("db"),
-        nc: Client = Depends("nats"),
+        db: AsyncDatabase = Depends("db"),
+        publisher: EventPublisher = Depends("event_publisher"),
 ):
     """
     Этот ивент отвечает за отключение пользователя от сокета.
@@ -174,7 +182,7 @@ async def disconnect(
         return
 
     user_uuid = user_session.user_uuid
-    await publish_user_disconnected(nc, user_uuid)
+    await publish_user_disconnected(publisher, user_uuid)
 
     timeline_watch_session_data = await get_timeline_watch_session_by_user_uuid(db, user_uuid)
     if not timeline_watch_session_data:
@@ -183,7 +191,7 @@ async def disconnect(
     try:
         timeline_watch_session = TimelineWatchSession.model_validate(
             timeline_watch_session_data)
-        await handle_user_leaving_timeline(app, db, nc, timeline_watch_session)
+        await handle_user_leaving_timeline(app, db, publisher, timeline_watch_session)
     except ValidationError as e:
         logging.error(
             f"Could not handle user timeline leave for user {user_uuid}. "
@@ -194,8 +202,8 @@ async def timeline_connect(
         sid,
         data: TimelineConnectRequest,
         app: SocketioApplication = Depends("app"),
-        nc: Client = Depends("nats"),
-        db: Database = Depends("db"),
+        publisher: EventPublisher = Depends("event_publisher"),
+        db: AsyncDatabase = Depends("db"),
         session: UserSioSession = Depends("sio_session"),
 ):
     """
@@ -208,7 +216,8 @@ async def timeline_connect(
 
     Event `timeline_chat_history` is emitted to the user:
 
-    Response is an array of:
+    Response is an array of the latest messages, oldest first
+    (older ones are fetched with :py:func:`timeline_fetch_chat_messages`):
     :py:class:`fliji_sockets.models.database.TimelineChatMessage`
 
     Event `timeline_groups` is emitted to the user:
@@ -216,8 +225,13 @@ async def timeline_connect(
     Response is an array of:
     :py:class:`fliji_sockets.models.database.TimelineGroupDataResponse`
 
+    If `groups_delta` is set in the request, `timeline_groups` is not sent.
+    Event `timeline_groups_snapshot` is emitted to the user instead
+    and the changes are then sent as `timeline_groups_delta`.
+    See :py:func:`timeline_groups_resync`.
+
     Event `timeline_user_avatars` is emitted to the user
-    (or to everybody on the timeline if there were less than 6 users):
+    (or to everybody on the timeline if the user is one of the first 6 users):
     The data is an array of (max 6 elements):
 
     Response is:
@@ -230,11 +244,11 @@ async def timeline_connect(
     await delete_timeline_watch_session_by_user_uuid(db, user_uuid)
 
     # publish that the user connected to the timeline
-    await publish_user_connected_to_timeline(nc, user_uuid, data.video_uuid)
+    await publish_user_connected_to_timeline(publisher, user_uuid, data.video_uuid)
     # This is left as legacy, on mobile there's no fliji mode
     # and the default behaviour is as if fliji mode is enabled
     # TODO: remove fliji mode
-    await publish_enable_fliji_mode(nc, user_uuid)
+    await publish_enable_fliji_mode(publisher, user_uuid)
 
     # create a single group on the timeline for the user
     group = TimelineGroup(
@@ -273,26 +287,23 @@ async def timeline_connect(
     # join socketio rooms
     await app.enter_room(sid, sio_video_room_identifier)
     await app.enter_room(sid, sio_group_room_identifier)
+    await handle_user_joining_timeline_groups(app, db, sid, data.video_uuid, data.groups_delta)
 
     # send the initial data to the user who just connected
-    chat_messages = await get_timeline_chat_messages_by_video_uuid(db, watch_session.video_uuid)
+    chat_messages, _ = await get_timeline_chat_messages_by_video_uuid(db, watch_session.video_uuid)
     await app.emit(
         "timeline_chat_history",
         TimelineChatHistoryResponse(root=chat_messages),
         room=sid,
     )
 
-    timeline_groups = await get_timeline_groups(db, watch_session.video_uuid)
-    await app.emit(
-        "timeline_groups",
-        TimelineGroupResponse(root=timeline_groups),
-        room=get_room_name(watch_session.video_uuid),
-    )
+    schedule_timeline_groups_broadcast(app, db, watch_session.video_uuid)
 
     timeline_user_avatars = await get_timeline_user_avatars(db, watch_session.video_uuid)
     timeline_user_count = await get_video_watch_session_count(db, watch_session.video_uuid)
 
-    if timeline_user_count < 6:
+    # the others only need the strip if the user made it into it
+    if any(avatar["user_uuid"] == user_uuid for avatar in timeline_user_avatars):
         room = get_room_name(watch_session.video_uuid)
     else:
         room = sid
@@ -322,7 +333,7 @@ async def timeline_connect(
 async def timeline_set_mic_enabled(
         data: TimelineSetMicEnabled,
         app: SocketioApplication = Depends("app"),
-        db: Database = Depends("db"),
+        db: AsyncDatabase = Depends("db"),
         watch_session: TimelineWatchSession = Depends("timeline_session"),
 ):
     """
@@ -344,7 +355,8 @@ async def timeline_set_mic_enabled(
         }
     """
     watch_session.mic_enabled = data.mic_enabled
-    await upsert_timeline_watch_session(db, watch_session)
+    await update_timeline_watch_session(db, watch_session.user_uuid,
+                                        {"mic_enabled": data.mic_enabled})
 
     await app.emit(
         "timeline_user_mic_state_changed",
@@ -360,7 +372,7 @@ async def timeline_update_timecode(
         sid,
         data: TimelineUpdateTimecodeRequest,
         app: SocketioApplication = Depends("app"),
-        db: Database = Depends("db"),
+        db: AsyncDatabase = Depends("db"),
         session: UserSioSession = Depends("sio_session"),
         group: TimelineGroup = Depends("timeline_group"),
 ):
@@ -373,6 +385,10 @@ async def timeline_update_timecode(
 
     Если видео было на паузе, то при обновлении таймкода on_pause ставится в False.
 
+    The server extrapolates the position of a playing group from the last timecode,
+    so the host only needs to send it on seeks: a timecode within TIMECODE_DRIFT_TOLERANCE
+    of the extrapolated position is ignored.
+
     Request:
     :py:class:`fliji_sockets.models.socket.TimelineUpdateTimecodeRequest`
 
@@ -409,7 +425,14 @@ async def timeline_update_timecode(
                                      " You can't send the timecode.")
         return
 
+    now = datetime.now()
+    position = group.get_position(now)
+    if position is not None and abs(position - data.timecode) <= TIMECODE_DRIFT_TOLERANCE:
+        # the playback clock of the server is already there
+        return
+
     group.watch_time = data.timecode
+    group.watch_time_updated_at = now
 
     # if group.on_pause:
     #     group.on_pause = False
@@ -434,22 +457,17 @@ async def timeline_update_timecode(
     #     room=get_room_name(group.video_uuid),
     # )
 
-    await upsert_timeline_group(db, group)
+    await update_timeline_group_timecode(db, group)
 
-    groups = await get_timeline_groups(db, group.video_uuid)
-    await app.emit(
-        "timeline_groups",
-        TimelineGroupResponse(root=groups),
-        room=get_room_name(group.video_uuid),
-    )
+    schedule_timeline_groups_broadcast(app, db, group.video_uuid)
 
 
 async def timeline_change_group(
         sid,
         data: TimelineChangeGroupRequest,
         app: SocketioApplication = Depends("app"),
-        nc: Client = Depends("nats"),
-        db: Database = Depends("db"),
+        publisher: EventPublisher = Depends("event_publisher"),
+        db: AsyncDatabase = Depends("db"),
         watch_session: TimelineWatchSession = Depends("timeline_session"),
         group: TimelineGroup = Depends("timeline_group"),
 ):
@@ -509,40 +527,37 @@ async def timeline_change_group(
             await app.send_error_message(sid, "You are already in a single group.")
             return
 
-        await handle_user_leaving_group(app, nc, db, watch_session)
+        await handle_user_leaving_group(app, publisher, db, watch_session)
         await handle_user_joining_new_single_room(app, db, watch_session)
 
     # we have an option to join to a group by uuid of one of the participants
     if data.user_uuid is not None:
-        try:
-            target_user_watch_session = await get_watch_session_or_fail(db, data.user_uuid)
-            group_uuid = target_user_watch_session.group_uuid
-        except Exception as e:
-            logging.warning(f"Couldn't get watch session for user with uuid {data.user_uuid}: {e}")
+        target_user_watch_session = await get_timeline_watch_session_by_user_uuid(
+            db, data.user_uuid, WatchSessionProjection.MEMBERSHIP
+        )
+        if target_user_watch_session is None:
+            logging.warning(f"Couldn't get watch session for user with uuid {data.user_uuid}")
             await app.send_error_message(sid, f"Could not find user with uuid {data.user_uuid}.")
             return
+        group_uuid = target_user_watch_session.get("group_uuid")
     else:
         group_uuid = data.group_uuid
 
-    # disable user mic when change or leave group
-    watch_session.mic_enabled = False
-    await upsert_timeline_watch_session(db, watch_session)
-
     # join an existing room
     if group_uuid:
-        try:
-            new_group = await get_group_or_fail(db, group_uuid)
-        except Exception as e:
+        # counted in the new group first, so that the user is not left without a group
+        new_group_data = await join_timeline_group(db, group_uuid)
+        if new_group_data is None:
             await app.send_error_message(sid, "Could not get group.")
-            logging.error(f"Error getting group: {e}")
+            logging.error(f"Error getting group: group {group_uuid} not found")
             return
+        new_group = TimelineGroup.model_validate(new_group_data)
 
-        # leave the old group. this sends events, too
-        await handle_user_leaving_group(app, nc, db, watch_session)
+        # leave the old group. this sends events, too, and disables the user's mic
+        await handle_user_leaving_group(app, publisher, db, watch_session)
         watch_session.group_uuid = new_group.group_uuid
-        new_group.users_count += 1
-        await upsert_timeline_watch_session(db, watch_session)
-        await upsert_timeline_group(db, new_group)
+        await update_timeline_watch_session(db, watch_session.user_uuid,
+                                            {"group_uuid": new_group.group_uuid})
         # join socketio room
         await app.enter_room(sid, get_room_name(new_group.group_uuid))
 
@@ -558,33 +573,31 @@ async def timeline_change_group(
             "timeline_you_joined_group",
             {
                 "group_uuid": new_group.group_uuid,
-                "timecode": new_group.watch_time,
+                "timecode": new_group.get_position(),
             },
             room=sid
         )
 
         # sent event to host user for start chat
         if len(timeline_current_group) == 2:
-            host_user_sid = await get_watch_session_or_fail(db, new_group.host_user_uuid)
-            await app.emit(
-                "timeline_start_voice_chat",
-                {"group_uuid": new_group.group_uuid},
-                room=host_user_sid.sid
+            host_watch_session = await get_timeline_watch_session_by_user_uuid(
+                db, new_group.host_user_uuid, WatchSessionProjection.MEMBERSHIP
             )
+            if host_watch_session is not None:
+                await app.emit(
+                    "timeline_start_voice_chat",
+                    {"group_uuid": new_group.group_uuid},
+                    room=host_watch_session["sid"]
+                )
 
-    timeline_groups = await get_timeline_groups(db, watch_session.video_uuid)
-    await app.emit(
-        "timeline_groups",
-        TimelineGroupResponse(root=timeline_groups),
-        room=get_room_name(watch_session.video_uuid),
-    )
+    schedule_timeline_groups_broadcast(app, db, watch_session.video_uuid)
 
 
 async def timeline_leave(
         watch_session: TimelineWatchSession = Depends("timeline_session"),
         app: SocketioApplication = Depends("app"),
-        nc: Client = Depends("nats"),
-        db: Database = Depends("db"),
+        publisher: EventPublisher = Depends("event_publisher"),
+        db: AsyncDatabase = Depends("db"),
 ):
     """
     Отключиться от таймлайна видео.
@@ -611,14 +624,14 @@ async def timeline_leave(
         }
 
     """
-    await handle_user_leaving_timeline(app, db, nc, watch_session)
+    await handle_user_leaving_timeline(app, db, publisher, watch_session)
 
 
 async def timeline_pause(
         sid,
         data: TimelinePauseRequest,
         app: SocketioApplication = Depends("app"),
-        db: Database = Depends("db"),
+        db: AsyncDatabase = Depends("db"),
         session: UserSioSession = Depends("sio_session"),
         group: TimelineGroup = Depends("timeline_group"),
 ):
@@ -644,7 +657,8 @@ async def timeline_pause(
 
     group.on_pause = True
     group.watch_time = data.timecode
-    await upsert_timeline_group(db, group)
+    group.watch_time_updated_at = datetime.now()
+    await update_timeline_group_playback(db, group)
 
     sio_room_identifier = get_room_name(group.video_uuid)
 
@@ -663,7 +677,7 @@ async def timeline_unpause(
         sid,
         data: TimelinePauseRequest,
         app: SocketioApplication = Depends("app"),
-        db: Database = Depends("db"),
+        db: AsyncDatabase = Depends("db"),
         session: UserSioSession = Depends("sio_session"),
         group: TimelineGroup = Depends("timeline_group"),
 ):
@@ -690,9 +704,10 @@ async def timeline_unpause(
         await app.send_error_message(sid, "You are not the host of the group.")
         return
 
-    group.on_pause = True
+    group.on_pause = False
     group.watch_time = data.timecode
-    await upsert_timeline_group(db, group)
+    group.watch_time_updated_at = datetime.now()
+    await update_timeline_group_playback(db, group)
 
     sio_room_identifier = get_room_name(group.video_uuid)
 
@@ -707,10 +722,58 @@ async def timeline_unpause(
     )
 
 
+async def timeline_get_group_position(
+        sid,
+        data: TimelineGetGroupPositionRequest,
+        app: SocketioApplication = Depends("app"),
+        db: AsyncDatabase = Depends("db"),
+        watch_session: TimelineWatchSession = Depends("timeline_session"),
+):
+    """
+    Получить текущую позицию воспроизведения группы.
+
+    The position is extrapolated from the last timecode, pause or unpause of the host,
+    without waiting for a timecode update.
+
+    Request:
+    :py:class:`fliji_sockets.models.socket.TimelineGetGroupPositionRequest`
+
+    Response (emitted to the user):
+    `timeline_group_position` event
+
+    :py:class:`fliji_sockets.models.socket.TimelineGroupPositionResponse`
+    """
+    group_uuid = data.group_uuid or watch_session.group_uuid
+    if group_uuid is None:
+        await app.send_error_message(sid, "You are not in a group.")
+        return
+
+    try:
+        group = await get_group_or_fail(db, group_uuid)
+    except NoGroupError:
+        group = None
+    if group is None or group.video_uuid != watch_session.video_uuid:
+        await app.send_error_message(sid, "Group not found.")
+        return
+
+    now = datetime.now()
+    await app.emit(
+        "timeline_group_position",
+        TimelineGroupPositionResponse(
+            group_uuid=group.group_uuid,
+            timecode=group.get_position(now),
+            on_pause=bool(group.on_pause),
+            server_time=now,
+        ),
+        room=sid,
+    )
+
+
 async def timeline_send_chat_message(
+        sid: str,
         data: TimelineSendChatMessageRequest,
         app: SocketioApplication = Depends("app"),
-        db: Database = Depends("db"),
+        db: AsyncDatabase = Depends("db"),
         watch_session: TimelineWatchSession = Depends("timeline_session"),
 ):
     """
@@ -718,6 +781,12 @@ async def timeline_send_chat_message(
 
     Ивент о новом сообщении отправляется всем пользователям на таймлайне.
 
+    The messages are written and broadcast by the chat pipeline:
+    a message sent to a quiet video is emitted right away as `timeline_chat_message`,
+    the messages sent to a busy video within CHAT_BATCH_INTERVAL are emitted together
+    as one `timeline_chat_messages` event, oldest first.
+    If the messages can't be written, they are not emitted and the user gets an `err`.
+
     Request:
     :py:class:`fliji_sockets.models.socket.TimelineSendChatMessageRequest`
 
@@ -725,6 +794,10 @@ async def timeline_send_chat_message(
     `timeline_chat_message` event
 
     :py:class:`fliji_sockets.models.database.TimelineChatMessage`
+
+    or `timeline_chat_messages` event
+
+    list of :py:class:`fliji_sockets.models.database.TimelineChatMessage`
     """
     chat_message = TimelineChatMessage(
         user_uuid=watch_session.user_uuid,
@@ -737,21 +810,48 @@ async def timeline_send_chat_message(
         created_at=datetime.now(),
     )
 
-    await insert_timeline_chat_message(db, chat_message)
+    chat_pipeline.put(db, app, sid, chat_message)
+
+
+async def timeline_fetch_chat_messages(
+        sid,
+        data: TimelineFetchChatMessages,
+        app: SocketioApplication = Depends("app"),
+        db: AsyncDatabase = Depends("db"),
+        watch_session: TimelineWatchSession = Depends("timeline_session"),
+):
+    """
+    Получить более старые сообщения чата таймлайна.
+
+    The cursor is the `created_at` and `id` of the oldest message the client has,
+    the page holds the messages sent before it, oldest first.
+    `limit` defaults to and is capped at CHAT_HISTORY_PAGE_SIZE.
 
+    Request:
+    :py:class:`fliji_sockets.models.socket.TimelineFetchChatMessages`
+
+    Response (emitted to the user):
+    `timeline_chat_messages_page` event
+
+    :py:class:`fliji_sockets.models.socket.TimelineChatMessagesPageResponse`
+    """
+    if not ObjectId.is_valid(data.before_id):
+        await app.send_error_message(sid, "Invalid before_id.")
+        return
+    # is_valid also accepts upper case hex, the stored ids are lower case hex
+    before_id = str(ObjectId(data.before_id))
+
+    messages, has_more = await get_timeline_chat_messages_by_video_uuid(
+        db,
+        watch_session.video_uuid,
+        limit=min(data.limit or CHAT_HISTORY_PAGE_SIZE, CHAT_HISTORY_PAGE_SIZE),
+        before_created_at=data.before_created_at,
+        before_id=before_id,
+    )
     await app.emit(
-        "timeline_chat_message",
-        {
-            "id": str(chat_message.id),
-            "user_uuid": chat_message.user_uuid,
-            "message": chat_message.message,
-            "username": chat_message.username,
-            "user_avatar": chat_message.user_avatar,
-            "first_name": chat_message.first_name,
-            "last_name": chat_message.last_name,
-            "created_at": chat_message.created_at.isoformat(),
-        },
-        room=get_room_name(watch_session.video_uuid),
+        "timeline_chat_messages_page",
+        TimelineChatMessagesPageResponse(messages=messages, has_more=has_more),
+        room=sid,
     )
 
 
@@ -759,8 +859,8 @@ async def timeline_reconnect(
         sid,
         data: TimelineReConnectRequest,
         app: SocketioApplication = Depends("app"),
-        nc: Client = Depends("nats"),
-        db: Database = Depends("db"),
+        publisher: EventPublisher = Depends("event_publisher"),
+        db: AsyncDatabase = Depends("db"),
         session: UserSioSession = Depends("sio_session"),
 ):
 
@@ -770,7 +870,7 @@ async def timeline_reconnect(
     await delete_timeline_watch_session_by_user_uuid(db, user_uuid)
 
     # publish that the user connected to the timeline
-    await publish_user_connected_to_timeline(nc, user_uuid, data.video_uuid)
+    await publish_user_connected_to_timeline(publisher, user_uuid, data.video_uuid)
 
     # create a single group on the timeline for the user
     group = TimelineGroup(
@@ -798,15 +898,13 @@ async def timeline_reconnect(
         bio=session.bio,
     )
 
-    try:
-        old_group = await get_group_or_fail(db, data.group_uuid)
-        watch_session.group_uuid = old_group.group_uuid
-        group = old_group
-        group.users_count += 1
-    except Exception:
-        pass
+    old_group_data = await join_timeline_group(db, data.group_uuid)
+    if old_group_data is not None:
+        group = TimelineGroup.model_validate(old_group_data)
+        watch_session.group_uuid = group.group_uuid
+    else:
+        await upsert_timeline_group(db, group)
 
-    await upsert_timeline_group(db, group)
     await upsert_timeline_watch_session(db, watch_session)
 
     sio_video_room_identifier = get_room_name(data.video_uuid)
@@ -815,6 +913,7 @@ async def timeline_reconnect(
     # join socketio rooms
     await app.enter_room(sid, sio_video_room_identifier)
     await app.enter_room(sid, sio_group_room_identifier)
+    await handle_user_joining_timeline_groups(app, db, sid, data.video_uuid, data.groups_delta)
 
     timeline_current_group = await get_timeline_group_users_data(db, group.group_uuid)
     await app.emit(
@@ -828,27 +927,107 @@ async def timeline_reconnect(
         "timeline_you_joined_group",
         {
             "group_uuid": group.group_uuid,
-            "timecode": group.watch_time,
+            "timecode": group.get_position(),
         },
         room=sid
     )
 
     if len(timeline_current_group) == 2:
-        host_user_sid = await get_watch_session_or_fail(db, group.host_user_uuid)
-        await app.emit(
-            "timeline_start_voice_chat",
-            {"group_uuid": group.group_uuid},
-            room=host_user_sid.sid
+        host_watch_session = await get_timeline_watch_session_by_user_uuid(
+            db, group.host_user_uuid, WatchSessionProjection.MEMBERSHIP
         )
+        if host_watch_session is not None:
+            await app.emit(
+                "timeline_start_voice_chat",
+                {"group_uuid": group.group_uuid},
+                room=host_watch_session["sid"]
+            )
+
+    schedule_timeline_groups_broadcast(app, db, watch_session.video_uuid)
+
+
+async def timeline_groups_resync(
+        sid,
+        app: SocketioApplication = Depends("app"),
+        db: AsyncDatabase = Depends("db"),
+        watch_session: TimelineWatchSession = Depends("timeline_session"),
+):
+    """
+    Запросить полный список групп таймлайна.
+
+    Used by the clients subscribed to `timeline_groups_delta` (`groups_delta` in
+    `timeline_connect`). Every delta carries the `base_version` it applies to and the
+    resulting `version`. If `base_version` differs from the version the client holds,
+    a delta was missed and the client must resync.
+
+    Event `timeline_groups_delta` is emitted to the delta subscribers on the timeline:
 
-    timeline_groups = await get_timeline_groups(db, watch_session.video_uuid)
+    :py:class:`fliji_sockets.models.socket.TimelineGroupsDeltaResponse`
+
+    Response (emitted to the user):
+    `timeline_groups_snapshot` event
+
+    :py:class:`fliji_sockets.models.socket.TimelineGroupsSnapshotResponse`
+    """
+    timeline_groups = await get_timeline_groups_response(db, watch_session.video_uuid)
     await app.emit(
-        "timeline_groups",
-        TimelineGroupResponse(root=timeline_groups),
-        room=get_room_name(watch_session.video_uuid),
+        "timeline_groups_snapshot",
+        await timeline_groups_versions.encoded_snapshot(watch_session.video_uuid, timeline_groups),
+        room=sid,
     )
 
 
+async def timeline_groups_viewport(
+        sid,
+        data: TimelineGroupsViewportRequest,
+        app: SocketioApplication = Depends("app"),
+        db: AsyncDatabase = Depends("db"),
+        watch_session: TimelineWatchSession = Depends("timeline_session"),
+):
+    """
+    Получить только часть групп таймлайна, для видео с большим количеством групп.
+
+    Without a cursor, the user is subscribed to the first `limit` groups in the given sort:
+    `timeline_groups` and `timeline_groups_delta` are no longer sent to the user,
+    `timeline_groups_viewport` is sent instead whenever the groups change.
+    `limit` is rounded up to one of the sizes of GROUPS_VIEWPORT_SIZES.
+
+    With the `next_cursor` of a page, the next page is sent once, the subscription is kept.
+
+    The `friends` sort is not supported, this service doesn't know the friends of the users.
+
+    Request:
+    :py:class:`fliji_sockets.models.socket.TimelineGroupsViewportRequest`
+
+    Response (emitted to the user):
+    `timeline_groups_viewport` event
+
+    :py:class:`fliji_sockets.models.socket.TimelineGroupsViewportResponse`
+    """
+    video_uuid = watch_session.video_uuid
+    largest_size = max(GROUPS_VIEWPORT_SIZES)
+
+    if data.cursor is None:
+        size = min(
+            (size for size in GROUPS_VIEWPORT_SIZES if size >= data.limit), default=largest_size
+        )
+        await leave_groups_rooms(app, sid, video_uuid)
+        viewport_room = get_groups_viewport_room_name(video_uuid, data.sort, size)
+        await app.enter_room(sid, viewport_room)
+        # the broadcasts only build the viewports with subscribers
+        await room_subscribers.add(viewport_room, sid)
+    else:
+        size = min(data.limit, largest_size)
+
+    try:
+        page = await get_timeline_groups_page(db, video_uuid, data.sort, size, data.cursor)
+    except ValueError:
+        await app.send_error_message(sid, "Invalid cursor.")
+        return
+
+    await app.emit("timeline_groups_viewport", page, room=sid)
+
+
 def register_events(app: SocketioApplication) -> None:
     app.event("connect")(connect)
     app.event("disconnect")(disconnect)
@@ -861,5 +1040,9 @@ def register_events(app: SocketioApplication) -> None:
     app.event("timeline_leave")(timeline_leave)
     app.event("timeline_pause")(timeline_pause)
     app.event("timeline_unpause")(timeline_unpause)
+    app.event("timeline_get_group_position")(timeline_get_group_position)
     app.event("timeline_send_chat_message")(timeline_send_chat_message)
+    app.event("timeline_fetch_chat_messages")(timeline_fetch_chat_messages)
+    app.event("timeline_groups_resync")(timeline_groups_resync)
+    app.event("timeline_groups_viewport")(timeline_groups_viewport)
 
@@ -0,0 +1,301 @@
+import logging
+import time
+
+import redis.asyncio as redis
+
+from fliji_sockets.core.serialization import EncodedPayload, encode_payload
+from fliji_sockets.models.socket import TimelineGroupResponse, TimelineGroupDataResponse, \
+    TimelineGroupsDeltaResponse, TimelineGroupChangeResponse, TimelineGroupsSnapshotResponse
+from fliji_sockets.settings import REDIS_CONNECTION_STRING, GROUPS_STATE_BACKEND
+
+
+def _diff_groups(video_uuid: str, base_version: int, version: int,
+                 previous_groups: dict[str, TimelineGroupDataResponse],
+                 groups: dict[str, TimelineGroupDataResponse]) -> TimelineGroupsDeltaResponse | None:
+    """Returns None if nothing changed"""
+    added = []
+    changed = []
+    for group_uuid, group in groups.items():
+        previous_group = previous_groups.get(group_uuid)
+        if previous_group is None:
+            added.append(group)
+        elif previous_group != group:
+            changed.append(_diff_group(previous_group, group))
+
+    removed = [group_uuid for group_uuid in previous_groups if group_uuid not in groups]
+
+    if not added and not changed and not removed:
+        return None
+
+    return TimelineGroupsDeltaResponse(
+        video_uuid=video_uuid,
+        base_version=base_version,
+        version=version,
+        added=added,
+        changed=changed,
+        removed=removed,
+    )
+
+
+def _diff_group(previous: TimelineGroupDataResponse,
+                current: TimelineGroupDataResponse) -> TimelineGroupChangeResponse:
+    previous_users = {user.user_uuid: user for user in previous.users}
+    current_users = {user.user_uuid: user for user in current.users}
+
+    return TimelineGroupChangeResponse(
+        group_uuid=current.group_uuid,
+        host_user_uuid=current.host_user_uuid,
+        on_pause=current.on_pause,
+        users_count=current.users_count,
+        video_ended=current.video_ended,
+        watch_time=current.watch_time,
+        watch_time_updated_at=current.watch_time_updated_at,
+        added_users=[
+            user for user_uuid, user in current_users.items() if user_uuid not in previous_users
+        ],
+        changed_users=[
+            user for user_uuid, user in current_users.items()
+            if user_uuid in previous_users and previous_users[user_uuid] != user
+        ],
+        removed_users=[
+            user_uuid for user_uuid in previous_users if user_uuid not in current_users
+        ],
+    )
+
+
+def _expire_oldest(entries: dict, ttl: float, now: float) -> None:
+    """Drops the expired entries, kept ordered by their last change, the oldest first"""
+    while entries:
+        key = next(iter(entries))
+        if now - entries[key].updated_at <= ttl:
+            return
+        del entries[key]
+
+
+class _VideoGroupsVersion:
+    __slots__ = ("version", "groups", "payload", "updated_at")
+
+    def __init__(self, version: int, groups: dict[str, TimelineGroupDataResponse],
+                 updated_at: float):
+        self.version = version
+        self.groups = groups
+        self.payload: EncodedPayload | None = None
+        self.updated_at = updated_at
+
+
+class _EncodedSnapshot:
+    __slots__ = ("version", "payload", "updated_at")
+
+    def __init__(self, version: int, payload: EncodedPayload, updated_at: float):
+        self.version = version
+        self.payload = payload
+        self.updated_at = updated_at
+
+
+class MemoryGroupsVersions:
+    """
+    Tracks the last `timeline_groups` snapshot broadcast for each video,
+    so that only the difference to it is sent to the clients subscribed to deltas.
+    Only knows the deltas broadcast by this node, so it's only correct with a single node.
+
+    Versions come from a single counter: they only grow,
+    and a client can detect a missed delta by comparing base_version with the version it holds.
+    The state of a video is kept when its last group is removed,
+    so the next delta is still based on the version the clients hold.
+    It is dropped ``ttl`` seconds after its last change, the next delta is then based on version 0
+    and the clients resync.
+    """
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        # ordered by last change, the oldest first
+        self._versions: dict[str, _VideoGroupsVersion] = {}
+        self._counter = 0
+
+    async def diff(self, video_uuid: str,
+                   response: TimelineGroupResponse) -> TimelineGroupsDeltaResponse | None:
+        """Advances the version of the video, returns None if nothing changed"""
+        now = time.monotonic()
+        _expire_oldest(self._versions, self._ttl, now)
+
+        groups = {group.group_uuid: group for group in response.root}
+        previous = self._versions.get(video_uuid)
+        base_version = previous.version if previous is not None else 0
+        previous_groups = previous.groups if previous is not None else {}
+
+        delta = _diff_groups(video_uuid, base_version, self._counter + 1, previous_groups, groups)
+        if delta is None:
+            return None
+
+        self._counter += 1
+        # moved to the end, it's now the last changed video
+        self._versions.pop(video_uuid, None)
+        self._versions[video_uuid] = _VideoGroupsVersion(delta.version, groups, now)
+        return delta
+
+    async def encoded_snapshot(self, video_uuid: str,
+                               response: TimelineGroupResponse) -> EncodedPayload:
+        """
+        Returns the last broadcast snapshot of the video, the one the next delta is based on,
+        encoded once per version.
+        The given response is only used if nothing was broadcast yet.
+        """
+        _expire_oldest(self._versions, self._ttl, time.monotonic())
+        if video_uuid not in self._versions:
+            await self.diff(video_uuid, response)
+
+        previous = self._versions.get(video_uuid)
+        if previous is None:
+            return encode_payload(
+                TimelineGroupsSnapshotResponse(video_uuid=video_uuid, version=0, groups=[])
+            )
+
+        if previous.payload is None:
+            previous.payload = encode_payload(TimelineGroupsSnapshotResponse(
+                video_uuid=video_uuid,
+                version=previous.version,
+                groups=list(previous.groups.values()),
+            ))
+        return previous.payload
+
+    async def clear(self) -> None:
+        self._versions.clear()
+
+    async def close(self) -> None:
+        pass
+
+
+# replaces the snapshot only if nobody replaced it since it was read
+_SET_IF_VERSION = """
+local current = redis.call('hget', KEYS[1], 'version')
+if (current or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('hset', KEYS[1], 'version', ARGV[2], 'groups', ARGV[3])
+redis.call('expire', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+class RedisGroupsVersions:
+    """
+    Tracks the last `timeline_groups` snapshot broadcast for each video in Redis,
+    so that the deltas broadcast by all the nodes form a single chain of versions.
+
+    Versions come from a counter shared by the nodes, see MemoryGroupsVersions.
+    A node advances the version of a video only if it's still the one its delta is based on,
+    otherwise the delta is computed again from the snapshot stored by the other node.
+    The snapshots expire if no delta refreshes them, the next delta is then based on version 0
+    and the clients resync.
+    """
+
+    # times a delta is computed again after a concurrent broadcast of another node
+    MAX_ATTEMPTS = 3
+
+    def __init__(self, connection_string: str, key_prefix: str, counter_key: str, ttl: int):
+        self._connection_string = connection_string
+        self._key_prefix = key_prefix
+        # not cleared with the snapshots, so the versions never go back
+        self._counter_key = counter_key
+        self._ttl = ttl
+        self._redis: redis.Redis | None = None
+        # last snapshot encoded for each video, ordered by encoding time, the oldest first.
+        # Dropped with the same ttl as the snapshots, a snapshot still in use is encoded again.
+        self._payloads: dict[str, _EncodedSnapshot] = {}
+
+    def _client(self) -> redis.Redis:
+        # created on first use, so that it's bound to the event loop using it
+        if self._redis is None:
+            self._redis = redis.from_url(self._connection_string)
+        return self._redis
+
+    def _key(self, video_uuid: str) -> str:
+        return f"{self._key_prefix}{video_uuid}"
+
+    async def _get(self, video_uuid: str) -> tuple[int, dict[str, TimelineGroupDataResponse]]:
+        version, groups = await self._client().hmget(self._key(video_uuid), "version", "groups")
+        if version is None:
+            return 0, {}
+        response = TimelineGroupResponse.model_validate_json(groups)
+        return int(version), {group.group_uuid: group for group in response.root}
+
+    async def diff(self, video_uuid: str,
+                   response: TimelineGroupResponse) -> TimelineGroupsDeltaResponse | None:
+        """Advances the version of the video, returns None if nothing changed"""
+        groups = {group.group_uuid: group for group in response.root}
+        encoded_groups = response.model_dump_json()
+
+        for _ in range(self.MAX_ATTEMPTS):
+            base_version, previous_groups = await self._get(video_uuid)
+            delta = _diff_groups(video_uuid, base_version, 0, previous_groups, groups)
+            if delta is None:
+                return None
+
+            version = await self._client().incr(self._counter_key)
+            stored = await self._client().eval(
+                _SET_IF_VERSION, 1, self._key(video_uuid),
+                base_version, version, encoded_groups, self._ttl,
+            )
+            if stored:
+                return delta.model_copy(update={"version": version})
+
+        logging.warning(f"Groups delta of video {video_uuid} not broadcast, the version kept changing")
+        return None
+
+    async def encoded_snapshot(self, video_uuid: str,
+                               response: TimelineGroupResponse) -> EncodedPayload:
+        """
+        Returns the last broadcast snapshot of the video, the one the next delta is based on,
+        encoded once per version.
+        The given response is only used if nothing was broadcast yet.
+        """
+        version, groups = await self._get(video_uuid)
+        if version == 0:
+            await self.diff(video_uuid, response)
+            version, groups = await self._get(video_uuid)
+
+        now = time.monotonic()
+        _expire_oldest(self._payloads, self._ttl, now)
+        cached = self._payloads.get(video_uuid)
+        if cached is not None and cached.version == version:
+            return cached.payload
+
+        payload = encode_payload(TimelineGroupsSnapshotResponse(
+            video_uuid=video_uuid,
+            version=version,
+            groups=list(groups.values()),
+        ))
+        self._payloads.pop(video_uuid, None)
+        self._payloads[video_uuid] = _EncodedSnapshot(version, payload, now)
+        return payload
+
+    async def clear(self) -> None:
+        self._payloads.clear()
+        client = self._client()
+        async for key in client.scan_iter(match=f"{self._key_prefix}*"):
+            await client.delete(key)
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+# a day without any change of the groups of a video
+GROUPS_VERSIONS_TTL = 86400
+
+
+def create_groups_versions(backend: str) -> MemoryGroupsVersions | RedisGroupsVersions:
+    if backend == "memory":
+        return MemoryGroupsVersions(GROUPS_VERSIONS_TTL)
+    if backend == "redis":
+        return RedisGroupsVersions(
+            REDIS_CONNECTION_STRING,
+            "fliji_sockets:groups_versions:",
+            "fliji_sockets:groups_versions_counter",
+            GROUPS_VERSIONS_TTL,
+        )
+    raise ValueError(f"Unknown groups state backend: {backend}")
+
+
+timeline_groups_versions = create_groups_versions(GROUPS_STATE_BACKEND)
@@ -71,6 +71,21 @@ def get_room_name(voice_uuid: str) -> str:
     return f"room_{voice_uuid}"
 
 
+def get_groups_room_name(video_uuid: str) -> str:
+    """Room of the clients receiving the full `timeline_groups` list"""
+    return f"room_{video_uuid}_groups"
+
+
+def get_groups_delta_room_name(video_uuid: str) -> str:
+    """Room of the clients receiving `timeline_groups_delta`"""
+    return f"room_{video_uuid}_groups_delta"
+
+
+def get_groups_viewport_room_name(video_uuid: str, sort: str, size: int) -> str:
+    """Room of the clients receiving the first `size` groups in the given sort"""
+    return f"room_{video_uuid}_groups_{sort}_{size}"
+
+
 T = TypeVar("T")  # Generic type for return values
 
 def run_async_task(coro: Coroutine[Any, Any, T], loop: Optional[asyncio.AbstractEventLoop] = None) -> T:
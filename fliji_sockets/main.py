@@ -1,18 +1,26 @@
 import asyncio
+import logging
 
-from pymongo.database import Database
+from pymongo.asynchronous.database import AsyncDatabase
 
 # noinspection PyUnresolvedReferences
 import fliji_sockets.dependencies  # Ensure dependencies are registered
 # noinspection PyUnresolvedReferences
 import fliji_sockets.events.handlers  # Ensure events are registered
+from fliji_sockets.chat_pipeline import chat_pipeline
 from fliji_sockets.core.di import container
+from fliji_sockets.core.metrics import MetricsASGIApp
 from fliji_sockets.core.socketio_application import SocketioApplication
 from fliji_sockets.debug_data import load_debug_data
 from fliji_sockets.events.handlers import register_events
+from fliji_sockets.groups_versions import timeline_groups_versions
 from fliji_sockets.helpers import configure_logging, configure_sentry, run_async_task
-from fliji_sockets.settings import APP_ENV
-from fliji_sockets.store import delete_all_timeline_groups, delete_all_timeline_watch_sessions
+from fliji_sockets.settings import APP_ENV, VIEWER_COUNT_RECONCILE_INTERVAL, METRICS_PATH
+from fliji_sockets.store import delete_all_timeline_groups, delete_all_timeline_watch_sessions, \
+    timecode_write_buffer, get_database, ensure_indexes, find_collection_scans, \
+    reconcile_viewer_counts
+from fliji_sockets.room_subscribers import room_subscribers
+from fliji_sockets.viewer_counter import viewer_counter
 
 # Configure logging and monitoring
 configure_logging()
@@ -22,24 +30,66 @@ configure_sentry()
 loop = asyncio.new_event_loop()
 
 
-def clear_data_on_startup(database: Database):
+async def clear_data_on_startup(database: AsyncDatabase):
     # timeline groups and watch sessions
-    delete_all_timeline_groups(database)
-    delete_all_timeline_watch_sessions(database)
+    await delete_all_timeline_groups(database)
+    await delete_all_timeline_watch_sessions(database)
     # delete_all_timeline_chat_messages(database)
 
 
+async def flush_event_publisher():
+    publisher = container.get_instance("event_publisher")
+    if publisher is not None:
+        await publisher.flush()
+
+
+async def reconcile_viewer_counts_periodically():
+    db = await container.get("db")
+    while True:
+        await asyncio.sleep(VIEWER_COUNT_RECONCILE_INTERVAL)
+        try:
+            await reconcile_viewer_counts(db)
+        except Exception as e:
+            logging.error(f"Error reconciling viewer counts: {e}")
+
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def start_background_tasks():
+    task = asyncio.create_task(reconcile_viewer_counts_periodically())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
 async def setup_dependencies():
     """Initialize async dependencies."""
-    db = await container.get("db")
+    db = get_database()
 
-    clear_data_on_startup(db)
+    # cleared before creating the unique indexes, so stale duplicates can't make it fail
+    await clear_data_on_startup(db)
+    await ensure_indexes(db)
 
     if APP_ENV in ["dev", "local"]:
         await load_debug_data(db)
 
+        for collection_scan in await find_collection_scans(db):
+            logging.warning(f"Query does a collection scan: {collection_scan}")
+
+    # The async client is bound to the event loop it was created on.
+    # This loop only runs the startup, so the client is closed here and
+    # the first event handled by uvicorn creates a new one on its own loop.
+    await db.client.close()
+    await viewer_counter.close()
+    await timeline_groups_versions.close()
+    await room_subscribers.close()
+
     sio_app = SocketioApplication()
     register_events(sio_app)
+    sio_app.on_startup(start_background_tasks)
+    sio_app.on_shutdown(timecode_write_buffer.flush)
+    sio_app.on_shutdown(chat_pipeline.flush)
+    sio_app.on_shutdown(flush_event_publisher)
 
     return sio_app
 
@@ -52,3 +102,5 @@ if not app:
 
 # Expose `asgi_app` for Uvicorn
 asgi_app = app.get_asgi_app()
+if METRICS_PATH:
+    asgi_app = MetricsASGIApp(asgi_app, METRICS_PATH)
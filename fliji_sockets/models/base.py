@@ -21,9 +21,8 @@ class ObjectIdAnnotation:
             python_schema=core_schema.union_schema(
                 [core_schema.is_instance_schema(ObjectId), object_id_schema]
             ),
-            serialization=core_schema.plain_serializer_function_ser_schema(
-                lambda x: str(x)
-            ),
+            # str() called by pydantic-core, also in python mode so that the ids are stored as strings
+            serialization=core_schema.to_string_ser_schema(when_used="always"),
         )
 
     @classmethod
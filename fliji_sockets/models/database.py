@@ -31,6 +31,22 @@ class TimelineGroup(MyBaseModel):
     users_count: int
     on_pause: bool | None = False
     watch_time: int | None = None
+    # when watch_time was set by the host, the anchor of the playback clock
+    watch_time_updated_at: datetime | None = None
+    created_at: datetime | None = Field(default_factory=datetime.now)
+
+    def get_position(self, now: datetime | None = None) -> int | None:
+        """
+        Current timecode of the group, extrapolated from the anchor while the video plays.
+        Without an anchor, the last watch_time is returned as is.
+        """
+        if self.watch_time is None or self.on_pause or self.watch_time_updated_at is None:
+            return self.watch_time
+
+        if now is None:
+            now = datetime.now()
+        elapsed = (now - self.watch_time_updated_at).total_seconds()
+        return self.watch_time + max(0, int(elapsed))
 
 
 class TimelineChatMessage(MyBaseModel):
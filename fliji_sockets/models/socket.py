@@ -1,6 +1,7 @@
 from datetime import datetime
+from typing import Literal
 
-from pydantic import RootModel
+from pydantic import RootModel, Field
 
 from fliji_sockets.models.base import MyBaseModel, PyObjectId
 
@@ -15,6 +16,8 @@ class OnConnectRequest(MyBaseModel):
 
 class TimelineConnectRequest(MyBaseModel):
     video_uuid: str
+    # receive `timeline_groups_delta` instead of the full `timeline_groups` list
+    groups_delta: bool = False
 
 
 class TimelineJoinGroupRequest(MyBaseModel):
@@ -36,7 +39,10 @@ class TimelineSetMicEnabled(MyBaseModel):
 
 
 class TimelineFetchChatMessages(MyBaseModel):
-    mic_enabled: bool
+    # cursor: the oldest message the client has, the page holds the messages sent before it
+    before_created_at: datetime
+    before_id: str
+    limit: int | None = Field(default=None, ge=1)
 
 
 class TimelineSendTimecodeToGroupRequest(MyBaseModel):
@@ -90,6 +96,8 @@ class TimelineGroupDataResponse(MyBaseModel):
     users_count: int
     video_ended: bool | None = None
     watch_time: int | None = None
+    # while on_pause is False, the group is at watch_time + the seconds elapsed since this time
+    watch_time_updated_at: datetime | None = None
     users: list[TimelineUserDataResponse]
 
 
@@ -120,6 +128,11 @@ class TimelineChatHistoryResponse(RootModel, MyBaseModel):
     root: list[TimelineChatMessageResponse]
 
 
+class TimelineChatMessagesPageResponse(MyBaseModel):
+    messages: list[TimelineChatMessageResponse]
+    has_more: bool
+
+
 class TimelineCurrentGroupResponse(RootModel, MyBaseModel):
     root: list[TimelineUserDataResponse]
 
@@ -131,3 +144,64 @@ class TimelineGroupResponse(RootModel, MyBaseModel):
 class TimelineReConnectRequest(MyBaseModel):
     video_uuid: str
     group_uuid: str
+    groups_delta: bool = False
+
+
+class TimelineGroupChangeResponse(MyBaseModel):
+    group_uuid: str
+    host_user_uuid: str
+    on_pause: bool | None = None
+    users_count: int
+    video_ended: bool | None = None
+    watch_time: int | None = None
+    watch_time_updated_at: datetime | None = None
+    added_users: list[TimelineUserDataResponse] = []
+    changed_users: list[TimelineUserDataResponse] = []
+    removed_users: list[str] = []
+
+
+class TimelineGroupsDeltaResponse(MyBaseModel):
+    video_uuid: str
+    base_version: int
+    version: int
+    added: list[TimelineGroupDataResponse] = []
+    changed: list[TimelineGroupChangeResponse] = []
+    removed: list[str] = []
+
+
+class TimelineGroupsSnapshotResponse(MyBaseModel):
+    video_uuid: str
+    version: int
+    groups: list[TimelineGroupDataResponse]
+
+
+class TimelineGroupsViewportRequest(MyBaseModel):
+    # "size": most users first, "recency": newest groups first
+    sort: Literal["size", "recency"] = "size"
+    limit: int = Field(default=25, ge=1)
+    # next_cursor of the previous page, the first page (no cursor) subscribes to the updates
+    cursor: str | None = None
+
+
+class TimelineGroupsViewportResponse(MyBaseModel):
+    video_uuid: str
+    sort: str
+    # the cursor of the request, None for the first page
+    cursor: str | None = None
+    # None on the last page
+    next_cursor: str | None = None
+    total: int
+    groups: list[TimelineGroupDataResponse]
+
+
+class TimelineGetGroupPositionRequest(MyBaseModel):
+    # a group of the video, the group of the user if None
+    group_uuid: str | None = None
+
+
+class TimelineGroupPositionResponse(MyBaseModel):
+    group_uuid: str
+    # extrapolated from the last timecode sent by the host, None if the host never sent one
+    timecode: int | None = None
+    on_pause: bool
+    server_time: datetime
@@ -0,0 +1,97 @@
+import redis.asyncio as redis
+
+from fliji_sockets.settings import REDIS_CONNECTION_STRING, GROUPS_STATE_BACKEND
+
+
+class MemoryRoomSubscribers:
+    """
+    Sids in each of the rooms whose broadcasts are only built when somebody receives them.
+    Only knows the sids of this node, so it's only correct with a single node.
+    """
+
+    def __init__(self):
+        self._rooms: dict[str, set[str]] = {}
+
+    async def add(self, room: str, sid: str) -> None:
+        self._rooms.setdefault(room, set()).add(sid)
+
+    async def remove(self, rooms: list[str], sid: str) -> None:
+        for room in rooms:
+            sids = self._rooms.get(room)
+            if sids is None:
+                continue
+            sids.discard(sid)
+            if not sids:
+                del self._rooms[room]
+
+    async def subscribed(self, rooms: list[str]) -> set[str]:
+        """Returns the given rooms that have at least one subscriber"""
+        return {room for room in rooms if room in self._rooms}
+
+    async def clear(self) -> None:
+        self._rooms.clear()
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisRoomSubscribers:
+    """
+    Sids in each of the rooms whose broadcasts are only built when somebody receives them,
+    shared by all the nodes through Redis.
+
+    The sids of a node that stopped without removing them stay until clear(),
+    the broadcasts are only built for nothing meanwhile.
+    """
+
+    def __init__(self, connection_string: str, key_prefix: str):
+        self._connection_string = connection_string
+        self._key_prefix = key_prefix
+        self._redis: redis.Redis | None = None
+
+    def _client(self) -> redis.Redis:
+        # created on first use, so that it's bound to the event loop using it
+        if self._redis is None:
+            self._redis = redis.from_url(self._connection_string)
+        return self._redis
+
+    def _key(self, room: str) -> str:
+        return f"{self._key_prefix}{room}"
+
+    async def add(self, room: str, sid: str) -> None:
+        await self._client().sadd(self._key(room), sid)
+
+    async def remove(self, rooms: list[str], sid: str) -> None:
+        async with self._client().pipeline(transaction=False) as pipe:
+            for room in rooms:
+                pipe.srem(self._key(room), sid)
+            await pipe.execute()
+
+    async def subscribed(self, rooms: list[str]) -> set[str]:
+        """Returns the given rooms that have at least one subscriber"""
+        async with self._client().pipeline(transaction=False) as pipe:
+            for room in rooms:
+                pipe.exists(self._key(room))
+            exists = await pipe.execute()
+        return {room for room, room_exists in zip(rooms, exists) if room_exists}
+
+    async def clear(self) -> None:
+        client = self._client()
+        async for key in client.scan_iter(match=f"{self._key_prefix}*"):
+            await client.delete(key)
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+def create_room_subscribers(backend: str) -> MemoryRoomSubscribers | RedisRoomSubscribers:
+    if backend == "memory":
+        return MemoryRoomSubscribers()
+    if backend == "redis":
+        return RedisRoomSubscribers(REDIS_CONNECTION_STRING, "fliji_sockets:subscribers:")
+    raise ValueError(f"Unknown groups state backend: {backend}")
+
+
+room_subscribers = create_room_subscribers(GROUPS_STATE_BACKEND)
@@ -27,6 +27,10 @@ USER_SERVICE_API_KEY = os.environ.get("USER_SERVICE_API_KEY")
 
 NATS_HOST = os.environ.get("NATS_HOST", "nats://localhost:4222")
 NATS_TOKEN = os.environ.get("NATS_TOKEN", "")
+# events are published in batches of at most this size...
+NATS_PUBLISH_BATCH_SIZE = int(os.environ.get("NATS_PUBLISH_BATCH_SIZE", "100"))
+# ...or at most this many seconds after the first queued event
+NATS_PUBLISH_MAX_DELAY = float(os.environ.get("NATS_PUBLISH_MAX_DELAY", "0.01"))
 
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.environ.get("REDIS_PORT", "6379"))
@@ -34,6 +38,86 @@ REDIS_DB = int(os.environ.get("REDIS_DB", "5"))
 REDIS_PASSWORD = os.environ.get("REDIS_PASSWORD", "")
 REDIS_CONNECTION_STRING = f"redis://:{REDIS_PASSWORD}@{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
 
+# numbers of groups a viewport subscription can get, a requested limit is rounded up to one of them
+GROUPS_VIEWPORT_SIZES = tuple(
+    int(size) for size in os.environ.get("GROUPS_VIEWPORT_SIZES", "10,25,50,100").split(",")
+)
+
+# seconds a video's timeline groups are served from memory before being re-read from Mongo
+TIMELINE_CACHE_TTL = float(os.environ.get("TIMELINE_CACHE_TTL", "5"))
+
+# chat messages sent on timeline_connect and per timeline_fetch_chat_messages page
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", "50"))
+# most recent chat messages of each video kept in memory
+CHAT_HISTORY_CACHE_SIZE = int(os.environ.get("CHAT_HISTORY_CACHE_SIZE", "200"))
+# seconds a video's recent chat messages are served from memory before being re-read from Mongo
+CHAT_HISTORY_CACHE_TTL = float(os.environ.get("CHAT_HISTORY_CACHE_TTL", "30"))
+
+# "messages" stores one document per chat message in timeline_chat_messages,
+# "buckets" appends the messages of a video to bucket documents in timeline_chat_buckets,
+# run `pdm run backfill-chat-buckets` before switching to "buckets"
+CHAT_STORAGE = os.environ.get("CHAT_STORAGE", "messages")
+# max messages of a chat bucket
+CHAT_BUCKET_SIZE = int(os.environ.get("CHAT_BUCKET_SIZE", "200"))
+# max seconds between the first message of a chat bucket and the next messages it accepts
+CHAT_BUCKET_SPAN = float(os.environ.get("CHAT_BUCKET_SPAN", "3600"))
+
+# seconds during which the chat messages sent to a busy video are collected
+# to be written with one insert_many and broadcast as one `timeline_chat_messages` event
+CHAT_BATCH_INTERVAL = float(os.environ.get("CHAT_BATCH_INTERVAL", "0.1"))
+
+# token buckets of the events a client may send, as "event:rate per second:burst",
+# the excess events are dropped and an `err` is emitted back
+EVENT_RATE_LIMITS = {
+    event: (float(rate), int(burst))
+    for event, rate, burst in (
+        limit.split(":") for limit in os.environ.get(
+            "EVENT_RATE_LIMITS",
+            "timeline_update_timecode:2:5,timeline_send_chat_message:3:10,timeline_change_group:0.5:3",
+        ).split(",") if limit
+    )
+}
+# rate limited events whose excess is not dropped: the latest one is kept
+# and handled as soon as the limit allows it
+COALESCED_EVENTS = tuple(
+    os.environ.get("COALESCED_EVENTS", "timeline_update_timecode").split(",")
+)
+
+# seconds of event loop lag above which the server is overloaded
+# and rejects the events of SHED_EVENTS with an `err`
+OVERLOAD_LAG_THRESHOLD = float(os.environ.get("OVERLOAD_LAG_THRESHOLD", "0.5"))
+# seconds between two measures of the event loop lag
+OVERLOAD_CHECK_INTERVAL = float(os.environ.get("OVERLOAD_CHECK_INTERVAL", "0.5"))
+SHED_EVENTS = tuple(os.environ.get(
+    "SHED_EVENTS",
+    "timeline_fetch_chat_messages,timeline_groups_resync,timeline_groups_viewport",
+).split(","))
+
+# minimum seconds between two coalesced broadcasts of the same event to the same room
+BROADCAST_INTERVAL = float(os.environ.get("BROADCAST_INTERVAL", "1"))
+
+# max seconds between the timecode sent by a host and the position extrapolated by the server
+# for the timecode to be ignored, a larger difference is a seek and moves the playback anchor
+TIMECODE_DRIFT_TOLERANCE = float(os.environ.get("TIMECODE_DRIFT_TOLERANCE", "2"))
+
+# max seconds a group's timecode may stay in memory before being written to Mongo
+TIMECODE_FLUSH_INTERVAL = float(os.environ.get("TIMECODE_FLUSH_INTERVAL", "5"))
+
+# "memory" for a single node, "redis" to share the viewer counts between the nodes
+VIEWER_COUNTER_BACKEND = os.environ.get("VIEWER_COUNTER_BACKEND", "memory")
+# seconds between two corrections of the viewer counts from Mongo
+VIEWER_COUNT_RECONCILE_INTERVAL = float(os.environ.get("VIEWER_COUNT_RECONCILE_INTERVAL", "60"))
+
+# "memory" for a single node, "redis" to share between the nodes the versions of the groups deltas
+# and the subscribers of the groups broadcasts that are only built for their subscribers
+GROUPS_STATE_BACKEND = os.environ.get("GROUPS_STATE_BACKEND", "redis")
+
+# "json" (text frames) or "msgpack" (binary frames, the clients must use the socket.io msgpack parser)
+SIO_SERIALIZER = os.environ.get("SIO_SERIALIZER", "json")
+
+# path of the Prometheus metrics, served next to socket.io, empty to disable them
+METRICS_PATH = os.environ.get("METRICS_PATH", "/metrics")
+
 JWT_SECRET = os.environ.get("JWT_SECRET", "secret")
 JWT_ALGO = os.environ.get("JWT_ALGO", "HS256")
 
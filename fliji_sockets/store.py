@@ -1,31 +1,142 @@
-import json
+import asyncio
 import logging
+from datetime import datetime, timezone, timedelta
+from enum import Enum
 
 from pydantic import ValidationError
-from pymongo import MongoClient
-from pymongo.database import Database
+from pymongo import AsyncMongoClient, UpdateOne, IndexModel, ASCENDING, DESCENDING, ReturnDocument
+from pymongo.asynchronous.database import AsyncDatabase
 
+from fliji_sockets.cache import timeline_groups_cache, chat_history_cache, avatar_strip_cache, \
+    AVATAR_STRIP_SIZE, build_groups_order
+from fliji_sockets.core.metrics import timed, mongo_call_duration
+from fliji_sockets.core.serialization import EncodedPayload, encode_payload
 from fliji_sockets.models.database import TimelineWatchSession, TimelineGroup, TimelineChatMessage
-from fliji_sockets.models.socket import TimelineStatusResponse
+from fliji_sockets.models.socket import TimelineGroupResponse, TimelineGroupsViewportResponse
 from fliji_sockets.settings import (
     MONGO_PORT,
     MONGO_HOST,
     MONGO_USER,
     MONGO_PASSWORD,
     MONGO_DB,
+    TIMECODE_FLUSH_INTERVAL,
+    CHAT_HISTORY_PAGE_SIZE,
+    CHAT_STORAGE,
+    CHAT_BUCKET_SIZE,
+    CHAT_BUCKET_SPAN,
 )
-
-
-def ensure_indexes(db: Database):
-    db.timeline_watch_sessions.create_index("sid")
-    db.timeline_watch_sessions.create_index("video_uuid")
-    db.timeline_watch_sessions.create_index("user_uuid")
-
-
-def serialize_doc(doc):
-    """Weird hack to serialize the ObjectId to a string.
-    This is necessary because socketio doesn't properly serialize"""
-    return json.loads(json.dumps(doc, default=str))
+from fliji_sockets.groups_versions import timeline_groups_versions
+from fliji_sockets.room_subscribers import room_subscribers
+from fliji_sockets.viewer_counter import viewer_counter
+
+
+# Indexes of each collection, one per query shape of this module, see _query_shapes().
+INDEXES: dict[str, list[IndexModel]] = {
+    "timeline_watch_sessions": [
+        IndexModel("sid"),
+        # upserts, reads and deletes by user_uuid use the prefix
+        IndexModel([("user_uuid", ASCENDING), ("video_uuid", ASCENDING)], unique=True),
+        # group members ordered by last update
+        IndexModel([("group_uuid", ASCENDING), ("last_update_time", ASCENDING)]),
+        # grouped/single users of a video ordered by last update, viewer counts use the prefix
+        IndexModel([
+            ("video_uuid", ASCENDING), ("group_uuid", ASCENDING), ("last_update_time", ASCENDING)
+        ]),
+        # first viewers of a video for the avatars
+        IndexModel([("video_uuid", ASCENDING), ("created_at", ASCENDING)]),
+    ],
+    "timeline_groups": [
+        IndexModel("group_uuid", unique=True),
+        IndexModel("video_uuid"),
+    ],
+    "timeline_chat_messages": [
+        # history pages, the id breaks ties between messages sent in the same millisecond
+        IndexModel([("video_uuid", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)]),
+    ],
+    "timeline_chat_buckets": [
+        # the open bucket of a video and the history pages, newest bucket first
+        IndexModel([("video_uuid", ASCENDING), ("start", DESCENDING)]),
+    ],
+}
+
+async def ensure_indexes(db: AsyncDatabase):
+    for collection_name, indexes in INDEXES.items():
+        await db[collection_name].create_indexes(indexes)
+
+
+def _has_collection_scan(plan) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        # the $lookup of an aggregation, without and with the slot based engine
+        if plan.get("collectionScans") or plan.get("strategy") in ("NestedLoopJoin", "HashJoin"):
+            return True
+        return any(
+            _has_collection_scan(value) for key, value in plan.items() if key != "rejectedPlans"
+        )
+    if isinstance(plan, list):
+        return any(_has_collection_scan(value) for value in plan)
+    return False
+
+
+async def find_collection_scans(db: AsyncDatabase) -> list[str]:
+    """
+    Explains every query shape of the store, returns the ones doing a collection scan.
+    The aggregations are run on a group of the database to explain their $lookup.
+    """
+    group = await db.timeline_groups.find_one({}, {"group_uuid": 1, "video_uuid": 1}) or {}
+    collection_scans = []
+    for command in _query_shapes(group.get("video_uuid", ""), group.get("group_uuid", "")):
+        verbosity = "executionStats" if "aggregate" in command else "queryPlanner"
+        explain = await db.command({"explain": command, "verbosity": verbosity})
+        if _has_collection_scan(explain):
+            collection_scans.append(str(command))
+
+    return collection_scans
+
+
+def _find_shape(collection_name: str, query_filter: dict, sort: dict | None = None) -> dict:
+    command = {"find": collection_name, "filter": query_filter}
+    if sort:
+        command["sort"] = sort
+    return command
+
+
+def _query_shapes(video_uuid: str, group_uuid: str) -> list[dict]:
+    """
+    Find and aggregate commands of every query of this module, checked by find_collection_scans.
+    The filters built by a helper are taken from it, so that they are checked as they are sent.
+    """
+    before = (datetime.now(timezone.utc), "")
+    return [
+        _find_shape("timeline_watch_sessions", {"user_uuid": "", "video_uuid": ""}),
+        _find_shape("timeline_watch_sessions", {"user_uuid": ""}),
+        _find_shape("timeline_watch_sessions", {"group_uuid": ""}, {"last_update_time": 1}),
+        _find_shape("timeline_watch_sessions", {"video_uuid": "", "group_uuid": None},
+                    {"last_update_time": 1}),
+        _find_shape("timeline_watch_sessions", {"video_uuid": ""}, {"created_at": 1}),
+        _find_shape("timeline_watch_sessions", {"video_uuid": ""}),
+        _find_shape("timeline_groups", {"group_uuid": ""}),
+        _find_shape("timeline_groups", _joinable_group_filter("")),
+        _find_shape("timeline_groups", _empty_group_filter("")),
+        _find_shape("timeline_chat_messages", _chat_messages_filter("", None), _CHAT_MESSAGES_SORT),
+        _find_shape("timeline_chat_messages", _chat_messages_filter("", before),
+                    _CHAT_MESSAGES_SORT),
+        _find_shape("timeline_chat_messages", {"video_uuid": ""}, {"created_at": 1, "id": 1}),
+        _find_shape("timeline_chat_buckets", _chat_buckets_filter("", None), {"start": -1}),
+        _find_shape("timeline_chat_buckets", _chat_buckets_filter("", before), {"start": -1}),
+        # the $lookup of the users is explained too
+        {
+            "aggregate": "timeline_groups",
+            "pipeline": _timeline_groups_pipeline({"video_uuid": video_uuid}),
+            "cursor": {},
+        },
+        {
+            "aggregate": "timeline_groups",
+            "pipeline": _timeline_groups_pipeline({"group_uuid": group_uuid}),
+            "cursor": {},
+        },
+    ]
 
 
 def get_database():
@@ -33,7 +144,7 @@ def get_database():
     connection_url = (
         f"mongodb://{MONGO_USER}:{MONGO_PASSWORD}@{MONGO_HOST}:{MONGO_PORT}"
     )
-    client = MongoClient(connection_url)
+    client = AsyncMongoClient(connection_url)
     db = client[
         MONGO_DB
     ]  # Replace 'your_database_name' with your desired database name
@@ -41,122 +152,463 @@ def get_database():
     # set logging level to INFO so it's not too verbose
     logging.getLogger('pymongo').setLevel(logging.INFO)
 
-    ensure_indexes(db)
     return db
 
 
-async def upsert_timeline_watch_session(db: Database, watch_session: TimelineWatchSession) -> int:
-    watch_session_id = db.timeline_watch_sessions.update_one(
+class TimecodeWriteBuffer:
+    """
+    Write-behind buffer for the timecodes of the groups, the most frequent write.
+
+    Keeps the latest watch_time/on_pause of each group in memory and writes them
+    with a single bulk_write at most ``flush_interval`` seconds after the first change.
+    Reads of a group go through apply() so they see the buffered values.
+    """
+
+    def __init__(self, flush_interval: float):
+        self._flush_interval = flush_interval
+        self._pending: dict[str, dict] = {}
+        self._db: AsyncDatabase | None = None
+        self._flush_task: asyncio.Task | None = None
+
+    def put(self, db: AsyncDatabase, group_uuid: str, fields: dict) -> None:
+        self._db = db
+        self._pending.setdefault(group_uuid, {}).update(fields)
+
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    def apply(self, group_data: dict | None) -> dict | None:
+        """Overlays the buffered fields on a group document read from Mongo"""
+        if group_data is None:
+            return None
+
+        pending = self._pending.get(group_data.get("group_uuid"))
+        if pending:
+            group_data.update(pending)
+        return group_data
+
+    def discard(self, group_uuid: str) -> None:
+        """Drops the buffered fields of a group that was written or deleted directly"""
+        self._pending.pop(group_uuid, None)
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self._flush_interval)
+        self._flush_task = None
+        await self.flush()
+
+    @timed(mongo_call_duration)
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        operations = [
+            UpdateOne({"group_uuid": group_uuid}, {"$set": fields})
+            for group_uuid, fields in pending.items()
+        ]
+        try:
+            await self._db.timeline_groups.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logging.error(f"Error flushing {len(operations)} buffered timecodes: {e}")
+            # keep the values that were not overwritten in the meantime for the next flush
+            for group_uuid, fields in pending.items():
+                self._pending[group_uuid] = {**fields, **self._pending.get(group_uuid, {})}
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush_later())
+
+
+timecode_write_buffer = TimecodeWriteBuffer(TIMECODE_FLUSH_INTERVAL)
+
+
+class WatchSessionProjection(Enum):
+    """Fields of a watch session read for each use case"""
+    # where the user is: rooms, group membership, host reassignment
+    MEMBERSHIP = "membership"
+    # what is shown in the timeline avatars strip, and its order
+    AVATAR_CARD = "avatar_card"
+    # the whole document, needed to validate a TimelineWatchSession or upsert it back
+    FULL_PROFILE = "full_profile"
+
+
+_WATCH_SESSION_PROJECTIONS: dict[WatchSessionProjection, dict | None] = {
+    WatchSessionProjection.MEMBERSHIP: {
+        "_id": 0, "user_uuid": 1, "sid": 1, "video_uuid": 1, "group_uuid": 1,
+        "last_update_time": 1,
+    },
+    WatchSessionProjection.AVATAR_CARD: {
+        "_id": 0, "user_uuid": 1, "video_uuid": 1, "avatar": 1, "username": 1, "first_name": 1,
+        "last_name": 1, "created_at": 1,
+    },
+    WatchSessionProjection.FULL_PROFILE: None,
+}
+
+
+@timed(mongo_call_duration)
+async def upsert_timeline_watch_session(db: AsyncDatabase, watch_session: TimelineWatchSession) -> int:
+    watch_session_data = watch_session.model_dump()
+    watch_session_id = await db.timeline_watch_sessions.update_one(
         {"user_uuid": watch_session.user_uuid, "video_uuid": watch_session.video_uuid},
-        {"$set": watch_session.model_dump()},
+        {"$set": watch_session_data},
         upsert=True,
     )
+    timeline_groups_cache.upsert_watch_session(watch_session_data)
+    if watch_session_id.upserted_id is not None:
+        avatar_strip_cache.add(watch_session_data)
+        await viewer_counter.add(watch_session.video_uuid, 1)
     return watch_session_id
 
 
-async def delete_timeline_watch_session_by_user_uuid(db: Database, user_uuid: str) -> int:
-    result = db.timeline_watch_sessions.delete_one({"user_uuid": user_uuid})
-    return result.deleted_count
+@timed(mongo_call_duration)
+async def update_timeline_watch_session(db: AsyncDatabase, user_uuid: str,
+                                        fields: dict) -> dict | None:
+    """Sets the given fields of the user's watch session, returns it after the update"""
+    watch_session_data = await db.timeline_watch_sessions.find_one_and_update(
+        {"user_uuid": user_uuid},
+        {"$set": fields},
+        return_document=ReturnDocument.AFTER,
+    )
+    if watch_session_data is not None:
+        timeline_groups_cache.upsert_watch_session(watch_session_data)
+    return watch_session_data
 
 
-async def get_timeline_watch_session_by_user_uuid(db: Database, user_uuid: str) -> dict:
-    watch_session = db.timeline_watch_sessions.find_one({"user_uuid": user_uuid})
+@timed(mongo_call_duration)
+async def delete_timeline_watch_session_by_user_uuid(db: AsyncDatabase, user_uuid: str) -> int:
+    deleted = await db.timeline_watch_sessions.find_one_and_delete(
+        {"user_uuid": user_uuid},
+        projection={"video_uuid": 1},
+    )
+    if deleted is None:
+        return 0
+
+    timeline_groups_cache.delete_watch_session(deleted.get("video_uuid"), user_uuid)
+    avatar_strip_cache.remove(deleted.get("video_uuid"), user_uuid)
+    await viewer_counter.add(deleted.get("video_uuid"), -1)
+    return 1
+
+
+@timed(mongo_call_duration)
+async def get_timeline_watch_session_by_user_uuid(
+        db: AsyncDatabase, user_uuid: str,
+        projection: WatchSessionProjection = WatchSessionProjection.FULL_PROFILE,
+) -> dict:
+    watch_session = await db.timeline_watch_sessions.find_one(
+        {"user_uuid": user_uuid}, _WATCH_SESSION_PROJECTIONS[projection]
+    )
     return watch_session
 
 
-async def get_timeline_group_by_uuid(db: Database, group_uuid: str):
-    group = db.timeline_groups.find_one({"group_uuid": group_uuid})
-    return group
+@timed(mongo_call_duration)
+async def get_timeline_group_by_uuid(db: AsyncDatabase, group_uuid: str):
+    group = await db.timeline_groups.find_one({"group_uuid": group_uuid})
+    return timecode_write_buffer.apply(group)
 
 
-async def get_timeline_group_users(db: Database, group_uuid: str):
+@timed(mongo_call_duration)
+async def get_timeline_group_users(
+        db: AsyncDatabase, group_uuid: str,
+        projection: WatchSessionProjection = WatchSessionProjection.FULL_PROFILE,
+):
     # order by last_update_time
-    users = db.timeline_watch_sessions.find({"group_uuid": group_uuid}).sort(
-        "last_update_time"
-    )
+    users = await db.timeline_watch_sessions.find(
+        {"group_uuid": group_uuid}, _WATCH_SESSION_PROJECTIONS[projection]
+    ).sort("last_update_time").to_list()
     return users
 
 
-async def upsert_timeline_group(db: Database, group: TimelineGroup) -> int:
-    result = db.timeline_groups.update_one(
+@timed(mongo_call_duration)
+async def upsert_timeline_group(db: AsyncDatabase, group: TimelineGroup) -> int:
+    group_data = group.model_dump(exclude_none=True)
+    result = await db.timeline_groups.update_one(
         {"group_uuid": group.group_uuid},
-        {"$set": group.model_dump(exclude_none=True)},
+        {"$set": group_data},
         upsert=True,
     )
+    timecode_write_buffer.discard(group.group_uuid)
+    timeline_groups_cache.upsert_group(group_data)
     return result
 
 
-async def delete_timeline_group_by_uuid(db: Database, group_uuid: str) -> int:
-    result = db.timeline_groups.delete_one({"group_uuid": group_uuid})
-    return result.deleted_count
-
+@timed(mongo_call_duration)
+async def update_timeline_group_playback(db: AsyncDatabase, group: TimelineGroup) -> None:
+    """
+    Sets the pause state and the timecode of the group right away, replacing the buffered timecode.
+    Only these fields are written, so the concurrent joins and leaves are kept.
+    """
+    fields = {
+        "on_pause": group.on_pause,
+        "watch_time": group.watch_time,
+        "watch_time_updated_at": group.watch_time_updated_at,
+    }
+    await db.timeline_groups.update_one({"group_uuid": group.group_uuid}, {"$set": fields})
+    timecode_write_buffer.discard(group.group_uuid)
+    timeline_groups_cache.update_group(group.video_uuid, group.group_uuid, fields)
+
+
+async def update_timeline_group_timecode(db: AsyncDatabase, group: TimelineGroup) -> None:
+    """Buffers the timecode of the group, it is written to Mongo by the write-behind buffer"""
+    fields = {
+        "watch_time": group.watch_time,
+        "watch_time_updated_at": group.watch_time_updated_at,
+        "on_pause": group.on_pause,
+    }
+    timecode_write_buffer.put(db, group.group_uuid, fields)
+    timeline_groups_cache.update_group(group.video_uuid, group.group_uuid, fields)
+
+
+def _cache_updated_group(group_data: dict) -> dict:
+    # the counters come from Mongo, the timecode may still be buffered
+    group_data = timecode_write_buffer.apply(group_data)
+    timeline_groups_cache.upsert_group(group_data)
+    return group_data
+
+
+def _joinable_group_filter(group_uuid: str) -> dict:
+    # a group left empty is being deleted
+    return {"group_uuid": group_uuid, "users_count": {"$gt": 0}}
+
+
+def _empty_group_filter(group_uuid: str) -> dict:
+    return {"group_uuid": group_uuid, "users_count": {"$lte": 0}}
+
+
+@timed(mongo_call_duration)
+async def join_timeline_group(db: AsyncDatabase, group_uuid: str) -> dict | None:
+    """
+    Atomically counts a new user in the group.
+    Returns the group after the update, None if it doesn't exist or was just left empty.
+    """
+    group_data = await db.timeline_groups.find_one_and_update(
+        _joinable_group_filter(group_uuid),
+        {"$inc": {"users_count": 1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if group_data is None:
+        return None
 
-async def get_timeline_single_users(db: Database, video_uuid: str):
-    users = db.timeline_watch_sessions.find(
-        {
-            "video_uuid": video_uuid,
-            "group_uuid": None
+    return _cache_updated_group(group_data)
+
+
+@timed(mongo_call_duration)
+async def leave_timeline_group(db: AsyncDatabase, group_uuid: str, user_uuid: str,
+                               next_host_user_uuid: str | None) -> dict | None:
+    """
+    Atomically removes a user from the group count. If the user is the host,
+    the host is handed over to next_host_user_uuid. The group is deleted once it is empty.
+    Returns the group after the update, None if it doesn't exist.
+    """
+    update = {"users_count": {"$subtract": ["$users_count", 1]}}
+    if next_host_user_uuid is not None:
+        update["host_user_uuid"] = {
+            "$cond": [
+                {"$eq": ["$host_user_uuid", {"$literal": user_uuid}]},
+                {"$literal": next_host_user_uuid},
+                "$host_user_uuid",
+            ]
         }
-    ).sort("last_update_time")
 
-    return users
+    group_data = await db.timeline_groups.find_one_and_update(
+        {"group_uuid": group_uuid},
+        [{"$set": update}],
+        return_document=ReturnDocument.AFTER,
+    )
+    if group_data is None:
+        return None
 
+    if group_data["users_count"] > 0:
+        return _cache_updated_group(group_data)
 
-async def get_timeline_groups(db: Database, video_uuid: str):
-    users = list(db.timeline_watch_sessions.find(
-        {
-            "video_uuid": video_uuid,
-            "group_uuid": {"$ne": None}
-        }
-    ).sort("last_update_time"))
-    groups = list(db.timeline_groups.find({"video_uuid": video_uuid}))
+    # a user who joined in the meantime keeps the group alive
+    deleted = await db.timeline_groups.find_one_and_delete(
+        _empty_group_filter(group_uuid),
+        projection={"video_uuid": 1},
+    )
+    if deleted is None:
+        group_data = await db.timeline_groups.find_one({"group_uuid": group_uuid})
+        return _cache_updated_group(group_data) if group_data is not None else None
 
-    # if either groups or users is empty, return empty list
-    if len(groups) == 0 or len(users) == 0:
-        return []
+    timecode_write_buffer.discard(group_uuid)
+    timeline_groups_cache.delete_group(deleted["video_uuid"], group_uuid)
+    return group_data
 
-    groups_dict = {}
-    for group in groups:
-        group["users"] = []
-        groups_dict[group["group_uuid"]] = group
 
-    for user in users:
-        user["is_host"] = user.get("user_uuid") == groups_dict[user.get("group_uuid")].get(
-            "host_user_uuid")
-        group_uuid = user.get("group_uuid")
-        if group_uuid in groups_dict.keys():
-            groups_dict[group_uuid]["users"].append(user)
+@timed(mongo_call_duration)
+async def delete_timeline_group_by_uuid(db: AsyncDatabase, group_uuid: str) -> int:
+    deleted = await db.timeline_groups.find_one_and_delete(
+        {"group_uuid": group_uuid},
+        projection={"video_uuid": 1},
+    )
+    timecode_write_buffer.discard(group_uuid)
+    if deleted is None:
+        return 0
 
-    return groups
+    timeline_groups_cache.delete_group(deleted["video_uuid"], group_uuid)
+    return 1
 
 
-async def get_timeline_group_users_data(db: Database, group_uuid: str):
-    users_cursor = db.timeline_watch_sessions.find(
+@timed(mongo_call_duration)
+async def get_timeline_single_users(
+        db: AsyncDatabase, video_uuid: str,
+        projection: WatchSessionProjection = WatchSessionProjection.FULL_PROFILE,
+):
+    users = await db.timeline_watch_sessions.find(
         {
-            "group_uuid": group_uuid
-        }
-    ).sort("last_update_time")
+            "video_uuid": video_uuid,
+            "group_uuid": None
+        },
+        _WATCH_SESSION_PROJECTIONS[projection],
+    ).sort("last_update_time").to_list()
 
-    users = list(users_cursor)
+    return users
 
-    group = db.timeline_groups.find_one({"group_uuid": group_uuid})
 
-    if group is None:
+# fields of a watch session sent as TimelineUserDataResponse,
+# plus the ones the groups cache needs to order and place the users
+_USER_DATA_PROJECTION = {
+    "_id": 0,
+    "user_uuid": 1,
+    "username": 1,
+    "first_name": 1,
+    "last_name": 1,
+    "agora_id": 1,
+    "mic_enabled": 1,
+    "avatar": 1,
+    "avatar_thumbnail": 1,
+    "bio": 1,
+    "group_uuid": 1,
+    "video_uuid": 1,
+    "last_update_time": 1,
+}
+
+
+def _timeline_groups_pipeline(group_filter: dict) -> list[dict]:
+    """
+    Groups matching the filter, each with its users ordered by last_update_time
+    and their is_host flag, joined by Mongo.
+    """
+    return [
+        {"$match": group_filter},
+        # the Mongo ids are never sent, nor decoded
+        {"$project": {"_id": 0}},
+        {"$lookup": {
+            "from": "timeline_watch_sessions",
+            "localField": "group_uuid",
+            "foreignField": "group_uuid",
+            "let": {"host_user_uuid": "$host_user_uuid"},
+            "pipeline": [
+                {"$project": {
+                    **_USER_DATA_PROJECTION,
+                    "is_host": {"$eq": ["$user_uuid", "$$host_user_uuid"]},
+                }},
+                {"$sort": {"last_update_time": 1}},
+            ],
+            "as": "users",
+        }},
+    ]
+
+
+@timed(mongo_call_duration)
+async def _aggregate_timeline_groups(db: AsyncDatabase, video_uuid: str) -> list[dict]:
+    groups = await (
+        await db.timeline_groups.aggregate(_timeline_groups_pipeline({"video_uuid": video_uuid}))
+    ).to_list()
+    return [timecode_write_buffer.apply(group) for group in groups]
+
+
+async def get_timeline_groups_response(db: AsyncDatabase, video_uuid: str) -> TimelineGroupResponse:
+    """Returns the `timeline_groups` payload, reading Mongo only if the video is not cached"""
+    response = timeline_groups_cache.get_response(video_uuid)
+    if response is not None:
+        return response
+
+    generation = timeline_groups_cache.begin_load(video_uuid)
+    try:
+        groups = await _aggregate_timeline_groups(db, video_uuid)
+    finally:
+        is_consistent = timeline_groups_cache.end_load(video_uuid, generation)
+
+    if not is_consistent:
+        # a write landed while reading, serve what was read without caching it
+        if not any(group["users"] for group in groups):
+            groups = []
+        return TimelineGroupResponse(root=groups)
+
+    # the cache keeps groups and users apart to apply the later writes
+    users = [user for group in groups for user in group.pop("users")]
+    timeline_groups_cache.load(video_uuid, groups, users)
+    return timeline_groups_cache.get_response(video_uuid)
+
+
+async def get_timeline_groups_payload(db: AsyncDatabase, video_uuid: str) -> EncodedPayload:
+    """The `timeline_groups` payload, encoded once per change of the video"""
+    response = await get_timeline_groups_response(db, video_uuid)
+    payload = timeline_groups_cache.get_payload(video_uuid)
+    return payload if payload is not None else encode_payload(response)
+
+
+async def _get_timeline_groups_order(db: AsyncDatabase, video_uuid: str, sort: str):
+    response = await get_timeline_groups_response(db, video_uuid)
+    order = timeline_groups_cache.get_order(video_uuid, sort)
+    if order is not None:
+        return order
+
+    # the read raced with a write and was not cached, the groups are ordered from the response,
+    # without their created_at
+    groups = [group.model_dump() for group in response.root]
+    return build_groups_order(sort, groups, response)
+
+
+async def get_timeline_groups_page(db: AsyncDatabase, video_uuid: str, sort: str, limit: int,
+                                   cursor: str | None = None) -> TimelineGroupsViewportResponse:
+    """
+    A slice of the `timeline_groups` payload in the given sort.
+    Raises ValueError if the cursor is invalid.
+    """
+    order = await _get_timeline_groups_order(db, video_uuid, sort)
+    return order.get_page(video_uuid, limit, cursor)
+
+
+async def get_timeline_groups_first_pages(
+        db: AsyncDatabase, video_uuid: str, sort: str,
+        limits: list[int]) -> dict[int, TimelineGroupsViewportResponse]:
+    """The first page of each limit, sliced from the groups ordered once"""
+    order = await _get_timeline_groups_order(db, video_uuid, sort)
+    return {limit: order.get_page(video_uuid, limit) for limit in limits}
+
+
+@timed(mongo_call_duration)
+async def get_timeline_group_users_data(db: AsyncDatabase, group_uuid: str):
+    groups = await (
+        await db.timeline_groups.aggregate(_timeline_groups_pipeline({"group_uuid": group_uuid}))
+    ).to_list()
+
+    if not groups:
         return []
 
-    # set is host for the host
-    for user in users:
-        user["is_host"] = user.get("user_uuid") == group.get("host_user_uuid")
-
-    return users
+    return groups[0]["users"]
 
 
-async def get_timeline_user_avatars(db: Database, video_uuid: str):
-    users = db.timeline_watch_sessions.find(
+@timed(mongo_call_duration)
+async def _find_timeline_user_avatars(db: AsyncDatabase, video_uuid: str) -> list[dict]:
+    return await db.timeline_watch_sessions.find(
         {
             "video_uuid": video_uuid,
-        }
-    ).sort("created_at").limit(6)
+        },
+        _WATCH_SESSION_PROJECTIONS[WatchSessionProjection.AVATAR_CARD],
+    ).sort("created_at").limit(AVATAR_STRIP_SIZE).to_list()
+
+
+async def get_timeline_user_avatars(db: AsyncDatabase, video_uuid: str):
+    users = avatar_strip_cache.get(video_uuid)
+    if users is None:
+        generation = avatar_strip_cache.begin_load(video_uuid)
+        try:
+            users = await _find_timeline_user_avatars(db, video_uuid)
+        finally:
+            is_consistent = avatar_strip_cache.end_load(video_uuid, generation)
+
+        if is_consistent:
+            avatar_strip_cache.load(video_uuid, users)
 
     data = []
 
@@ -172,79 +624,255 @@ async def get_timeline_user_avatars(db: Database, video_uuid: str):
     return data
 
 
-async def get_video_watch_session_count(db: Database, video_uuid: str) -> int:
-    count = db.timeline_watch_sessions.count_documents({"video_uuid": video_uuid})
-    return count
-
+@timed(mongo_call_duration)
+async def _count_video_watch_sessions(db: AsyncDatabase, video_uuid: str) -> int:
+    return await db.timeline_watch_sessions.count_documents({"video_uuid": video_uuid})
 
-async def get_timeline_status(db: Database, video_uuid: str) -> TimelineStatusResponse:
-    groups = db.timeline_groups.find({"video_uuid": video_uuid})
-    users = db.timeline_watch_sessions.find({"video_uuid": video_uuid}).sort("last_update_time")
 
-    groups_dict = {}
-    for group in groups:
-        group["users"] = []
-        groups_dict[group["group_uuid"]] = group
+async def get_video_watch_session_count(db: AsyncDatabase, video_uuid: str) -> int:
+    count = await viewer_counter.get(video_uuid)
+    if count is not None:
+        return count
 
-    # remove users that are already in groups
-    users_data = []
-    for user in users:
-        if user.get("group_uuid") is not None and user.get("group_uuid") in groups_dict.keys():
-            # if user is the host, add to the beginning of the list
-            is_host = groups_dict[user["group_uuid"]].get("host_uuid") == user.get("user_uuid")
-            if is_host:
-                groups_dict[user["group_uuid"]]["users"].insert(0, user)
-            else:
-                groups_dict[user["group_uuid"]]["users"].append(user)
-        else:
-            users_data.append(user)
-
-    # transform groups_dict to list
-    groups_data = []
-    for group in groups_dict.values():
-        groups_data.append(group)
-
-    response = TimelineStatusResponse(
-        video_uuid=video_uuid,
-        groups=groups_data,
-        users=users_data,
-    )
-    return response
+    # counted once, then kept up to date by the inserts and deletes of watch sessions
+    count = await _count_video_watch_sessions(db, video_uuid)
+    await viewer_counter.init(video_uuid, count)
+    return count
 
 
-def delete_all_timeline_watch_sessions(db: Database) -> int:
-    result = db.timeline_watch_sessions.delete_many({})
-    return result.deleted_count
+@timed(mongo_call_duration)
+async def reconcile_viewer_counts(db: AsyncDatabase) -> None:
+    """Corrects the drift of the viewer counts, e.g. sessions deleted by another node"""
+    counts = await (await db.timeline_watch_sessions.aggregate([
+        {"$group": {"_id": "$video_uuid", "count": {"$sum": 1}}},
+    ])).to_list()
+    await viewer_counter.reconcile({count["_id"]: count["count"] for count in counts})
 
 
-def delete_all_timeline_groups(db: Database) -> int:
-    result = db.timeline_groups.delete_many({})
+@timed(mongo_call_duration)
+async def delete_all_timeline_watch_sessions(db: AsyncDatabase) -> int:
+    result = await db.timeline_watch_sessions.delete_many({})
+    timeline_groups_cache.clear()
+    avatar_strip_cache.clear()
+    await viewer_counter.clear()
+    await room_subscribers.clear()
     return result.deleted_count
 
 
-def delete_all_timeline_chat_messages(db: Database) -> int:
-    result = db.timeline_chat_messages.delete_many({})
+@timed(mongo_call_duration)
+async def delete_all_timeline_groups(db: AsyncDatabase) -> int:
+    result = await db.timeline_groups.delete_many({})
+    timeline_groups_cache.clear()
+    await timeline_groups_versions.clear()
     return result.deleted_count
 
 
-async def insert_timeline_chat_message(db: Database, chat_message: TimelineChatMessage) -> int:
-    result = db.timeline_chat_messages.insert_one(chat_message.model_dump(exclude_none=True))
-    return result
+@timed(mongo_call_duration)
+async def delete_all_timeline_chat_messages(db: AsyncDatabase) -> int:
+    result = await db.timeline_chat_messages.delete_many({})
+    await db.timeline_chat_buckets.delete_many({})
+    chat_history_cache.clear()
+    return result.deleted_count
 
 
-async def get_timeline_chat_messages_by_video_uuid(db: Database, video_uuid: str):
-    messages = db.timeline_chat_messages.find({"video_uuid": video_uuid})
+def _to_mongo_datetime(value: datetime) -> datetime:
+    """Mongo stores naive datetimes with millisecond precision"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+@timed(mongo_call_duration)
+async def insert_timeline_chat_messages(db: AsyncDatabase,
+                                        chat_messages: list[TimelineChatMessage]) -> None:
+    """Writes the messages of a video with a single write, in the given order"""
+    messages = [chat_message.model_dump(exclude_none=True) for chat_message in chat_messages]
+    if CHAT_STORAGE == "buckets":
+        await _push_chat_message_buckets(db, messages)
+    else:
+        await db.timeline_chat_messages.insert_many(messages)
+
+    # cached as they would be read back
+    for message in messages:
+        message.pop("_id", None)
+        message["created_at"] = _to_mongo_datetime(message["created_at"])
+        chat_history_cache.append(message)
+
+
+async def _push_chat_message_buckets(db: AsyncDatabase, messages: list[dict]) -> None:
+    """
+    Appends the messages of a video to its open bucket, a new one is created if there is none.
+
+    A bucket takes the messages that fit in its CHAT_BUCKET_SIZE messages
+    until its first message is CHAT_BUCKET_SPAN seconds old.
+    A chunk that doesn't fit opens a new bucket.
+    """
+    for i in range(0, len(messages), CHAT_BUCKET_SIZE):
+        chunk = messages[i:i + CHAT_BUCKET_SIZE]
+        first_created_at = chunk[0]["created_at"]
+        await db.timeline_chat_buckets.update_one(
+            {
+                "video_uuid": chunk[0]["video_uuid"],
+                "start": {"$gte": first_created_at - timedelta(seconds=CHAT_BUCKET_SPAN)},
+                # never more than CHAT_BUCKET_SIZE messages once the chunk is pushed
+                "count": {"$lte": CHAT_BUCKET_SIZE - len(chunk)},
+            },
+            {
+                "$push": {"messages": {"$each": chunk}},
+                "$inc": {"count": len(chunk)},
+                "$setOnInsert": {"start": first_created_at},
+            },
+            upsert=True,
+        )
+
+
+def _is_before(message: dict, before: tuple[datetime, str]) -> bool:
+    return (message["created_at"], message["id"]) < before
+
+
+@timed(mongo_call_duration)
+async def _find_timeline_chat_messages(db: AsyncDatabase, video_uuid: str, limit: int,
+                                       before: tuple[datetime, str] | None = None) -> list[dict]:
+    """Returns the `limit` latest messages sent before the cursor, oldest first"""
+    if CHAT_STORAGE == "buckets":
+        return await _find_chat_message_buckets(db, video_uuid, limit, before)
+    return await _find_chat_message_documents(db, video_uuid, limit, before)
+
+
+# newest first, the id breaks ties between messages sent in the same millisecond
+_CHAT_MESSAGES_SORT = {"created_at": DESCENDING, "id": DESCENDING}
+
+
+def _chat_messages_filter(video_uuid: str, before: tuple[datetime, str] | None) -> dict:
+    query = {"video_uuid": video_uuid}
+    if before is not None:
+        created_at, message_id = before
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "id": {"$lt": message_id}},
+        ]
+    return query
+
+
+def _chat_buckets_filter(video_uuid: str, before: tuple[datetime, str] | None) -> dict:
+    query = {"video_uuid": video_uuid}
+    if before is not None:
+        query["start"] = {"$lte": before[0]}
+    return query
+
+
+async def _find_chat_message_documents(db: AsyncDatabase, video_uuid: str, limit: int,
+                                       before: tuple[datetime, str] | None = None) -> list[dict]:
+    # the message id is the id field, the Mongo id is never sent
+    messages = await db.timeline_chat_messages.find(
+        _chat_messages_filter(video_uuid, before), {"_id": 0}
+    ).sort(list(_CHAT_MESSAGES_SORT.items())).limit(limit).to_list()
+    messages.reverse()
     return messages
 
 
-def clear_data_on_startup():
-    # remove all transient session data
-    database = get_database()
-
-    # timeline groups and watch sessions
-    delete_all_timeline_groups(database)
-    delete_all_timeline_watch_sessions(database)
-    # delete_all_timeline_chat_messages(database)
+async def _find_chat_message_buckets(db: AsyncDatabase, video_uuid: str, limit: int,
+                                     before: tuple[datetime, str] | None = None) -> list[dict]:
+    messages = []
+    enough = False
+    buckets = db.timeline_chat_buckets.find(
+        _chat_buckets_filter(video_uuid, before), {"_id": 0, "messages": 1}
+    ).sort(
+        "start", DESCENDING
+    )
+    async for bucket in buckets:
+        bucket_messages = bucket["messages"]
+        if before is not None:
+            bucket_messages = [message for message in bucket_messages if _is_before(message, before)]
+        messages.extend(bucket_messages)
+
+        # nodes writing at the same time can open two buckets,
+        # the bucket after the one completing the page may still hold newer messages
+        if enough:
+            break
+        enough = len(messages) >= limit
+
+    messages.sort(key=lambda message: (message["created_at"], message["id"]))
+    return messages[-limit:]
+
+
+async def backfill_timeline_chat_buckets(db: AsyncDatabase, batch_size: int = 100) -> int:
+    """
+    Copies the messages of `timeline_chat_messages` into buckets, video by video.
+    The existing buckets of a video are replaced. Returns the number of messages copied.
+    """
+    copied = 0
+    for video_uuid in await db.timeline_chat_messages.distinct("video_uuid"):
+        await db.timeline_chat_buckets.delete_many({"video_uuid": video_uuid})
+
+        buckets = []
+        messages = db.timeline_chat_messages.find({"video_uuid": video_uuid}, {"_id": 0}).sort(
+            [("created_at", ASCENDING), ("id", ASCENDING)]
+        )
+        async for message in messages:
+            bucket = buckets[-1] if buckets else None
+            if bucket is None or bucket["count"] >= CHAT_BUCKET_SIZE or \
+                    message["created_at"] - bucket["start"] > timedelta(seconds=CHAT_BUCKET_SPAN):
+                if len(buckets) >= batch_size:
+                    # the buckets read so far are complete
+                    await db.timeline_chat_buckets.insert_many(buckets)
+                    buckets = []
+                bucket = {
+                    "video_uuid": video_uuid,
+                    "start": message["created_at"],
+                    "count": 0,
+                    "messages": [],
+                }
+                buckets.append(bucket)
+
+            bucket["messages"].append(message)
+            bucket["count"] += 1
+            copied += 1
+
+        if buckets:
+            await db.timeline_chat_buckets.insert_many(buckets)
+
+    return copied
+
+
+async def get_timeline_chat_messages_by_video_uuid(
+        db: AsyncDatabase,
+        video_uuid: str,
+        limit: int = CHAT_HISTORY_PAGE_SIZE,
+        before_created_at: datetime | None = None,
+        before_id: str | None = None,
+) -> tuple[list[dict], bool]:
+    """
+    Returns a page of the chat history, oldest message first, and whether there are older messages.
+    The page holds the `limit` latest messages sent before the (before_created_at, before_id) cursor,
+    or the latest messages if no cursor is given.
+    """
+    before = None
+    # ids are stored as strings, their hex order is the order of the ObjectIds
+    if before_created_at is not None and before_id is not None:
+        before = (_to_mongo_datetime(before_created_at), before_id)
+
+    page = chat_history_cache.get_page(video_uuid, limit, before)
+    if page is not None:
+        return page
+
+    if before is None and limit < chat_history_cache.size:
+        # the latest messages are read once into the cache
+        generation = chat_history_cache.begin_load(video_uuid)
+        try:
+            messages = await _find_timeline_chat_messages(db, video_uuid, chat_history_cache.size)
+        finally:
+            consistent = chat_history_cache.end_load(video_uuid, generation)
+
+        if consistent:
+            chat_history_cache.load(video_uuid, messages)
+        return messages[-limit:], len(messages) > limit
+
+    # one more message is read to know if there are older ones
+    messages = await _find_timeline_chat_messages(db, video_uuid, limit + 1, before)
+    if len(messages) > limit:
+        return messages[1:], True
+    return messages, False
 
 
 class TimelineError(Exception):
@@ -262,7 +890,7 @@ class NoGroupError(TimelineError):
     pass
 
 
-async def get_watch_session_or_fail(db: Database, user_uuid: str) -> TimelineWatchSession:
+async def get_watch_session_or_fail(db: AsyncDatabase, user_uuid: str) -> TimelineWatchSession:
     """Get and validate current watch session"""
     watch_session_data = await get_timeline_watch_session_by_user_uuid(db, user_uuid)
     if not watch_session_data:
@@ -275,7 +903,7 @@ async def get_watch_session_or_fail(db: Database, user_uuid: str) -> TimelineWat
         raise NoWatchSessionError("Invalid watch session data")
 
 
-async def get_group_or_fail(db: Database, group_uuid: str) -> TimelineGroup | None:
+async def get_group_or_fail(db: AsyncDatabase, group_uuid: str) -> TimelineGroup | None:
     """Get and validate current group if it exists"""
     group_data = await get_timeline_group_by_uuid(db, group_uuid)
     if not group_data:
@@ -288,14 +916,15 @@ async def get_group_or_fail(db: Database, group_uuid: str) -> TimelineGroup | No
         raise NoGroupError("Invalid group data")
 
 
-async def get_group_by_participant_uuid(db: Database, user_uuid: str) -> TimelineGroup | None:
-    try:
-        watch_session = await get_watch_session_or_fail(db, user_uuid)
-    except Exception as e:
-        logging.error(f"Error getting watch session: {e}")
+async def get_group_by_participant_uuid(db: AsyncDatabase, user_uuid: str) -> TimelineGroup | None:
+    watch_session = await get_timeline_watch_session_by_user_uuid(
+        db, user_uuid, WatchSessionProjection.MEMBERSHIP
+    )
+    if watch_session is None:
+        logging.error(f"Error getting watch session: no watch session for user {user_uuid}")
         return None
 
-    group_uuid = watch_session.group_uuid
+    group_uuid = watch_session.get("group_uuid")
 
     if not group_uuid:
         return None
@@ -0,0 +1,126 @@
+import redis.asyncio as redis
+
+from fliji_sockets.settings import REDIS_CONNECTION_STRING, VIEWER_COUNTER_BACKEND, \
+    VIEWER_COUNT_RECONCILE_INTERVAL
+
+
+class MemoryViewerCounter:
+    """
+    Number of watch sessions of each video, kept in the memory of this node.
+    Only counts the sessions created and deleted through this node,
+    so it's only exact with a single node, reconcile() corrects the drift.
+    """
+
+    def __init__(self):
+        self._counts: dict[str, int] = {}
+
+    async def get(self, video_uuid: str) -> int | None:
+        """Returns None if the video is not counted yet"""
+        return self._counts.get(video_uuid)
+
+    async def init(self, video_uuid: str, count: int) -> None:
+        """Starts counting a video from the given count, unless it's already counted"""
+        self._counts.setdefault(video_uuid, count)
+
+    async def add(self, video_uuid: str, amount: int) -> None:
+        """Changes the count of a video, does nothing if the video is not counted yet"""
+        if video_uuid in self._counts:
+            self._counts[video_uuid] += amount
+
+    async def reconcile(self, counts: dict[str, int]) -> None:
+        """Replaces every count with the ones counted in Mongo"""
+        self._counts = dict(counts)
+
+    async def clear(self) -> None:
+        self._counts.clear()
+
+    async def close(self) -> None:
+        pass
+
+
+# increments the count only if the video is counted already
+_ADD_IF_EXISTS = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+return nil
+"""
+
+
+class RedisViewerCounter:
+    """
+    Number of watch sessions of each video, shared by all the nodes through Redis.
+
+    The counts expire if reconcile() doesn't refresh them,
+    so the videos nobody watches anymore are dropped.
+    """
+
+    def __init__(self, connection_string: str, key_prefix: str, ttl: int):
+        self._connection_string = connection_string
+        self._key_prefix = key_prefix
+        self._ttl = ttl
+        self._redis: redis.Redis | None = None
+
+    def _client(self) -> redis.Redis:
+        # created on first use, so that it's bound to the event loop using it
+        if self._redis is None:
+            self._redis = redis.from_url(self._connection_string)
+        return self._redis
+
+    def _key(self, video_uuid: str) -> str:
+        return f"{self._key_prefix}{video_uuid}"
+
+    async def get(self, video_uuid: str) -> int | None:
+        """Returns None if the video is not counted yet"""
+        count = await self._client().get(self._key(video_uuid))
+        return int(count) if count is not None else None
+
+    async def init(self, video_uuid: str, count: int) -> None:
+        """Starts counting a video from the given count, unless it's already counted"""
+        await self._client().set(self._key(video_uuid), count, ex=self._ttl, nx=True)
+
+    async def add(self, video_uuid: str, amount: int) -> None:
+        """Changes the count of a video, does nothing if the video is not counted yet"""
+        await self._client().eval(_ADD_IF_EXISTS, 1, self._key(video_uuid), amount)
+
+    async def reconcile(self, counts: dict[str, int]) -> None:
+        """
+        Replaces every count with the ones counted in Mongo.
+        The videos without sessions in Mongo are not counted anymore,
+        a video counted meanwhile is only counted again on its next get().
+        """
+        client = self._client()
+        keys = {self._key(video_uuid): count for video_uuid, count in counts.items()}
+        async with client.pipeline(transaction=False) as pipe:
+            for key, count in keys.items():
+                pipe.set(key, count, ex=self._ttl)
+            async for key in client.scan_iter(match=f"{self._key_prefix}*"):
+                if key.decode() not in keys:
+                    pipe.delete(key)
+            await pipe.execute()
+
+    async def clear(self) -> None:
+        client = self._client()
+        async for key in client.scan_iter(match=f"{self._key_prefix}*"):
+            await client.delete(key)
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+
+def create_viewer_counter(backend: str) -> MemoryViewerCounter | RedisViewerCounter:
+    if backend == "memory":
+        return MemoryViewerCounter()
+    if backend == "redis":
+        # outlives a missed reconciliation
+        return RedisViewerCounter(
+            REDIS_CONNECTION_STRING,
+            "fliji_sockets:viewers:",
+            int(VIEWER_COUNT_RECONCILE_INTERVAL * 3),
+        )
+    raise ValueError(f"Unknown viewer counter backend: {backend}")
+
+
+viewer_counter = create_viewer_counter(VIEWER_COUNTER_BACKEND)
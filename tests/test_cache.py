@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta
+
+from fliji_sockets.cache import TimelineGroupsCache, ChatHistoryCache, AvatarStripCache, \
+    AVATAR_STRIP_SIZE
+
+VIDEO_UUID = "video"
+STARTED = datetime(2024, 1, 1)
+
+
+def make_group(group_uuid: str, users_count: int = 1) -> dict:
+    return {
+        "group_uuid": group_uuid,
+        "video_uuid": VIDEO_UUID,
+        "host_user_uuid": "u0",
+        "users_count": users_count,
+    }
+
+
+def make_watch_session(user_uuid: str, group_uuid: str | None = "g", seconds: int = 0) -> dict:
+    return {
+        "user_uuid": user_uuid,
+        "video_uuid": VIDEO_UUID,
+        "group_uuid": group_uuid,
+        "username": user_uuid,
+        "created_at": STARTED + timedelta(seconds=seconds),
+        "last_update_time": STARTED + timedelta(seconds=seconds),
+    }
+
+
+def make_message(number: int) -> dict:
+    return {
+        "id": f"{number:024x}",
+        "video_uuid": VIDEO_UUID,
+        "message": f"message {number}",
+        "created_at": STARTED + timedelta(seconds=number),
+    }
+
+
+def test_groups_load_without_writes_is_consistent():
+    cache = TimelineGroupsCache(ttl=60)
+
+    generation = cache.begin_load(VIDEO_UUID)
+
+    assert cache.end_load(VIDEO_UUID, generation)
+
+
+def test_groups_load_racing_with_a_write_is_not_consistent():
+    cache = TimelineGroupsCache(ttl=60)
+
+    generation = cache.begin_load(VIDEO_UUID)
+    cache.upsert_watch_session(make_watch_session("u1"))
+
+    assert not cache.end_load(VIDEO_UUID, generation)
+
+
+def test_groups_write_to_another_video_keeps_the_load_consistent():
+    cache = TimelineGroupsCache(ttl=60)
+
+    generation = cache.begin_load(VIDEO_UUID)
+    cache.update_group("other video", "g", {"watch_time": 10})
+
+    assert cache.end_load(VIDEO_UUID, generation)
+
+
+def test_groups_clear_during_a_load_is_not_consistent():
+    cache = TimelineGroupsCache(ttl=60)
+
+    generation = cache.begin_load(VIDEO_UUID)
+    cache.clear()
+
+    assert not cache.end_load(VIDEO_UUID, generation)
+
+
+def test_groups_overlapping_loads_see_the_write_between_them():
+    cache = TimelineGroupsCache(ttl=60)
+
+    first = cache.begin_load(VIDEO_UUID)
+    cache.delete_group(VIDEO_UUID, "g")
+    second = cache.begin_load(VIDEO_UUID)
+
+    assert not cache.end_load(VIDEO_UUID, first)
+    assert cache.end_load(VIDEO_UUID, second)
+
+
+def test_groups_writes_are_applied_to_the_loaded_video():
+    cache = TimelineGroupsCache(ttl=60)
+    cache.load(VIDEO_UUID, [make_group("g")], [make_watch_session("u0")])
+
+    cache.update_group(VIDEO_UUID, "g", {"watch_time": 10, "users_count": 2})
+    cache.upsert_watch_session(make_watch_session("u1", seconds=1))
+
+    [group] = cache.get_response(VIDEO_UUID).root
+    assert group.watch_time == 10
+    assert [user.user_uuid for user in group.users] == ["u0", "u1"]
+    assert [user.is_host for user in group.users] == [True, False]
+
+
+def test_chat_load_racing_with_a_message_is_not_consistent():
+    cache = ChatHistoryCache(size=10, ttl=60)
+
+    generation = cache.begin_load(VIDEO_UUID)
+    cache.append(make_message(1))
+
+    assert not cache.end_load(VIDEO_UUID, generation)
+
+
+def test_chat_load_without_messages_is_consistent():
+    cache = ChatHistoryCache(size=10, ttl=60)
+
+    generation = cache.begin_load(VIDEO_UUID)
+
+    assert cache.end_load(VIDEO_UUID, generation)
+
+
+def test_chat_page_of_a_complete_video():
+    cache = ChatHistoryCache(size=10, ttl=60)
+    cache.load(VIDEO_UUID, [make_message(number) for number in range(5)])
+    cache.append(make_message(5))
+
+    messages, has_more = cache.get_page(VIDEO_UUID, 3)
+    assert [message["message"] for message in messages] == ["message 3", "message 4", "message 5"]
+    assert has_more
+
+    before = (messages[0]["created_at"], messages[0]["id"])
+    messages, has_more = cache.get_page(VIDEO_UUID, 3, before)
+    assert [message["message"] for message in messages] == ["message 0", "message 1", "message 2"]
+    assert not has_more
+
+
+def test_chat_page_beyond_the_buffer_is_not_served():
+    cache = ChatHistoryCache(size=3, ttl=60)
+    cache.load(VIDEO_UUID, [make_message(number) for number in range(3)])
+
+    assert cache.get_page(VIDEO_UUID, 5) is None
+
+
+def test_avatars_load_racing_with_a_new_session_is_not_consistent():
+    cache = AvatarStripCache(ttl=60)
+
+    generation = cache.begin_load(VIDEO_UUID)
+    cache.add(make_watch_session("u1"))
+
+    assert not cache.end_load(VIDEO_UUID, generation)
+
+
+def test_avatars_load_racing_with_a_deleted_session_is_not_consistent():
+    cache = AvatarStripCache(ttl=60)
+
+    generation = cache.begin_load(VIDEO_UUID)
+    cache.remove(VIDEO_UUID, "u1")
+
+    assert not cache.end_load(VIDEO_UUID, generation)
+
+
+def test_avatars_full_strip_losing_a_viewer_is_read_again():
+    cache = AvatarStripCache(ttl=60)
+    sessions = [make_watch_session(f"u{i}", seconds=i) for i in range(AVATAR_STRIP_SIZE + 1)]
+    cache.load(VIDEO_UUID, sessions)
+
+    cache.remove(VIDEO_UUID, "u0")
+
+    assert cache.get(VIDEO_UUID) is None
+
+
+def test_avatars_strip_with_room_is_kept_up_to_date():
+    cache = AvatarStripCache(ttl=60)
+    cache.load(VIDEO_UUID, [make_watch_session("u1", seconds=1)])
+
+    cache.add(make_watch_session("u0", seconds=0))
+    cache.remove(VIDEO_UUID, "u1")
+
+    assert [avatar["user_uuid"] for avatar in cache.get(VIDEO_UUID)] == ["u0"]
@@ -0,0 +1,168 @@
+import asyncio
+
+import pytest
+
+from fliji_sockets.core.di import DIContainer, Context, Scope
+
+
+def get_context() -> Context:
+    return Context(sid="sid", app=None)
+
+
+def test_cycle_is_rejected():
+    container = DIContainer()
+    container.register("a", lambda: "a", requires=("b",))
+
+    with pytest.raises(TypeError, match="Dependency cycle: b -> a -> b"):
+        container.register("b", lambda: "b", requires=("a",))
+
+    with pytest.raises(KeyError):
+        asyncio.run(container.get("b"))
+
+
+def test_rejected_cycle_keeps_the_previous_factory():
+    container = DIContainer()
+    container.register("a", lambda: "a", requires=("b",))
+    container.register("b", lambda: "b")
+
+    with pytest.raises(TypeError):
+        container.register("b", lambda: "other b", requires=("a",))
+
+    assert asyncio.run(container.get("a")) == "a"
+    assert asyncio.run(container.get("b")) == "b"
+
+
+def test_self_requirement_is_rejected():
+    container = DIContainer()
+
+    with pytest.raises(TypeError, match="Dependency cycle: a -> a"):
+        container.register("a", lambda: "a", requires=("a",))
+
+
+def test_independent_dependencies_are_resolved_concurrently():
+    container = DIContainer()
+    running = []
+    overlapped = []
+
+    def make_factory(key: str):
+        async def factory() -> str:
+            running.append(key)
+            await asyncio.sleep(0)
+            overlapped.append(len(running) == 2)
+            return key
+
+        return factory
+
+    container.register("a", make_factory("a"), Scope.TRANSIENT)
+    container.register("b", make_factory("b"), Scope.TRANSIENT)
+
+    assert asyncio.run(container.resolve_many(["a", "b"], get_context())) == ["a", "b"]
+    assert overlapped == [True, True]
+
+
+def test_failed_dependency_is_returned_as_its_exception():
+    container = DIContainer()
+
+    async def fail() -> str:
+        raise ValueError("no database")
+
+    container.register("ok", lambda: "ok", Scope.TRANSIENT)
+    container.register("failing", fail, Scope.TRANSIENT)
+
+    ok, failing = asyncio.run(container.resolve_many(["ok", "failing"], get_context()))
+
+    assert ok == "ok"
+    assert isinstance(failing, ValueError)
+
+
+def test_required_dependency_is_created_once_for_concurrent_requests():
+    container = DIContainer()
+    created = []
+
+    async def get_session(context: Context) -> str:
+        created.append(context.sid)
+        await asyncio.sleep(0)
+        return "session"
+
+    container.register("session", get_session, Scope.REQUEST)
+    container.register("user", lambda: "user", Scope.REQUEST, requires=("session",))
+    container.register("group", lambda: "group", Scope.REQUEST, requires=("session",))
+
+    resolved = asyncio.run(container.resolve_many(["session", "user", "group"], get_context()))
+
+    assert resolved == ["session", "user", "group"]
+    assert created == ["sid"]
+
+
+def test_singleton_is_created_once():
+    container = DIContainer()
+    created = []
+    container.register("db", lambda: created.append("db") or object())
+
+    first = asyncio.run(container.get("db", get_context()))
+    second = asyncio.run(container.get("db", get_context()))
+
+    assert first is second
+    assert created == ["db"]
+
+
+def test_request_dependency_is_created_once_per_event():
+    container = DIContainer()
+    container.register("session", lambda: object(), Scope.REQUEST)
+    first_event = get_context()
+    second_event = get_context()
+
+    async def resolve(context: Context):
+        return await container.get("session", context), await container.get("session", context)
+
+    first, same_event = asyncio.run(resolve(first_event))
+    second, _ = asyncio.run(resolve(second_event))
+
+    assert first is same_event
+    assert first is not second
+
+
+def test_transient_dependency_is_created_every_time():
+    container = DIContainer()
+    container.register("publisher", lambda: object(), Scope.TRANSIENT)
+    context = get_context()
+
+    first = asyncio.run(container.get("publisher", context))
+    second = asyncio.run(container.get("publisher", context))
+
+    assert first is not second
+
+
+def test_factory_gets_the_context():
+    container = DIContainer()
+
+    def get_sid(context: Context) -> str:
+        return context.sid
+
+    container.register("sid", get_sid, Scope.REQUEST)
+
+    assert asyncio.run(container.get("sid", get_context())) == "sid"
+
+
+def test_factory_with_other_arguments_is_rejected():
+    container = DIContainer()
+
+    with pytest.raises(TypeError):
+        container.register("a", lambda sid: sid)
+
+
+def test_failed_singleton_is_created_again():
+    container = DIContainer()
+    attempts = []
+
+    async def connect() -> str:
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise ConnectionError("unreachable")
+        return "connected"
+
+    container.register("nats", connect)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(container.get("nats"))
+    assert asyncio.run(container.get("nats")) == "connected"
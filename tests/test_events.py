@@ -0,0 +1,102 @@
+import asyncio
+from datetime import datetime
+from typing import Any
+
+import pytest
+
+from fliji_sockets import chat_pipeline as chat_pipeline_module
+from fliji_sockets.chat_pipeline import chat_pipeline
+from fliji_sockets.core import socketio_application
+from fliji_sockets.core.di import DIContainer, Context, Scope
+from fliji_sockets.core.rate_limit import RateLimiter
+from fliji_sockets.core.socketio_application import SocketioApplication
+from fliji_sockets.events.handlers import timeline_send_chat_message
+from fliji_sockets.helpers import get_room_name
+from fliji_sockets.models.base import UserSioSession
+from fliji_sockets.models.database import TimelineWatchSession
+
+SID = "sid"
+VIDEO_UUID = "9d2b6a97-d054-4c68-96ed-af0cb82b97db"
+SESSION = UserSioSession(user_uuid="f4a1d9a4-7f0e-4b8b-9a52-3b1f6b2b7c1e", username="username")
+WATCH_SESSION = TimelineWatchSession(
+    user_uuid=SESSION.user_uuid,
+    created_at=datetime(2024, 1, 1),
+    sid=SID,
+    video_uuid=VIDEO_UUID,
+    last_update_time=datetime(2024, 1, 1),
+    mic_enabled=False,
+    username=SESSION.username,
+)
+
+
+class Application(SocketioApplication):
+    """Keeps the emits and the errors instead of sending them"""
+
+    def __init__(self):
+        super().__init__()
+        self._rate_limiter = RateLimiter({})
+        self.emitted = []
+        self.errors = []
+
+    async def get_session(self, sid) -> UserSioSession:
+        return SESSION
+
+    async def emit(self, event: str, data: Any, room: str | None = None,
+                   skip_sid: str | None = None) -> None:
+        self.emitted.append((event, data, room))
+
+    async def send_error_message(self, sid: str, message: str, body: Any = None) -> None:
+        self.errors.append((sid, message))
+
+    async def send_fatal_error_message(self, sid: str, message: str, body: Any = None) -> None:
+        self.errors.append((sid, message))
+
+
+@pytest.fixture
+def container(monkeypatch):
+    container = DIContainer()
+    monkeypatch.setattr(socketio_application, "container", container)
+    return container
+
+
+@pytest.fixture
+def inserted(monkeypatch):
+    inserted = []
+
+    async def insert_timeline_chat_messages(db, chat_messages):
+        inserted.extend(chat_messages)
+
+    monkeypatch.setattr(
+        chat_pipeline_module, "insert_timeline_chat_messages", insert_timeline_chat_messages
+    )
+    return inserted
+
+
+def test_send_chat_message(container, inserted):
+    db = object()
+
+    async def get_timeline_session(context: Context) -> TimelineWatchSession:
+        return WATCH_SESSION
+
+    container.register("db", lambda: db)
+    container.register("timeline_session", get_timeline_session, Scope.REQUEST)
+
+    async def send():
+        app = Application()
+        app.event("timeline_send_chat_message")(timeline_send_chat_message)
+        handler = app.sio.handlers["/"]["timeline_send_chat_message"]
+
+        await handler(SID, {"message": "hello"})
+        await chat_pipeline.flush()
+        return app
+
+    app = asyncio.run(send())
+
+    assert app.errors == []
+    assert [chat_message.message for chat_message in inserted] == ["hello"]
+    assert len(app.emitted) == 1
+    event, data, room = app.emitted[0]
+    assert event == "timeline_chat_message"
+    assert data["message"] == "hello"
+    assert data["user_uuid"] == SESSION.user_uuid
+    assert room == get_room_name(VIDEO_UUID)
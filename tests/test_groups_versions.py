@@ -0,0 +1,143 @@
+import asyncio
+import json
+
+import pytest
+
+from fliji_sockets import groups_versions
+from fliji_sockets.groups_versions import MemoryGroupsVersions, _diff_groups
+from fliji_sockets.models.socket import TimelineGroupResponse, TimelineGroupDataResponse, \
+    TimelineUserDataResponse
+
+VIDEO_UUID = "video"
+
+
+def make_user(user_uuid: str, mic_enabled: bool = False) -> TimelineUserDataResponse:
+    return TimelineUserDataResponse(user_uuid=user_uuid, username=user_uuid, mic_enabled=mic_enabled)
+
+
+def make_group(group_uuid: str, users: list[TimelineUserDataResponse],
+               watch_time: int = 0) -> TimelineGroupDataResponse:
+    return TimelineGroupDataResponse(
+        group_uuid=group_uuid,
+        host_user_uuid=users[0].user_uuid,
+        users_count=len(users),
+        watch_time=watch_time,
+        users=users,
+    )
+
+
+def make_response(*groups: TimelineGroupDataResponse) -> TimelineGroupResponse:
+    return TimelineGroupResponse(root=list(groups))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(groups_versions.time, "monotonic", lambda: clock[0])
+    return clock
+
+
+def test_diff_of_unchanged_groups_is_none():
+    group = make_group("a", [make_user("u1")])
+
+    assert _diff_groups(VIDEO_UUID, 1, 2, {"a": group}, {"a": group.model_copy()}) is None
+
+
+def test_diff_lists_added_changed_and_removed_groups():
+    kept = make_group("kept", [make_user("u1")])
+    changed = make_group("changed", [make_user("u2"), make_user("u3")])
+    removed = make_group("removed", [make_user("u4")])
+    added = make_group("added", [make_user("u5")])
+    changed_after = make_group("changed", [make_user("u2", mic_enabled=True), make_user("u6")],
+                               watch_time=30)
+
+    delta = _diff_groups(
+        VIDEO_UUID, 1, 2,
+        {"kept": kept, "changed": changed, "removed": removed},
+        {"kept": kept, "changed": changed_after, "added": added},
+    )
+
+    assert (delta.base_version, delta.version) == (1, 2)
+    assert delta.added == [added]
+    assert delta.removed == ["removed"]
+    [group_change] = delta.changed
+    assert group_change.group_uuid == "changed"
+    assert group_change.watch_time == 30
+    assert [user.user_uuid for user in group_change.added_users] == ["u6"]
+    assert [user.user_uuid for user in group_change.changed_users] == ["u2"]
+    assert group_change.removed_users == ["u3"]
+
+
+def test_versions_form_a_chain():
+    versions = MemoryGroupsVersions(ttl=60)
+    first = make_group("a", [make_user("u1")])
+    second = make_group("a", [make_user("u1"), make_user("u2")])
+
+    async def broadcast():
+        return [
+            await versions.diff(VIDEO_UUID, make_response(first)),
+            await versions.diff(VIDEO_UUID, make_response(first)),
+            await versions.diff(VIDEO_UUID, make_response(second)),
+            await versions.diff(VIDEO_UUID, make_response()),
+        ]
+
+    added, unchanged, changed, removed = asyncio.run(broadcast())
+
+    assert (added.base_version, added.version) == (0, 1)
+    assert unchanged is None
+    assert (changed.base_version, changed.version) == (1, 2)
+    assert (removed.base_version, removed.version) == (2, 3)
+    assert removed.removed == ["a"]
+
+
+def test_versions_are_shared_by_the_videos():
+    versions = MemoryGroupsVersions(ttl=60)
+    group = make_group("a", [make_user("u1")])
+
+    async def broadcast():
+        return [
+            await versions.diff("first", make_response(group)),
+            await versions.diff("second", make_response(group)),
+        ]
+
+    first, second = asyncio.run(broadcast())
+
+    assert (first.base_version, first.version) == (0, 1)
+    assert (second.base_version, second.version) == (0, 2)
+
+
+def test_snapshot_is_the_base_of_the_next_delta():
+    versions = MemoryGroupsVersions(ttl=60)
+    group = make_group("a", [make_user("u1")])
+
+    async def snapshot():
+        await versions.diff(VIDEO_UUID, make_response(group))
+        # the given response is ignored once a version was broadcast
+        return await versions.encoded_snapshot(VIDEO_UUID, make_response())
+
+    payload = json.loads(asyncio.run(snapshot()).data)
+
+    assert payload["version"] == 1
+    assert [group["group_uuid"] for group in payload["groups"]] == ["a"]
+
+
+def test_idle_video_is_expired(clock):
+    versions = MemoryGroupsVersions(ttl=60)
+    group = make_group("a", [make_user("u1")])
+    other_group = make_group("b", [make_user("u2")])
+
+    async def broadcast():
+        await versions.diff(VIDEO_UUID, make_response(group))
+        clock[0] += 30
+        await versions.diff("other", make_response(other_group))
+        clock[0] += 31
+        return await versions.diff("other", make_response())
+
+    removed = asyncio.run(broadcast())
+
+    assert list(versions._versions) == ["other"]
+    assert (removed.base_version, removed.version) == (2, 3)
+
+    # the clients of the expired video resync from version 0
+    resent = asyncio.run(versions.diff(VIDEO_UUID, make_response(group)))
+    assert (resent.base_version, resent.version) == (0, 4)
@@ -0,0 +1,75 @@
+import pytest
+
+from fliji_sockets.core import rate_limit
+from fliji_sockets.core.rate_limit import TokenBucket, RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: clock[0])
+    return clock
+
+
+def test_bucket_allows_a_burst():
+    bucket = TokenBucket(rate=1, burst=3, now=0)
+
+    assert [bucket.take(0) for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2, burst=1, now=0)
+    assert bucket.take(0)
+    assert not bucket.take(0.25)
+
+    assert bucket.take(0.5)
+
+
+def test_bucket_refills_up_to_its_burst():
+    bucket = TokenBucket(rate=10, burst=2, now=0)
+
+    assert [bucket.take(60) for _ in range(3)] == [True, True, False]
+
+
+def test_bucket_wait_time():
+    bucket = TokenBucket(rate=4, burst=1, now=0)
+    assert bucket.wait_time(0) == 0
+    bucket.take(0)
+
+    assert bucket.wait_time(0) == pytest.approx(0.25)
+    assert bucket.wait_time(0.1) == pytest.approx(0.15)
+
+
+def test_limiter_allows_events_without_limit(clock):
+    limiter = RateLimiter({"timeline_update_timecode": (1, 1)})
+
+    assert all(limiter.allow("sid", "ping") for _ in range(100))
+    assert limiter.wait_time("sid", "ping") == 0
+
+
+def test_limiter_limits_each_client_and_event(clock):
+    limiter = RateLimiter({"a": (1, 1), "b": (1, 1)})
+
+    assert limiter.allow("sid", "a")
+    assert not limiter.allow("sid", "a")
+    assert limiter.allow("sid", "b")
+    assert limiter.allow("other sid", "a")
+
+    clock[0] += 1
+    assert limiter.allow("sid", "a")
+
+
+def test_limiter_wait_time(clock):
+    limiter = RateLimiter({"a": (2, 1)})
+    limiter.allow("sid", "a")
+
+    assert limiter.wait_time("sid", "a") == pytest.approx(0.5)
+
+
+def test_forgotten_client_starts_with_a_full_bucket(clock):
+    limiter = RateLimiter({"a": (1, 1)})
+    limiter.allow("sid", "a")
+
+    limiter.forget("sid")
+
+    assert limiter.allow("sid", "a")
@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from pymongo import AsyncMongoClient
+from pymongo.errors import PyMongoError
+
+from fliji_sockets.settings import MONGO_USER, MONGO_PASSWORD, MONGO_HOST, MONGO_PORT, MONGO_DB
+from fliji_sockets.store import ensure_indexes, find_collection_scans
+
+
+async def check_collection_scans() -> list[str] | None:
+    """Returns None if Mongo can't be reached"""
+    client = AsyncMongoClient(
+        f"mongodb://{MONGO_USER}:{MONGO_PASSWORD}@{MONGO_HOST}:{MONGO_PORT}",
+        serverSelectionTimeoutMS=2000,
+    )
+    try:
+        await client.admin.command("ping")
+    except PyMongoError:
+        await client.close()
+        return None
+
+    db = client[f"{MONGO_DB}_test"]
+    try:
+        await ensure_indexes(db)
+        # the aggregations are explained on a group of the database
+        await db.timeline_groups.insert_one({
+            "group_uuid": "group",
+            "video_uuid": "video",
+            "host_user_uuid": "user",
+            "users_count": 1,
+        })
+        await db.timeline_watch_sessions.insert_one({
+            "user_uuid": "user",
+            "video_uuid": "video",
+            "group_uuid": "group",
+            "sid": "sid",
+            "created_at": datetime(2024, 1, 1),
+            "last_update_time": datetime(2024, 1, 1),
+            "mic_enabled": False,
+        })
+        return await find_collection_scans(db)
+    finally:
+        await client.drop_database(db.name)
+        await client.close()
+
+
+def test_no_collection_scans():
+    collection_scans = asyncio.run(check_collection_scans())
+    if collection_scans is None:
+        pytest.skip("Mongo is unreachable")
+
+    assert collection_scans == []